@@ -0,0 +1,591 @@
+"""Benchmarks for fixing relations directions
+
+Run all benchmarks:
+    python Tests/benchmark_fixdirections.py
+Run some of them by name:
+    python Tests/benchmark_fixdirections.py stream_cursor
+"""
+import os,sys
+PROJECT_ROOT = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir)
+)
+sys.path.append(PROJECT_ROOT)
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from fixcypher_stream_method.cypher_parser_streammethod import CypherParser
+from fixcypher_stream_method.cypher_tokenizer import CypherTokenizer
+from Tests.stringio_cypher_parser import StringIOCypherParser
+from Tests.dataset import read_dataset_file
+from fixcypher_stream_method import fixdirections_streammethod
+import asyncio
+import copy
+import random
+import shutil
+import tempfile
+import tracemalloc
+from core.core_classes import ResultCache, SchemaCache, SchemaParser, SchemaIndex, Schema, Node, NodeFlag, Relation, Triple, DirectionFlag
+from core.schema_rules import SchemaRules
+from core.persistent_cache import PersistentResultCache
+from core import fixer as fixer_module
+from fixcypher_ast_method import fixdirections_astmethod
+from fixcypher_ast_method.regex_lexer import RegexLexer
+from parse_antlr_to_cypher.FixRelationsDirectionsLexer import FixRelationsDirectionsLexer
+from antlr4 import InputStream, Token
+
+def read_test_dataset_rows():
+    """ Reads (statement, schema, correct_query) rows from the examples dataset"""
+    return [(row['statement'], row['schema'], row['correct_query']) for row in read_dataset_file()]
+
+def generated_query(size):
+    """ Builds a query of about size characters by chaining the dataset statements"""
+    statements = [row[0] for row in read_test_dataset_rows()]
+    parts = []
+    length = 0
+    while length < size:
+        for statement in statements:
+            parts.append(statement)
+            length += len(statement) + 1
+            if length >= size:
+                break
+    return "\n".join(parts)
+
+def generated_pattern_query(size):
+    """ Builds a query of about size characters of long patterns with long names"""
+    pattern = ("MATCH (employee_of_the_month:Person:Employee)"
+               "-[worked_at_relation:`WORKS AT`|!PREVIOUSLY_WORKED_AT *1..3]->"
+               "(organization_name:Organization:Company)<-[:OWNS]-(owner_of_company:Person)\n")
+    return pattern * max(1, size // len(pattern))
+
+def generated_unicode_query(size):
+    """ Builds a query of about size characters of patterns with non-ASCII names"""
+    pattern = ("MATCH (ångström_värde:Förening:Organisation)-[arbetar_på:ARBETAR_PÅ]->"
+               "(företagets_namn:Företag)<-[:ÄGER]-(`ägare av bolag`:Person)\n")
+    return pattern * max(1, size // len(pattern))
+
+def generated_where_query(size):
+    """ Builds a query of about size characters with one pattern and a long where clause"""
+    condition = "toLower(p.name) <> toLower(o.name) AND p.age > 18"
+    conditions = " AND ".join([condition] * max(1, size // (len(condition) + 5)))
+    return f"MATCH (p:Person)-[:KNOWS]->(o:Person) WHERE {conditions} RETURN p, count(*)"
+
+def generated_property_queries(size):
+    """ Builds queries with one property value of about size characters, and one with many properties"""
+    value = ('{"name": "Foo", "tags": [1, 2, 3], "text": "a \\\\" quoted"} ' * (size // 50 + 1))[:size]
+    properties = ", ".join(f"p{i}: 'v{i}'" for i in range(size // 12))
+    return (
+        ("single", "MATCH (n:Node {data: '" + value.replace("'", "") + "'})-[:R]->(m:Other) RETURN n"),
+        ("escaped", 'MATCH (n:Node {data: "' + value.replace('"', '\\"') + '"})-[:R]->(m:Other) RETURN n'),
+        ("many", "MATCH (n:Node {" + properties + "})-[:R]->(m:Other) RETURN n"),
+    )
+
+def generated_schemas_and_triples(schema_count, triple_count, seed=1):
+    """ Builds a large schema and triples with labels and types from it"""
+    rng = random.Random(seed)
+    labels = [f"Label{number}" for number in range(max(2, schema_count // 10))]
+    types = [f"TYPE_{number}" for number in range(max(2, schema_count // 5))]
+    schemas = [Schema(rng.choice(labels), rng.choice(types), rng.choice(labels)) for _ in range(schema_count)]
+
+    directions = (DirectionFlag.SOURCE_TO_DESTINATION, DirectionFlag.DESTINATION_TO_SOURCE, DirectionFlag.UNDIRECTED)
+    triples = []
+    for _ in range(triple_count):
+        relation = Relation()
+        relation.types = rng.sample(types, rng.choice((0, 1, 2)))
+        relation.negative_types = []
+        relation.variable_length = False
+        triple = Triple(Node("a", rng.sample(labels, rng.choice((0, 1, 1, 2))), NodeFlag.NODE_FOUND),
+                        relation,
+                        Node("b", rng.sample(labels, rng.choice((0, 1, 1, 2))), NodeFlag.NODE_FOUND))
+        triple.direction = rng.choice(directions)
+        triples.append(triple)
+    return schemas, triples
+
+def generated_flip_query(flips):
+    """ Builds a query where every relation arrow has the wrong direction for FLIP_SCHEMA"""
+    pattern = "MATCH (p:Person {name: 'Tom'})<-[:WORKS_AT]-(o:Organization)-[:OWNS]->(c:Company) RETURN p, o\n"
+    return pattern * max(1, flips // 2)
+
+FLIP_SCHEMA = "(Person, WORKS_AT, Organization), (Company, OWNS, Organization)"
+
+def best_of(function, number, repeat=5):
+    """ Best time in seconds for one call of function"""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+def p(text=""):
+    print(text)
+
+#----------------------------------------------------------------
+# Benchmarks
+#----------------------------------------------------------------
+def benchmark_stream_cursor():
+    """ Characters per second for the StringIO reader and the index cursor"""
+    p("Stream parser: StringIO reader vs index cursor")
+    for size in (1_000, 10_000, 100_000):
+        cypher = generated_query(size)
+        number = max(1, 200_000 // size)
+        for name, parser in (("StringIO", StringIOCypherParser()), ("cursor", CypherParser())):
+            seconds = best_of(lambda: parser.find_and_prepare_all_triples(cypher), number)
+            p(f"  {len(cypher):>8} chars  {name:<10} {len(cypher) / seconds:>14,.0f} chars/s")
+
+def benchmark_stream_tokenizer():
+    """ Characters per second for character by character scanning and the regex tokenizer"""
+    p("Stream parser: character scanning vs regex tokenizer")
+    for query_name, cypher in (("examples", generated_query(100_000)), ("patterns", generated_pattern_query(100_000))):
+        for name, tokenizer in (("character", None), ("regex", CypherTokenizer())):
+            parser = CypherParser(tokenizer=tokenizer)
+            seconds = best_of(lambda: parser.find_and_prepare_all_triples(cypher), 2)
+            p(f"  {query_name:<9} {len(cypher):>8} chars  {name:<10} {len(cypher) / seconds:>14,.0f} chars/s")
+
+def benchmark_stream_arrow_anchored():
+    """ Parsing the whole cypher vs only around the arrows"""
+    p("Stream parser: whole cypher vs arrow anchored")
+    for query_name, cypher in (("examples", generated_query(100_000)), ("where", generated_where_query(100_000))):
+        for name, arrow_anchored in (("whole", False), ("anchored", True)):
+            parser = CypherParser(arrow_anchored=arrow_anchored)
+            seconds = best_of(lambda: parser.find_and_prepare_all_triples(cypher), 2)
+            p(f"  {query_name:<9} {len(cypher):>8} chars  {name:<10} {seconds * 1000:>10.2f} ms")
+
+def benchmark_stream_property_values():
+    """ Skipping long strings and property maps"""
+    p("Stream parser: 100 KB property values")
+    for query_name, cypher in generated_property_queries(100_000):
+        parser = CypherParser()
+        seconds = best_of(lambda: parser.find_and_prepare_all_triples(cypher), 5)
+        p(f"  {query_name:<9} {len(cypher):>8} chars  {seconds * 1000:>10.2f} ms")
+
+def benchmark_stream_identifiers():
+    """ Identifier scanning on name heavy queries, and classifying single characters"""
+    p("Stream parser: identifier heavy queries")
+    for query_name, cypher in (("patterns", generated_pattern_query(100_000)), ("unicode", generated_unicode_query(100_000))):
+        parser = CypherParser()
+        seconds = best_of(lambda: parser.find_and_prepare_all_triples(cypher), 2)
+        p(f"  {query_name:<9} {len(cypher):>8} chars  {len(cypher) / seconds:>14,.0f} chars/s")
+
+    p("Scanning names: str methods per character vs lookup table vs word regex")
+    table = CypherParser.ASCII_VARIABLE_CHARACTERS
+    last_ascii_character = CypherParser.LAST_ASCII_CHARACTER
+    for query_name, cypher in (("patterns", generated_pattern_query(2_000)), ("unicode", generated_unicode_query(2_000))):
+        parser = CypherParser(cypher)
+        starts = [offset for offset in range(1, len(cypher))
+                  if parser.is_valid_start_variable_character(cypher[offset])
+                  and not parser.is_valid_variable_character(cypher[offset - 1])]
+
+        def scan_str(offset):
+            while offset < len(cypher):
+                char = cypher[offset]
+                if not (char.isalpha() or char.isdigit() or char == "_"):
+                    break
+                offset += 1
+            return offset
+
+        def scan_table(offset):
+            while offset < len(cypher):
+                char = cypher[offset]
+                if char not in table and (char <= last_ascii_character or not (char.isalpha() or char.isdigit())):
+                    break
+                offset += 1
+            return offset
+
+        for name, scan in (("str", scan_str), ("table", scan_table), ("regex", parser.find_end_of_variable)):
+            seconds = best_of(lambda: [scan(offset) for offset in starts], 20)
+            p(f"  {query_name:<9} {name:<9} {len(starts) / seconds:>14,.0f} names/s")
+def benchmark_fixer_per_call():
+    """ Per call time for short queries, new objects for every call vs a reused Fixer"""
+    p("Fix directions: static function vs reused Fixer, short dataset queries")
+    rows = read_test_dataset_rows()
+    for engine_name, engine in (("stream", fixdirections_streammethod), ("ast", fixdirections_astmethod)):
+        fixers = {schema: engine.Fixer(schema) for _, schema, _ in rows}
+        calls = (
+            ("static", lambda: [engine.FixDirections.fix_cypher_relations_directions(statement, schema)
+                                for statement, schema, _ in rows]),
+            ("Fixer", lambda: [fixers[schema].fix(statement) for statement, schema, _ in rows]),
+        )
+        for name, call in calls:
+            seconds = best_of(call, 5) / len(rows)
+            p(f"  {engine_name:<9} {name:<9} {seconds * 1_000_000:>10.1f} us/query")
+
+def benchmark_schema_cache():
+    """ Extracting the dataset schemas on every call vs the schema cache"""
+    p("Schemas: extract on every call vs schema cache")
+    schemas = [schema for _, schema, _ in read_test_dataset_rows()]
+    schema_parser = SchemaParser()
+    cache = SchemaCache()
+    for name, get_schemas in (("extract", schema_parser.extract_schemas), ("cache", cache.get_schemas)):
+        seconds = best_of(lambda: [get_schemas(schema) for schema in schemas], 20) / len(schemas)
+        p(f"  {name:<9} {seconds * 1_000_000:>10.2f} us/schema")
+    p(f"  cache hits {cache.hits} misses {cache.misses}")
+
+def benchmark_schema_rules():
+    """ Validating triples against large schemas, indexing the schema list per triple vs a compiled index"""
+    p("Schema rules: schema list vs compiled schema index")
+    for schema_count in (10, 100, 1_000, 5_000):
+        schemas, triples = generated_schemas_and_triples(schema_count, 200)
+        schema_index = SchemaIndex(schemas)
+        for name, schemas_argument in (("list", schemas), ("index", schema_index)):
+            triples_copy = copy.deepcopy(triples)
+            def validate():
+                for triple in triples_copy:
+                    SchemaRules.validate_direction_change(triple, schemas_argument)
+            seconds = best_of(validate, 1) / len(triples)
+            p(f"  {schema_count:>6} schemas  {name:<9} {seconds * 1_000_000:>10.1f} us/triple")
+
+def benchmark_fused_rules():
+    """ Validating triples with the rules one by one vs the fused evaluator"""
+    p("Schema rules: rules one by one vs fused evaluator")
+    for schema_count in (10, 100, 1_000):
+        schemas, triples = generated_schemas_and_triples(schema_count, 500)
+        schema_index = SchemaIndex(schemas)
+        for name, evaluate in (("rules", SchemaRules.validate_direction_change), ("fused", SchemaRules.evaluate_direction_change)):
+            triples_copy = copy.deepcopy(triples)
+            def validate():
+                for triple in triples_copy:
+                    evaluate(triple, schema_index)
+            seconds = best_of(validate, 1) / len(triples)
+            p(f"  {schema_count:>6} schemas  {name:<9} {seconds * 1_000_000:>10.1f} us/triple")
+
+def generated_corpus(size, seed=1):
+    """ Builds size distinct queries for the first dataset schema by joining dataset statements"""
+    rows = read_test_dataset_rows()
+    schema = rows[0][1]
+    statements = [statement for statement, row_schema, _ in rows if row_schema == schema]
+    rng = random.Random(seed)
+    corpus = [f"{rng.choice(statements)} UNION {rng.choice(statements)} LIMIT {number}" for number in range(size)]
+    return corpus, schema
+
+def benchmark_arrow_edits():
+    """ Flipping arrows by rebuilding the cypher per flip vs one splice of all edits"""
+    p("Fixing arrows: rebuild per flip vs one splice")
+    schemas = SchemaCache().get_schemas(FLIP_SCHEMA)
+    for flips in (10, 100, 500, 2_000):
+        cypher = generated_flip_query(flips)
+        parser = CypherParser()
+        parser.find_and_prepare_all_triples(cypher)
+        triples = parser.triples_repository.triples
+        for triple in triples:
+            SchemaRules.evaluate_direction_change(triple, schemas)
+
+        def rebuild_per_flip():
+            fixed_cypher = cypher
+            for triple in reversed(triples):
+                fixed_cypher = SchemaRules.fix_arrow_direction_if_needed(triple, fixed_cypher)
+            return fixed_cypher
+
+        def splice():
+            return SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples)
+
+        assert rebuild_per_flip() == splice()
+        flipped = sum(triple.change_direction() for triple in triples)
+        for name, fix in (("rebuild", rebuild_per_flip), ("splice", splice)):
+            seconds = best_of(fix, 3)
+            p(f"  {flipped:>6} flips {len(cypher):>8} chars  {name:<9} {seconds * 1000:>10.3f} ms")
+
+def benchmark_fix_in_place():
+    """ Rewriting a file of cyphers with strings vs in place through mmap"""
+    p("Fixing a file of cyphers: read, fix and write strings vs in place")
+    rows = read_test_dataset_rows()
+    schema = rows[0][1]
+    statements = [statement.replace("\n", " ") for statement, row_schema, _ in rows if row_schema == schema]
+    fixer = fixdirections_streammethod.Fixer(schema)
+    with tempfile.TemporaryDirectory() as directory:
+        original = os.path.join(directory, "original.txt")
+        with open(original, "w", encoding="utf-8") as file:
+            file.write("\n".join(statements * 200))
+        path = os.path.join(directory, "cyphers.txt")
+
+        def fix_strings():
+            with open(path, encoding="utf-8") as file:
+                cyphers = file.read().split("\n")
+            fixed_cyphers = [fixer.fix(cypher) or cypher for cypher in cyphers]
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("\n".join(fixed_cyphers))
+
+        def fix_in_place():
+            fixer.fix_file_in_place(path)
+
+        for name, fix in (("strings", fix_strings), ("in place", fix_in_place)):
+            seconds = min(timeit.repeat(lambda: fix(), setup=lambda: shutil.copyfile(original, path), number=1, repeat=3))
+            p(f"  {len(statements) * 200:>6} cyphers {os.path.getsize(original):>9} bytes  {name:<9} {seconds * 1000:>10.1f} ms")
+
+
+def benchmark_arrow_patch():
+    """ Building the fixed cypher vs only the patch of changed characters"""
+    p("Fixing arrows: fixed cypher vs patch")
+    schemas = SchemaCache().get_schemas(FLIP_SCHEMA)
+    plain_arrows = "MATCH (p:Person)<--(o:Organization) WHERE " + " AND ".join(["p.age > 18"] * 10_000)
+    cyphers = [generated_flip_query(flips) for flips in (2, 10, 100, 2_000)] + [plain_arrows]
+    for cypher in cyphers:
+        parser = CypherParser()
+        parser.find_and_prepare_all_triples(cypher)
+        triples = parser.triples_repository.triples
+        for triple in triples:
+            SchemaRules.evaluate_direction_change(triple, schemas)
+
+        def fixed_cypher():
+            return SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples)
+
+        def patch():
+            return SchemaRules.arrow_direction_patch(cypher, triples)
+
+        assert SchemaRules.apply_arrow_direction_patch(cypher, patch()) == fixed_cypher()
+        number = max(1, 20_000 // len(cypher))
+        for name, fix in (("cypher", fixed_cypher), ("patch", patch)):
+            seconds = best_of(fix, number)
+            p(f"  {len(patch()):>6} changes {len(cypher):>8} chars  {name:<7} {seconds * 1_000_000:>10.1f} us")
+
+def benchmark_needs_fix():
+    """ Queries with correct directions: fix vs needs_fix per query"""
+    p("Queries that need no fix: fix vs needs_fix")
+    rows = read_test_dataset_rows()
+    for engine in (fixdirections_streammethod, fixdirections_astmethod):
+        fixers = {schema: engine.Fixer(schema) for _, schema, _ in rows}
+        correct_rows = [(correct_query, fixers[schema]) for _, schema, correct_query in rows
+                        if fixers[schema].fix(correct_query) is correct_query]
+
+        def fix_all():
+            for correct_query, fixer in correct_rows:
+                fixer.fix(correct_query)
+
+        def needs_fix_all():
+            for correct_query, fixer in correct_rows:
+                fixer.needs_fix(correct_query)
+
+        for name, check in (("fix", fix_all), ("needs_fix", needs_fix_all)):
+            seconds = best_of(check, 3) / len(correct_rows)
+            p(f"  {engine.__name__.split('.')[-1]:<28} {name:<10} {seconds * 1_000_000:>10.1f} us per query")
+
+def benchmark_fix_many():
+    """ A batch of queries for one schema where half are repeated: static function per query vs fix_many"""
+    p("Fix a batch: static function per query vs fix_many")
+    rows = read_test_dataset_rows()
+    schema = rows[0][1]
+    statements = [statement for statement, row_schema, _ in rows if row_schema == schema]
+    batch = statements * 2
+    for engine_name, engine in (("stream", fixdirections_streammethod), ("ast", fixdirections_astmethod)):
+        calls = (
+            ("static", lambda: [engine.FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in batch]),
+            ("fix_many", lambda: list(engine.FixDirections.fix_many(batch, schema))),
+        )
+        for name, call in calls:
+            seconds = best_of(call, 3) / len(batch)
+            p(f"  {engine_name:<9} {name:<9} {len(batch):>5} queries {seconds * 1_000_000:>10.1f} us/query")
+
+def benchmark_parallel_scaling():
+    """ Queries per second for fix_many in one process vs fix_many_parallel with 1 to all CPUs"""
+    p(f"Fix a corpus: fix_many vs fix_many_parallel, {os.cpu_count()} CPUs")
+    corpus, schema = generated_corpus(20_000)
+    engine = fixdirections_streammethod.FixDirections
+    runs = [("fix_many", lambda: list(engine.fix_many(corpus, schema)))]
+    for processes in sorted({1, 2, 4, os.cpu_count() or 1}):
+        if processes <= (os.cpu_count() or 1):
+            runs.append((f"{processes} processes",
+                         lambda processes=processes: list(engine.fix_many_parallel(corpus, schema, processes=processes))))
+    for name, run in runs:
+        seconds = best_of(run, 1, repeat=3)
+        p(f"  {name:<13} {len(corpus):>6} queries {len(corpus) / seconds:>10.0f} queries/s")
+
+def benchmark_afix_inline():
+    """ Latency of afix for queries of different lengths, fixed on the event loop vs sent to a thread pool"""
+    p("afix: inline on the event loop vs thread pool")
+    rows = read_test_dataset_rows()
+    schema = rows[0][1]
+    fixer = fixdirections_streammethod.Fixer(schema)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        async def hop(number):
+            loop = asyncio.get_running_loop()
+            for _ in range(number):
+                await loop.run_in_executor(executor, len, schema)
+
+        seconds = best_of(lambda: asyncio.run(hop(5_000)), 1) / 5_000
+        p(f"  hop to the thread pool and back {seconds * 1_000_000:>10.1f} us")
+        for size in (100, 300, 1_000, 3_000, 10_000):
+            cypher = generated_query(size)
+
+            async def fix(inline_threshold, number):
+                for _ in range(number):
+                    await fixer.afix(cypher, executor, inline_threshold)
+
+            number = max(5, 200_000 // size)
+            for name, inline_threshold in (("inline", size + 1), ("executor", 0)):
+                seconds = best_of(lambda: asyncio.run(fix(inline_threshold, number)), 1) / number
+                p(f"  {len(cypher):>6} chars  {name:<9} {seconds * 1_000_000:>10.1f} us")
+
+def benchmark_result_cache():
+    """ Queries where a share is drawn from 50 common queries: a fixer without vs with a result cache"""
+    p("Repeated queries: no cache vs result cache")
+    corpus, schema = generated_corpus(50)
+    rng = random.Random(1)
+    for engine_name, engine in (("stream", fixdirections_streammethod), ("ast", fixdirections_astmethod)):
+        for repeated in (0.5, 0.9):
+            cyphers = [rng.choice(corpus) if rng.random() < repeated else f"{rng.choice(corpus)} SKIP {number}"
+                       for number in range(1_000)]
+            for name, result_cache in (("no cache", None), ("cache", ResultCache())):
+                fixer = engine.Fixer(schema, result_cache=result_cache)
+                seconds = best_of(lambda: [fixer.fix(cypher) for cypher in cyphers], 1, repeat=1)
+                hits = f"hits {result_cache.hits} misses {result_cache.misses}" if result_cache else ""
+                p(f"  {engine_name:<7} {repeated:>4.0%} repeated {name:<9} {seconds * 1_000_000 / len(cyphers):>10.1f} us/query  {hits}")
+
+def benchmark_persistent_cache():
+    """ A new process fixing a corpus: no cache, cold and warm sqlite cache, and a warm in-memory cache"""
+    p("Restart: no cache vs cold and warm persistent cache vs in-memory cache")
+    corpus, schema = generated_corpus(5_000)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "results.sqlite")
+
+        def fix_with(result_cache):
+            fixer = fixdirections_streammethod.Fixer(schema, result_cache=result_cache)
+            fixed_cyphers = list(fixer.fix_many(corpus))
+            if isinstance(result_cache, PersistentResultCache):
+                result_cache.close()
+            return fixed_cyphers
+
+        memory_cache = ResultCache()
+        fix_with(memory_cache)
+        runs = (
+            ("no cache", lambda: None, None),
+            ("cold", lambda: PersistentResultCache(path), lambda: os.path.exists(path) and os.remove(path)),
+            ("warm", lambda: PersistentResultCache(path), None),
+            ("in-memory", lambda: memory_cache, None),
+        )
+        for name, create_cache, setup in runs:
+            if setup:
+                setup()
+            start = timeit.default_timer()
+            fix_with(create_cache())
+            seconds = timeit.default_timer() - start
+            p(f"  {name:<10} {len(corpus):>6} queries {seconds * 1_000_000 / len(corpus):>10.1f} us/query")
+        p(f"  file {os.path.getsize(path)} bytes")
+
+def benchmark_ast_two_stage():
+    """ AST method: full LL prediction vs SLL first and LL only when SLL fails"""
+    p("AST parser: LL vs two-stage SLL then LL")
+    rows = read_test_dataset_rows()
+    queries = [("dataset", [statement for statement, _, _ in rows])]
+    queries += [(f"{size} chars", [generated_query(size)]) for size in (1_000, 10_000, 50_000)]
+    for name, cyphers in queries:
+        fixers = {two_stage: fixdirections_astmethod.Fixer(rows[0][1], two_stage=two_stage) for two_stage in (False, True)}
+        for two_stage, fixer in fixers.items():
+            seconds = best_of(lambda: [fixer.find_triples(cypher) for cypher in cyphers], 1, repeat=3) / len(cyphers)
+            p(f"  {name:<12} {'two-stage' if two_stage else 'LL':<10} {seconds * 1000:>10.2f} ms/query")
+
+def benchmark_ast_token_filter():
+    """ AST method: all tokens vs only the first token of each run outside of patterns"""
+    p("AST parser: all tokens vs filtered tokens")
+    rows = read_test_dataset_rows()
+    queries = [("dataset", [statement for statement, _, _ in rows]),
+               ("10000 chars", [generated_query(10_000)]),
+               ("where 10000", [generated_where_query(10_000)])]
+    for name, cyphers in queries:
+        for two_stage in (False, True):
+            for filter_tokens in (False, True):
+                fixer = fixdirections_astmethod.Fixer(rows[0][1], two_stage=two_stage, filter_tokens=filter_tokens)
+                seconds = best_of(lambda: [fixer.find_triples(cypher) for cypher in cyphers], 1, repeat=3) / len(cyphers)
+                p(f"  {name:<12} {'two-stage' if two_stage else 'LL':<10} {'filtered' if filter_tokens else 'all':<9}"
+                  f" {seconds * 1000:>10.2f} ms/query")
+
+def benchmark_ast_parse_trees():
+    """ AST method: building and walking a parse tree vs finding the triples with a parse listener while parsing"""
+    p("AST parser: parse tree and walker vs parse listener")
+    rows = read_test_dataset_rows()
+    queries = [("dataset", [statement for statement, _, _ in rows]),
+               ("10000 chars", [generated_query(10_000)]),
+               ("where 10000", [generated_where_query(10_000)])]
+    for name, cyphers in queries:
+        for two_stage in (False, True):
+            for build_parse_trees in (True, False):
+                fixer = fixdirections_astmethod.Fixer(rows[0][1], two_stage=two_stage, build_parse_trees=build_parse_trees)
+                seconds = best_of(lambda: [fixer.find_triples(cypher) for cypher in cyphers], 1, repeat=3) / len(cyphers)
+
+                # Peak memory of parsing the longest cypher, after the parser has warmed up its caches
+                longest_cypher = max(cyphers, key=len)
+                fixer.find_triples(longest_cypher)
+                fixer.release()
+                tracemalloc.start()
+                fixer.find_triples(longest_cypher)
+                _, peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                fixer.release()
+                p(f"  {name:<12} {'two-stage' if two_stage else 'LL':<10} {'tree' if build_parse_trees else 'listener':<9}"
+                  f" {seconds * 1000:>10.2f} ms/query {peak_bytes / 1024:>10.0f} KiB peak")
+
+def benchmark_ast_regex_lexer():
+    """ AST method: the generated ANTLR lexer vs the regular expression lexer"""
+    p("AST parser: generated lexer vs regex lexer")
+    rows = read_test_dataset_rows()
+    queries = [("dataset", [statement for statement, _, _ in rows]),
+               ("10000 chars", [generated_query(10_000)]),
+               ("where 10000", [generated_where_query(10_000)])]
+    for name, cyphers in queries:
+        for regex_lexer in (False, True):
+            if regex_lexer:
+                lexer = RegexLexer()
+            else:
+                lexer = FixRelationsDirectionsLexer(InputStream(""))
+                lexer.removeErrorListeners()
+            def lex_all():
+                for cypher in cyphers:
+                    lexer.inputStream = InputStream(cypher)
+                    while lexer.nextToken().type != Token.EOF:
+                        pass
+            lex_seconds = best_of(lex_all, 1, repeat=3) / len(cyphers)
+
+            fixer = fixdirections_astmethod.Fixer(rows[0][1], two_stage=True, regex_lexer=regex_lexer)
+            seconds = best_of(lambda: [fixer.find_triples(cypher) for cypher in cyphers], 1, repeat=3) / len(cyphers)
+            p(f"  {name:<12} {'regex' if regex_lexer else 'generated':<10} lex {lex_seconds * 1000:>8.2f} ms/query"
+              f"   two-stage parse {seconds * 1000:>8.2f} ms/query")
+
+def benchmark_pooled_parsers():
+    """ Per call time of the static function for short queries, new parser objects for every call vs pooled per thread"""
+    p("Fix directions: static function with new vs pooled parsers, short queries")
+    schema = "(Person, KNOWS, Person), (Person, WORKS_AT, Company)"
+    cyphers = ["MATCH (a:Person)<-[:KNOWS]-(b:Person) RETURN a",
+               "MATCH (c:Company)<-[:WORKS_AT]-(p) RETURN p.name",
+               "MATCH (a:Person)-->(b) WHERE b.age > 18 RETURN b"]
+    for engine_name, engine, options in (("stream", fixdirections_streammethod, {}),
+                                         ("ast", fixdirections_astmethod, {}),
+                                         ("ast SLL", fixdirections_astmethod, {"two_stage": True})):
+        def fix_with_new_parsers():
+            for cypher in cyphers:
+                fixer_module.thread_parsers_pool.__dict__.clear()
+                engine.FixDirections.fix_cypher_relations_directions(cypher, schema, **options)
+        fixer = engine.Fixer(schema, **options)
+        calls = (
+            ("new", fix_with_new_parsers),
+            ("pooled", lambda: [engine.FixDirections.fix_cypher_relations_directions(cypher, schema, **options)
+                                for cypher in cyphers]),
+            ("Fixer", lambda: [fixer.fix(cypher) for cypher in cyphers]),
+        )
+        for name, call in calls:
+            seconds = best_of(call, 200) / len(cyphers)
+            p(f"  {engine_name:<9} {name:<9} {seconds * 1_000_000:>10.1f} us/query")
+
+BENCHMARKS = {
+    "stream_cursor": benchmark_stream_cursor,
+    "stream_tokenizer": benchmark_stream_tokenizer,
+    "stream_arrow_anchored": benchmark_stream_arrow_anchored,
+    "stream_property_values": benchmark_stream_property_values,
+    "stream_identifiers": benchmark_stream_identifiers,
+    "fixer_per_call": benchmark_fixer_per_call,
+    "schema_cache": benchmark_schema_cache,
+    "schema_rules": benchmark_schema_rules,
+    "fused_rules": benchmark_fused_rules,
+    "arrow_edits": benchmark_arrow_edits,
+    "fix_in_place": benchmark_fix_in_place,
+    "arrow_patch": benchmark_arrow_patch,
+    "needs_fix": benchmark_needs_fix,
+    "fix_many": benchmark_fix_many,
+    "parallel_scaling": benchmark_parallel_scaling,
+    "afix_inline": benchmark_afix_inline,
+    "result_cache": benchmark_result_cache,
+    "persistent_cache": benchmark_persistent_cache,
+    "ast_two_stage": benchmark_ast_two_stage,
+    "ast_token_filter": benchmark_ast_token_filter,
+    "ast_parse_trees": benchmark_ast_parse_trees,
+    "ast_regex_lexer": benchmark_ast_regex_lexer,
+    "pooled_parsers": benchmark_pooled_parsers,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for benchmark_name in names:
+        BENCHMARKS[benchmark_name]()
+        p()
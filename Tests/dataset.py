@@ -0,0 +1,27 @@
+"""
+This module contains the readers of the examples dataset that the tests fix
+
+"""
+import csv
+import functools
+import os
+
+DATASET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'datasets', 'examples_2023-09-11.csv')
+
+
+@functools.lru_cache(maxsize=None)
+def read_dataset_file():
+    """ Reads the rows of the examples dataset once for all tests"""
+    with open(DATASET_FILE, newline='', encoding='utf-8') as file:
+        return tuple(csv.DictReader(file))
+
+
+def read_test_dataset_rows():
+    """ Reads all rows with statement, schema and correct_query in the examples dataset"""
+    return [dict(row) for row in read_dataset_file()]
+
+
+def read_test_dataset_statements():
+    """ Reads all statements in the examples dataset"""
+    return [row['statement'] for row in read_dataset_file()]
@@ -0,0 +1,39 @@
+"""
+This module contains the StringIO reader of the stream method parser,
+which the tests and benchmarks compare the index based cursor with
+
+"""
+import io
+from fixcypher_stream_method.cypher_parser_streammethod import CypherParser
+
+
+class StringIOCypherParser(CypherParser):
+    """
+    Cypher parser that reads the cypher through io.StringIO one character at a time.
+    This is how the parser originally read the cypher, it is kept to compare
+    positions and speed against the index based cursor in CypherParser
+    """
+
+    def set_cypher(self,cypher):
+        """ Sets cypher and set input stream"""
+        super().set_cypher(cypher)
+        self.input_stream = io.StringIO(cypher)
+
+    def next_character(self):
+        """ reads the next character in the stream"""
+        c = self.input_stream.read(1)
+
+        # Sets current character
+        self.current_character = c
+
+        # Sets the position of the character
+        self.position = self.input_stream.tell()
+
+    def seek(self, offset):
+        """ Moves the stream so the current character is the one at offset"""
+        self.input_stream.seek(min(max(offset, 0), self.cypher_length))
+        self.next_character()
+
+    def skip_to(self, character):
+        """ The stream has no random access, so only the current character is skipped"""
+        self.next_character()
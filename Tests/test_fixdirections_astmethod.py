@@ -3,12 +3,27 @@ All parsing rules tests
 
 """
 #from context import
-from core.core_classes import NodeFlag, Node, Relation, Triple, DirectionFlag,RelationFlag
-from core.schema_rules import SchemaRules
+import asyncio
+import inspect
+import pytest
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.Errors import ParseCancellationException
+from parse_antlr_to_cypher.FixRelationsDirectionsParser import FixRelationsDirectionsParser
+from parse_antlr_to_cypher.FixRelationsDirectionsLexer import FixRelationsDirectionsLexer
+from fixcypher_ast_method.pattern_token_source import PatternTokenSource
+from fixcypher_ast_method.regex_lexer import (RegexLexer, GENERATED_LEXER_RULE_NAMES, GENERATED_LEXER_ATN_SHA256,
+                                             generated_lexer_atn_sha256)
+from antlr4 import InputStream, Token
 #from fixcypher_streammethod.cypher_parser_streammethod import CypherParser
 # from fixcypher_streammethod.fixdirections_streammethod1 import FixDirections
 from fixcypher_ast_method.cypher_parser_ast_method import CypherParser
-from fixcypher_ast_method.fixdirections_astmethod import FixDirections
+from fixcypher_ast_method import fixdirections_astmethod
+from fixcypher_ast_method.fixdirections_astmethod import FixDirections, Fixer, pooled_parsers
+from Tests.dataset import read_test_dataset_rows
 
 
 
@@ -587,3 +602,344 @@ RETURN d.name
     fixed_cypher = FixDirections.fix_cypher_relations_directions(orginal_query, schema)
     assert fixed_cypher == correct_query
 
+
+
+# A fixer reused for many queries should fix them like new fixers
+def test_ReusedFixer_ShouldFixAllDatasetQueries():
+    rows = read_test_dataset_rows()
+
+    fixers = {}
+    for row in rows:
+        fixer = fixers.setdefault(row['schema'], Fixer(row['schema']))
+        assert fixer.fix(row['statement']) == row['correct_query']
+
+# A fixer should still work after a query that can't be parsed
+def test_ReusedFixer_ShouldFixAfterInvalidQuery():
+    fixer = Fixer('(Person,DIRECTED,Movie)')
+
+    fixer.fix("MATCH (d:Person)<-[:DIRECTED {]-(")
+
+    assert fixer.fix("MATCH (d:Person)<-[:DIRECTED]-(m:Movie)") == "MATCH (d:Person)-[:DIRECTED]->(m:Movie)"
+
+# needs_fix should be True only for queries that fix changes, unchanged queries should be returned as the same object
+def test_NeedsFix_ShouldMatchFix():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        fixer = Fixer(row['schema'])
+        fixed_cypher = fixer.fix(row['statement'])
+
+        assert fixer.needs_fix(row['statement']) == (fixed_cypher not in ("", row['statement']))
+        if fixed_cypher == row['statement']:
+            assert fixed_cypher is row['statement']
+
+# fix_many should fix all queries in order like fix, also when the same query comes again
+def test_FixMany_ShouldFixInInputOrder():
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    statements = [row['statement'] for row in rows if row['schema'] == schema]
+    cyphers = statements + statements[::-1]
+
+    fixed_cyphers = FixDirections.fix_many(iter(cyphers), schema)
+
+    assert list(fixed_cyphers) == [FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in cyphers]
+
+# fix_many_parallel should fix all queries in order like fix
+def test_FixManyParallel_ShouldFixInInputOrder():
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    cyphers = [row['statement'] for row in rows if row['schema'] == schema]
+
+    fixed_cyphers = FixDirections.fix_many_parallel(cyphers, schema, processes=2, chunk_size=5)
+
+    assert list(fixed_cyphers) == [FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in cyphers]
+
+# Fixers shared by many threads should fix every query like one thread does
+def test_SharedFixerInThreads_ShouldFixAllDatasetQueries():
+    rows = read_test_dataset_rows()
+    fixers = {row['schema']: Fixer(row['schema']) for row in rows}
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # Switch threads often, so the parses interleave
+
+    def fix(row):
+        if len(row['statement']) % 2:
+            return fixers[row['schema']].fix(row['statement'])
+        return FixDirections.fix_cypher_relations_directions(row['statement'], row['schema'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            fixed_cyphers = list(executor.map(fix, rows * 5))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert fixed_cyphers == [row['correct_query'] for row in rows * 5]
+
+# afix_many should fix all queries in order in a process pool like fix
+def test_AfixMany_ShouldFixInInputOrder():
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    cyphers = [row['statement'] for row in rows if row['schema'] == schema]
+
+    async def fix_all():
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            return [fixed_cypher async for fixed_cypher in FixDirections.afix_many(
+                cyphers, schema, executor=executor, max_in_flight=4, inline_threshold=100)]
+
+    assert asyncio.run(fix_all()) == [FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in cyphers]
+
+# afix calls that share a semaphore should not fix more cyphers in the executor at the same time than it allows
+def test_Afix_ShouldShareSemaphoreBetweenCalls(monkeypatch):
+    schema = "(Person, WORKS_AT, Organization)"
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    fix_uncached = Fixer.fix_uncached
+    def counting_fix_uncached(fixer, cypher):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            time.sleep(0.01) # Hold the fix, so the fixes in the executor overlap
+            return fix_uncached(fixer, cypher)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    monkeypatch.setattr(Fixer, "fix_uncached", counting_fix_uncached)
+
+    async def fix_all():
+        semaphore = asyncio.Semaphore(2)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return await asyncio.gather(*[FixDirections.afix(
+                f"MATCH (o:Organization)-[:WORKS_AT]->(p:Person) RETURN {number}", schema,
+                executor=executor, inline_threshold=0, semaphore=semaphore) for number in range(20)])
+
+    assert asyncio.run(fix_all()) == [f"MATCH (o:Organization)<-[:WORKS_AT]-(p:Person) RETURN {number}" for number in range(20)]
+    assert 1 <= in_flight[1] <= 2
+
+# Two-stage parsing should find the same triples as LL parsing and fix all dataset queries
+def test_TwoStage_ShouldFixAllDatasetQueries():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        fixer = Fixer(row['schema'], two_stage=True)
+        two_stage_triples = [str(triple) for triple in fixer.find_triples(row['statement'])]
+        fixer.release()
+        ll_triples = [str(triple) for triple in Fixer(row['schema']).find_triples(row['statement'])]
+
+        assert two_stage_triples == ll_triples
+        assert fixer.fix(row['statement']) == row['correct_query']
+
+# When SLL parsing fails the cypher should be parsed again with LL
+def test_TwoStage_ShouldParseWithLLWhenSLLFails(monkeypatch):
+    start = FixRelationsDirectionsParser.start
+    prediction_modes = []
+    def start_failing_with_sll(parser):
+        prediction_modes.append(parser._interp.predictionMode)
+        if parser._interp.predictionMode == PredictionMode.SLL:
+            raise ParseCancellationException("SLL failed")
+        return start(parser)
+    monkeypatch.setattr(FixRelationsDirectionsParser, "start", start_failing_with_sll)
+    cypher_parser = CypherParser(two_stage=True)
+
+    cypher_parser.find_and_prepare_all_triples("MATCH (d:Person)<-[:DIRECTED]-(m:Movie)")
+
+    assert prediction_modes == [PredictionMode.SLL, PredictionMode.LL]
+    assert len(cypher_parser.triples_repository.triples) == 1
+
+# Only the first token of each run outside of patterns should be given to the parser
+def test_PatternTokenSource_ShouldKeepFirstTokenOfRunsOutsidePatterns():
+    token_source = PatternTokenSource(FixRelationsDirectionsLexer(InputStream(
+        "MATCH (a:Person)<-[:KNOWS]-(b) WHERE a.age > 18 AND b.name = 'x' RETURN count(b) , a")))
+
+    texts = []
+    token = token_source.nextToken()
+    while token.type != Token.EOF:
+        texts.append(token.text)
+        token = token_source.nextToken()
+
+    assert texts == ["MATCH", "(", "a", ":", "Person", ")", "<", "-", "[", ":", "KNOWS", "]", "-", "(", "b", ")",
+                     "WHERE", "(", "b", ")", ","]
+
+# Filtered tokens should give the same triples as all tokens
+def test_FilterTokens_ShouldReturnSameTriplesAsAllTokens():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        filtered_parser = CypherParser(filter_tokens=True)
+        filtered_parser.find_and_prepare_all_triples(row['statement'])
+        parser = CypherParser()
+        parser.find_and_prepare_all_triples(row['statement'])
+
+        assert [str(triple) for triple in filtered_parser.triples_repository.triples] == \
+            [str(triple) for triple in parser.triples_repository.triples]
+
+
+# The parse listener should find the same triples as walking the parse tree
+def test_ParseListener_ShouldFixAllDatasetQueries():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        fixer = Fixer(row['schema'], build_parse_trees=False)
+        listener_triples = [str(triple) for triple in fixer.find_triples(row['statement'])]
+        fixer.release()
+        tree_triples = [str(triple) for triple in Fixer(row['schema']).find_triples(row['statement'])]
+
+        assert listener_triples == tree_triples
+        assert fixer.fix(row['statement']) == row['correct_query']
+
+# When the parse without tree fails, the triples found so far should be dropped and the tree should be walked
+def test_ParseListener_ShouldParseWithTreeWhenParseFails(monkeypatch):
+    start = FixRelationsDirectionsParser.start
+    build_parse_trees = []
+    def start_failing_without_tree(parser):
+        build_parse_trees.append(parser.buildParseTrees)
+        tree = start(parser)
+        if parser._interp.predictionMode == PredictionMode.SLL:
+            raise ParseCancellationException("SLL failed")
+        return tree
+    monkeypatch.setattr(FixRelationsDirectionsParser, "start", start_failing_without_tree)
+    cypher_parser = CypherParser(two_stage=True, build_parse_trees=False)
+
+    cypher_parser.find_and_prepare_all_triples("MATCH (d:Person)<-[:DIRECTED]-(m:Movie)-[:IN]->(g:Genre)")
+
+    assert build_parse_trees == [False, True]
+    assert len(cypher_parser.triples_repository.triples) == 2
+
+def all_tokens(token_source):
+    """ The type, offsets, text, line and column of all tokens up to EOF"""
+    tokens = []
+    while True:
+        token = token_source.nextToken()
+        tokens.append((token.type, token.start, token.stop, token.text, token.line, token.column))
+        if token.type == Token.EOF:
+            return tokens
+
+# The regex lexer should give the same tokens as the generated lexer for the dataset
+def test_RegexLexer_ShouldGiveSameTokensAsGeneratedLexer():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        lexer = FixRelationsDirectionsLexer(InputStream(row['statement']))
+        lexer.removeErrorListeners()
+
+        assert all_tokens(RegexLexer(InputStream(row['statement']))) == all_tokens(lexer)
+
+# Characters that the generated lexer can't match should be skipped the same way
+@pytest.mark.parametrize("cypher", [
+    "MATCH (a)\n WHERE a.x = $p AND 0 < 1_2__3 /* comment */ // line\r\n-->(b)",
+    "MATCH (a:`Per``son`)-[:`KNOWS`]->(b:Åsa_1) /* unclosed -->(c)",
+    "MATCH (a {name: 'unclosed})-->(b)",
+    "MATCH (a {name: \"x\"})-[:`unclosed]->(b)",
+    "MATCH (😀:L\ud800x)-->(\ud800",
+    "",
+])
+def test_RegexLexer_ShouldSkipUnmatchedCharactersAsGeneratedLexer(cypher):
+    lexer = FixRelationsDirectionsLexer(InputStream(cypher))
+    lexer.removeErrorListeners()
+
+    assert all_tokens(RegexLexer(InputStream(cypher))) == all_tokens(lexer)
+
+# The regex lexer should fix all dataset queries
+def test_RegexLexer_ShouldFixAllDatasetQueries():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        assert Fixer(row['schema'], regex_lexer=True).fix(row['statement']) == row['correct_query']
+
+# Fixers with the same token options should share the parsers of a thread, other threads get their own
+def test_ThreadParsers_ShouldBeSharedByFixersWithSameTokenOptions():
+    parsers = Fixer("(Person, KNOWS, Person)").thread_parsers()
+
+    assert Fixer("(Movie, IN, Genre)", two_stage=True).thread_parsers() is parsers
+    assert Fixer("(Person, KNOWS, Person)", regex_lexer=True).thread_parsers() is not parsers
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(lambda: Fixer("(Person, KNOWS, Person)").thread_parsers()).result() is not parsers
+    assert FixDirections.fix_cypher_relations_directions(
+        "MATCH (d:Person)<-[:KNOWS]-(m:Person)", "(Person, KNOWS, Person)") == "MATCH (d:Person)<-[:KNOWS]-(m:Person)"
+
+# CypherParser should parse with the thread parsers of Fixer and keep its own triples
+def test_CypherParser_ShouldUseThreadParsersOfFixer():
+    parsers = Fixer("(Person, KNOWS, Person)", filter_tokens=True).thread_parsers()
+    assert pooled_parsers(filter_tokens=True) is parsers
+
+    cypher_parser = CypherParser(filter_tokens=True)
+    cypher_parser.find_and_prepare_all_triples("MATCH (d:Person)<-[:KNOWS]-(m:Person)")
+    assert cypher_parser.triples_repository is not parsers.listener.triples_repository
+    parser = parsers.parser
+    Fixer("(Person, KNOWS, Person)", filter_tokens=True).fix("MATCH (a:Person)")
+    cypher_parser.find_and_prepare_all_triples("MATCH (d:Person)<-[:KNOWS]-(m:Person)-[:KNOWS]->(n)")
+
+    assert pooled_parsers(filter_tokens=True).parser is parser
+    assert len(cypher_parser.triples_repository.triples) == 2
+
+# Without the GIL each thread should get its own DFA cache instead of the one of the generated parser
+def test_ThreadParsers_ShouldHaveOwnDfaWithoutGil(monkeypatch):
+    monkeypatch.setattr(fixdirections_astmethod, "shares_dfa_between_threads", lambda: False)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        parsers = executor.submit(pooled_parsers).result()
+        fixed_cypher = executor.submit(FixDirections.fix_cypher_relations_directions, "MATCH (d:Person)-[:KNOWS]->(m:Movie)",
+                                       "(Movie, KNOWS, Person)").result()
+
+    assert parsers.parser._interp.decisionToDFA is not FixRelationsDirectionsParser.decisionsToDFA
+    assert parsers.lexer._interp.decisionToDFA is not FixRelationsDirectionsLexer.decisionsToDFA
+    assert fixed_cypher == "MATCH (d:Person)<-[:KNOWS]-(m:Movie)"
+    assert Fixer("(Person, KNOWS, Person)").thread_parsers().parser._interp.decisionToDFA is \
+        FixRelationsDirectionsParser.decisionsToDFA
+
+# Every FixDirections function should give the parse options to the fixer
+@pytest.mark.parametrize("option, value", [("two_stage", True), ("filter_tokens", True), ("build_parse_trees", False), ("regex_lexer", True)])
+def test_FixDirections_ShouldGiveParseOptionsToFixer(monkeypatch, option, value):
+    fixer_options = []
+    fixer_init = Fixer.__init__
+    def recording_init(fixer, schema, **arguments):
+        fixer_options.append(arguments[option])
+        fixer_init(fixer, schema, **arguments)
+    def recording_fix_many_parallel(cls, cyphers, schema, **arguments):
+        fixer_options.append(arguments[option])
+        return iter([])
+    monkeypatch.setattr(Fixer, "__init__", recording_init)
+    monkeypatch.setattr(Fixer, "fix_many_parallel", classmethod(recording_fix_many_parallel))
+    cypher = "MATCH (d:Person)<-[:KNOWS]-(m:Person)"
+    schema = "(Person, KNOWS, Person)"
+    options = {option: value}
+
+    async def afix_all():
+        return [fixed_cypher async for fixed_cypher in FixDirections.afix_many([cypher], schema, **options)]
+    FixDirections.fix_cypher_relations_directions(cypher, schema, **options)
+    FixDirections.fix_cypher_relations_directions_patch(cypher, schema, **options)
+    FixDirections.needs_fix(cypher, schema, **options)
+    list(FixDirections.fix_many([cypher], schema, **options))
+    list(FixDirections.fix_many_parallel([cypher], schema, **options))
+    asyncio.run(FixDirections.afix(cypher, schema, **options))
+    asyncio.run(afix_all())
+
+    assert fixer_options == [value] * 7
+
+# The FixDirections functions should take the options only by keyword, the parse options in the order of Fixer
+@pytest.mark.parametrize("function", ["fix_cypher_relations_directions", "fix_cypher_relations_directions_patch", "needs_fix",
+                                      "fix_many", "fix_many_parallel", "afix", "afix_many"])
+def test_FixDirections_ShouldTakeOptionsOnlyByKeyword(function):
+    parameters = list(inspect.signature(getattr(FixDirections, function)).parameters.values())
+    fixer_options = list(inspect.signature(Fixer.__init__).parameters)[2:]
+
+    assert [parameter.kind for parameter in parameters[2:]] == [inspect.Parameter.KEYWORD_ONLY] * (len(parameters) - 2)
+    assert [parameter.name for parameter in parameters if parameter.name in fixer_options] == \
+        [option for option in fixer_options if option in [parameter.name for parameter in parameters]]
+    with pytest.raises(TypeError):
+        getattr(FixDirections, function)("MATCH (d:Person)", "(Person, KNOWS, Person)", True)
+
+# The regex lexer is written for the rules of the generated lexer, this fails when the grammar is regenerated
+# with other lexer rules. Change regex_lexer.py to give the same tokens, and then its rule names and ATN hash
+def test_RegexLexer_ShouldBeWrittenForGeneratedLexerRules():
+    assert tuple(FixRelationsDirectionsLexer.ruleNames) == GENERATED_LEXER_RULE_NAMES
+    assert generated_lexer_atn_sha256() == GENERATED_LEXER_ATN_SHA256
+    assert RegexLexer.MATCHES_GENERATED_LEXER
+
+# When the generated lexer has other rules the fixer should use it instead of the regex lexer
+def test_RegexLexer_ShouldNotBeUsedForOtherGeneratedLexerRules(monkeypatch):
+    monkeypatch.setattr(RegexLexer, "MATCHES_GENERATED_LEXER", False)
+
+    with pytest.warns(UserWarning):
+        fixer = Fixer("(Person, KNOWS, Person)", two_stage=True, regex_lexer=True)
+
+    assert not fixer.regex_lexer
+    assert fixer.fix("MATCH (d:Person)<-[:KNOWS]-(m:Person)") == "MATCH (d:Person)<-[:KNOWS]-(m:Person)"
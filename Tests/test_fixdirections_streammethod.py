@@ -3,10 +3,21 @@ All parsing rules tests
 
 """
 #from context import
-from core.core_classes import NodeFlag, Node, Relation, Triple, DirectionFlag,RelationFlag
+import asyncio
+import inspect
+import sys
+import threading
+import time
+import pytest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from core.core_classes import NodeFlag, Node, Relation, Triple, DirectionFlag,RelationFlag,ResultCache
 from core.schema_rules import SchemaRules
 from fixcypher_stream_method.cypher_parser_streammethod import CypherParser
-from fixcypher_stream_method.fixdirections_streammethod import FixDirections
+from fixcypher_stream_method.fixdirections_streammethod import FixDirections, Fixer
+from fixcypher_stream_method.cypher_tokenizer import CypherTokenizer
+from Tests.stringio_cypher_parser import StringIOCypherParser
+from Tests.dataset import read_test_dataset_rows, read_test_dataset_statements
+
 
 
 
@@ -1362,16 +1373,491 @@ RETURN d.name
     assert fixed_cypher == correct_query
 
 
+#----------------------------------------------------------------
+# Parser modes must find the same triples
+#----------------------------------------------------------------
+def triple_signature(triple: Triple):
+    """ Everything the parser sets on a triple, to compare parser modes"""
+    signature = []
+    for node in (triple.first_node, triple.second_node):
+        signature.append((node.variable, list(node.labels), node.status, node.position))
+    rel = triple.relation
+    signature.append((rel.variable, rel.types, rel.negative_types, rel.variable_length, rel.status,
+                      rel.left, rel.left_position1, rel.left_position2,
+                      rel.right, rel.right_position1, rel.right_position2))
+    return signature
+
+def find_triple_signatures(cypher_parser, cypher):
+    """ Parses cypher and returns the signatures of all triples"""
+    cypher_parser.find_and_prepare_all_triples(cypher)
+    return [triple_signature(triple) for triple in cypher_parser.triples_repository.triples]
+
+# Index cursor should give the same triples and positions as the StringIO reader
+def test_CursorAndStringIOReader_ShouldReturnSameTriples():
+    cyphers = read_test_dataset_statements() + [
+        "(r:Road {`Rudimentär`: 'Test}', Namn: \"Mitt namn\\}\"})-[:`A``B`]->(`x`)",
+        "<-[r:`MyRel Type`|!Relation|!Rel*1..2 {Name: \"Andy\"} ]-",
+        "MATCH (a:`Unterminated",
+    ]
+
+    for cypher in cyphers:
+        expected = find_triple_signatures(StringIOCypherParser(), cypher)
+        assert find_triple_signatures(CypherParser(), cypher) == expected
+
+# Long cyphers up to 1 MB should be parsed without growing the stack
+def test_LongCyphers_ShouldReturnAllTriples():
+    pattern = "MATCH (p:Person)-[:KNOWS]->(:Person)<-[r:WORKS_AT]-(o) WHERE p.name = 'Foo' RETURN p.name, count(*)\n"
+
+    for size in (1_000, 10_000, 100_000, 1_000_000):
+        repeat = size // len(pattern)
+        cp = CypherParser()
+        cp.find_and_prepare_all_triples(pattern * repeat)
+
+        assert len(cp.triples_repository.triples) == 2 * repeat
+
+# A long return body without nodes should be skipped without growing the stack
+def test_LongReturnBody_ShouldReturnNoTriples():
+    cypher = "MATCH (p:Person) RETURN " + " + ".join(["p.age"] * 200_000)
+
+    cp = CypherParser()
+    cp.find_and_prepare_all_triples(cypher)
+
+    assert len(cp.triples_repository.triples) == 0
+    assert cp.current_character == ''
+
+# A path with thousands of hops should return one triple per hop
+def test_PathWithThousandsOfHops_ShouldReturnAllTriples():
+    hops = 10_000
+    cypher = "MATCH (p:Person)" + "-[:KNOWS]->(:Person)" * hops
+
+    cp = CypherParser()
+    cp.find_and_prepare_all_triples(cypher)
+
+    triples = cp.triples_repository.triples
+    assert len(triples) == hops
+    assert triples[-1].relation.right_position2 == len(cypher) - len("(:Person)") - 1
+
+# The regex tokenizer should match names, labels and types and return the offset after them
+def test_Tokenizer_ShouldMatchNamesLabelsAndTypesWithOffsets():
+    tokenizer = CypherTokenizer()
+
+    assert tokenizer.match_word("(p:Person)", 1) == ("p", 2)
+    assert tokenizer.match_word("(`my p`)", 1) == ("my p", 7)
+    assert tokenizer.match_word("(:Person)", 1) == ("", 1)
+    assert tokenizer.match_labels("(p:Person : `Big Cat`)", 2) == (["Person", "Big Cat"], 21)
+    assert tokenizer.match_types("[:!KNOWS|`WORKS AT`]", 1) == (["WORKS AT"], ["KNOWS"], 19)
+
+# The regex tokenizer should give the same triples and fixes as the character scanning
+@pytest.mark.parametrize("arrow_anchored", [False, True])
+def test_Tokenizer_ShouldParseAndFixLikeCharacterScanning(arrow_anchored):
+    rows = read_test_dataset_rows()
+    cyphers = [(row['statement'], row['schema']) for row in rows] + [(cypher, "(Person, KNOWS, Person)") for cypher in [
+        "MATCH (p : Person :`Big Cat` {name: 'x', age: 3})<-[ r :!KNOWS | `WORKS AT` *1..3 ]-(q:Person) RETURN p",
+        "MATCH (`p\\`q`:Person)-[:KNOWS {since: \"a}\\\"b\"}]->(:Person)<-[:KNOWS*]-(é:Person) RETURN é",
+        "MATCH (p:Person)\n  -[:KNOWS]->\t(q)-->(r:Person), (q)<--(:Person) RETURN count(p)",
+        "MATCH (p:Per son)-[:KNOWS*..2]->(:Person:) RETURN p",
+    ]]
+
+    for cypher, schema in cyphers:
+        expected = find_triple_signatures(CypherParser(arrow_anchored=arrow_anchored), cypher)
+        tokenizer_fixer = Fixer(schema, tokenizer=CypherTokenizer(), arrow_anchored=arrow_anchored)
+        fixer = Fixer(schema, arrow_anchored=arrow_anchored)
+
+        assert find_triple_signatures(CypherParser(tokenizer=CypherTokenizer(), arrow_anchored=arrow_anchored), cypher) == expected
+        assert tokenizer_fixer.fix(cypher) == fixer.fix(cypher)
+        assert tokenizer_fixer.fix_patch(cypher) == fixer.fix_patch(cypher)
+
+# The regex tokenizer should end names and numbers at the same characters as the character scanning
+@pytest.mark.parametrize("cypher", [
+    "MATCH (p:Org½nization:Person)-[:WORKS_AT]->(o:Organization) RETURN p",
+    "MATCH (p:½Person)-[:Ⅷ|!WORKS½AT]->(o:Organization) RETURN p",
+    "MATCH (p:Person)-[:WORKS_AT*1²..3]->(o:Organization) RETURN p",
+])
+def test_Tokenizer_ShouldEndNamesAndNumbersLikeCharacterScanning(cypher):
+    schema = "(Person, WORKS_AT, Organization)"
+
+    expected = find_triple_signatures(CypherParser(), cypher)
+
+    assert find_triple_signatures(CypherParser(tokenizer=CypherTokenizer()), cypher) == expected
+    assert Fixer(schema, tokenizer=CypherTokenizer()).fix(cypher) == Fixer(schema).fix(cypher)
+
+# Parsing only around arrows should give the same triples as parsing the whole cypher
+def test_ArrowAnchored_ShouldReturnSameTriplesAsWholeCypher():
+    cyphers = read_test_dataset_statements() + [
+        "MATCH (a)-->x(b:Car) RETURN count(*)-1",
+        "MATCH (x {a: '(y:Y)-->(z)'})-->(w) MATCH (y)<--(v:`V`)",
+        "MATCH (p:Person {id: \"(q:Q)\"})-[:KNOWS]->(q) WITH p MATCH (q:Person) RETURN q",
+        "MATCH (`a(b`:L)--(c) RETURN ((c))",
+    ]
+
+    for cypher in cyphers:
+        expected = find_triple_signatures(CypherParser(arrow_anchored=False), cypher)
+        assert find_triple_signatures(CypherParser(arrow_anchored=True), cypher) == expected
+
+# Labels of nodes outside of the arrows should still be looked up
+def test_ArrowAnchored_ShouldLookUpLabelsFromNodesWithoutArrows():
+    cypher = "MATCH (p:Person) WHERE p.age > 3 MATCH (p)-[:WORKS_AT]->(o) RETURN p"
+
+    cp = CypherParser(arrow_anchored=True)
+    cp.find_and_prepare_all_triples(cypher)
 
+    triple = cp.triples_repository.triples[0]
+    assert 'Person' in triple.first_node.labels
+    assert triple.first_node.label_is_looked_up is True
+    assert cp.current_character == ''
 
+# Property values of 100 KB should be skipped and the relation after them found
+@pytest.mark.parametrize("value_cypher", [
+    "'" + "a, (b)-[c]->{d} " * 6250 + "'",
+    '"' + 'a \\"(b)\\" -> \\\\' * 6250 + '"',
+    "toUpper(m.name) + (a)-->(b) " * 4000,
+], ids=["single_quoted", "escaped_double_quoted", "unquoted"])
+def test_LongPropertyValue_ShouldBeSkipped(value_cypher):
+    cypher = "MATCH (n:Node {data: " + value_cypher + "})<-[:R]-(m:Other) RETURN n"
+
+    cp = CypherParser()
+    cp.find_and_prepare_all_triples(cypher)
 
+    assert len(cp.triples_repository.triples) == 1
+    triple = cp.triples_repository.triples[0]
+    assert triple.first_node.labels == ["Node"]
+    assert triple.relation.types == ["R"]
+    assert triple.second_node.labels == ["Other"]
 
+# Thousands of properties should be skipped without growing the stack
+def test_ThousandsOfProperties_ShouldBeSkipped():
+    properties = ", ".join(f"p{i}: 'v{i}'" for i in range(20_000))
+    cypher = "MATCH (n:Node {" + properties + "})-[:R]->(m:Other) RETURN n"
 
+    cp = CypherParser()
+    cp.find_and_prepare_all_triples(cypher)
 
+    assert len(cp.triples_repository.triples) == 1
+    assert cp.triples_repository.triples[0].second_node.labels == ["Other"]
 
+# An escaped quote should not close a string, a quote after an even number of backslashes should
+@pytest.mark.parametrize("string_cypher", [
+    "'it\\'s (a)-->(b)'",
+    "'ends with backslash \\\\'",
+    '"\\\\\\"(a)-->(b)\\\\"',
+])
+def test_EscapedQuotes_ShouldBeSkippedInsideStrings(string_cypher):
+    cypher = "MATCH (n:Node {data: " + string_cypher + "})-[:R]->(m:Other) RETURN n"
 
+    cp = CypherParser()
+    cp.find_and_prepare_all_triples(cypher)
 
+    assert [triple.first_node.labels for triple in cp.triples_repository.triples] == [["Node"]]
+    assert cp.triples_repository.triples[0].second_node.labels == ["Other"]
 
+# Backticked and non-ASCII names should be found the same way as ASCII names
+@pytest.mark.parametrize("cypher,variables,labels,types", [
+    ("MATCH (å:Förening)-[r:ÄGER]->(b²:`Bolag AB`)", ["å", "b²"], [["Förening"], ["Bolag AB"]], ["ÄGER"]),
+    ("MATCH (名字:人物)<-[:認識]-(x_1:Person)", ["名字", "x_1"], [["人物"], ["Person"]], ["認識"]),
+    ("MATCH (`my node`:`Label:1`)-[`rel`:`HAS TYPE`]-(ø٣:Øst)", ["my node", "ø٣"], [["Label:1"], ["Øst"]], ["HAS TYPE"]),
+])
+def test_NonAsciiAndBacktickedNames_ShouldReturnNames(cypher, variables, labels, types):
+    cp = CypherParser()
+    cp.find_and_prepare_all_triples(cypher)
 
+    triple = cp.triples_repository.triples[0]
+    assert [triple.first_node.variable, triple.second_node.variable] == variables
+    assert [list(triple.first_node.labels), list(triple.second_node.labels)] == labels
+    assert triple.relation.types == types
+    assert find_triple_signatures(CypherParser(), cypher) == find_triple_signatures(StringIOCypherParser(), cypher)
 
+# Lookup tables for name characters should classify like str.isalpha and str.isdigit
+def test_VariableCharacterTables_ShouldMatchStringMethods():
+    cp = CypherParser()
+    characters = [chr(code) for code in range(0x3100)] + ["", "𝔘", "😀", "½", "²", "٣"]
+
+    for char in characters:
+        assert cp.is_valid_start_variable_character(char) == char.isalpha()
+        assert cp.is_valid_variable_character(char) == (char.isalpha() or char.isdigit() or char == "_")
+
+# A fixer reused for many queries should fix them like new fixers
+@pytest.mark.parametrize("arrow_anchored", [False, True])
+def test_ReusedFixer_ShouldFixAllDatasetQueries(arrow_anchored):
+    rows = read_test_dataset_rows()
 
+    fixers = {}
+    for row in rows:
+        fixer = fixers.setdefault(row['schema'], Fixer(row['schema'], arrow_anchored=arrow_anchored))
+        assert fixer.fix(row['statement']) == row['correct_query']
+        assert fixer.cypher_parser.triples_repository.triples == []
+
+# Fixing in place should write the same cypher as fix, or leave it unchanged without schema match
+@pytest.mark.parametrize("make_buffer", [bytearray, lambda data: memoryview(bytearray(data))], ids=["bytearray", "memoryview"])
+def test_FixInPlace_ShouldWriteFixedCypherIntoBuffer(make_buffer):
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        fixer = Fixer(row['schema'])
+        statement = "MATCH (å:Förening)-->(b) RETURN 1\n" + row['statement']
+        buffer = make_buffer(b"before;" + statement.encode('utf-8') + b";after")
+
+        has_schema_match = fixer.fix_in_place(buffer, 7, len(buffer) - 6)
+
+        fixed_cypher = fixer.fix(statement)
+        expected = fixed_cypher if has_schema_match else statement
+        assert has_schema_match == (fixed_cypher != "")
+        assert bytes(buffer) == b"before;" + expected.encode('utf-8') + b";after"
+
+# Fixing a file in place should rewrite every cypher in it through mmap
+def test_FixFileInPlace_ShouldRewriteAllCyphers(tmp_path):
+    cyphers = ["MATCH (p:Person)<-[:WORKS_AT]-(o:Organization) RETURN p",
+               "MATCH (p:Person)-[:KNOWS]->(o:Person) RETURN p",
+               "MATCH (p:Person)<-[:WORKS_AT]-(o:Organization {name: 'Örebro'})-->(x:Movie) RETURN p"]
+    path = tmp_path / "cyphers.txt"
+    path.write_bytes("\n".join(cyphers).encode('utf-8'))
+    fixer = Fixer("(Person, KNOWS, Person), (Person, WORKS_AT, Organization)")
+
+    matches = fixer.fix_file_in_place(str(path))
+
+    assert matches == 3
+    assert path.read_bytes().decode('utf-8').split("\n") == [fixer.fix(cypher) for cypher in cyphers]
+
+# A patch applied to the cypher should give the same cypher as fix, and be empty without schema match
+def test_FixPatch_ShouldGiveSameCypherAsFix():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        fixer = Fixer(row['schema'])
+
+        patch, has_schema_match = fixer.fix_patch(row['statement'])
+
+        fixed_cypher = fixer.fix(row['statement'])
+        assert has_schema_match == (fixed_cypher != "")
+        if has_schema_match:
+            assert SchemaRules.apply_arrow_direction_patch(row['statement'], patch) == fixed_cypher
+        else:
+            assert patch == []
+
+# A patch should only contain the characters that change
+def test_FixPatch_ShouldOnlyContainChangedCharacters():
+    schema = "(Person, KNOWS, Person), (Person, WORKS_AT, Organization)"
+
+    patch, has_schema_match = FixDirections.fix_cypher_relations_directions_patch(
+        "MATCH (p:Person)<--(o:Organization)<-[:KNOWS]-(x:Person) RETURN p", schema)
+
+    assert has_schema_match
+    assert patch == [(16, "<", "-"), (18, "-", ">")]
+
+# Applying a patch to another cypher should raise an error
+def test_ApplyPatch_ShouldRaiseOnOtherCypher():
+    with pytest.raises(ValueError):
+        SchemaRules.apply_arrow_direction_patch("MATCH (p)-->(o)", [(9, "<", "-"), (11, "-", ">")])
+
+# needs_fix should be True only for queries that fix changes, unchanged queries should be returned as the same object
+def test_NeedsFix_ShouldMatchFix():
+    rows = read_test_dataset_rows()
+
+    for row in rows:
+        fixer = Fixer(row['schema'])
+        fixed_cypher = fixer.fix(row['statement'])
+
+        assert fixer.needs_fix(row['statement']) == (fixed_cypher not in ("", row['statement']))
+        if fixed_cypher == row['statement']:
+            assert fixed_cypher is row['statement']
+
+# A query with correct directions should be returned as the same object without needing a fix
+def test_CorrectDirections_ShouldReturnSameObject():
+    schema = "(Person, KNOWS, Person), (Person, WORKS_AT, Organization)"
+    cypher = "MATCH (p:Person)-[:WORKS_AT]->(o:Organization), (p)-[:KNOWS]->(f:Person) RETURN p"
+
+    assert FixDirections.fix_cypher_relations_directions(cypher, schema) is cypher
+    assert not FixDirections.needs_fix(cypher, schema)
+    assert FixDirections.needs_fix("MATCH (o:Organization)-[:WORKS_AT]->(p:Person) RETURN p", schema)
+
+# fix_many should fix all queries in order like fix, also when the same query comes again
+def test_FixMany_ShouldFixInInputOrder():
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    statements = [row['statement'] for row in rows if row['schema'] == schema]
+    cyphers = statements + statements[::-1]
+
+    fixed_cyphers = FixDirections.fix_many(iter(cyphers), schema)
+
+    assert list(fixed_cyphers) == [FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in cyphers]
+
+# fix_many should only parse each distinct query once
+def test_FixMany_ShouldParseDuplicatesOnce(monkeypatch):
+    fixer = Fixer("(Person, WORKS_AT, Organization)")
+    parsed_cyphers = []
+    find_triples = fixer.find_triples
+    monkeypatch.setattr(fixer, "find_triples", lambda cypher: parsed_cyphers.append(cypher) or find_triples(cypher))
+    cyphers = ["MATCH (o:Organization)-[:WORKS_AT]->(p:Person)", "MATCH (p:Person)--(o)"] * 3
+
+    fixed_cyphers = list(fixer.fix_many(cyphers))
+
+    assert fixed_cyphers == ["MATCH (o:Organization)<-[:WORKS_AT]-(p:Person)", "MATCH (p:Person)--(o)"] * 3
+    assert parsed_cyphers == cyphers[:2]
+
+# fix_many should only keep the fixes of the last distinct queries
+def test_FixMany_ShouldParseAgainAfterRecentFixesSize(monkeypatch):
+    fixer = Fixer("(Person, WORKS_AT, Organization)")
+    monkeypatch.setattr(fixer, "RECENT_FIXES_SIZE", 2)
+    parsed_cyphers = []
+    find_triples = fixer.find_triples
+    monkeypatch.setattr(fixer, "find_triples", lambda cypher: parsed_cyphers.append(cypher) or find_triples(cypher))
+    cyphers = ["MATCH (a)--(b)", "MATCH (b)--(c)", "MATCH (a)--(b)", "MATCH (c)--(d)", "MATCH (b)--(c)", "MATCH (a)--(b)"]
+
+    fixed_cyphers = list(fixer.fix_many(cyphers))
+
+    assert len(fixed_cyphers) == len(cyphers)
+    assert parsed_cyphers == ["MATCH (a)--(b)", "MATCH (b)--(c)", "MATCH (c)--(d)", "MATCH (b)--(c)", "MATCH (a)--(b)"]
+
+# fix_many_parallel should fix all queries in order like fix, with chunks that don't divide the queries
+@pytest.mark.parametrize("chunk_size", [1, 7])
+def test_FixManyParallel_ShouldFixInInputOrder(chunk_size):
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    cyphers = [row['statement'] for row in rows if row['schema'] == schema] * 2
+
+    fixed_cyphers = FixDirections.fix_many_parallel(iter(cyphers), schema, processes=2, chunk_size=chunk_size)
+
+    assert list(fixed_cyphers) == [FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in cyphers]
+
+# fix_many_parallel should yield nothing for no queries
+def test_FixManyParallel_ShouldYieldNothingForNoQueries():
+    assert list(FixDirections.fix_many_parallel([], "(Person, KNOWS, Person)", processes=1)) == []
+
+# Fixers shared by many threads should fix every query like one thread does
+def test_SharedFixerInThreads_ShouldFixAllDatasetQueries():
+    rows = read_test_dataset_rows()
+    fixers = {row['schema']: Fixer(row['schema']) for row in rows}
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # Switch threads often, so the parses interleave
+
+    def fix(row):
+        if len(row['statement']) % 2:
+            return fixers[row['schema']].fix(row['statement'])
+        return FixDirections.fix_cypher_relations_directions(row['statement'], row['schema'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            fixed_cyphers = list(executor.map(fix, rows * 20))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert fixed_cyphers == [row['correct_query'] for row in rows * 20]
+
+# afix_many should fix all queries in order in the executor like fix
+def test_AfixMany_ShouldFixInInputOrder():
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    cyphers = [row['statement'] for row in rows if row['schema'] == schema] * 2
+
+    async def fix_all():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            return [fixed_cypher async for fixed_cypher in FixDirections.afix_many(
+                cyphers, schema, executor=executor, max_in_flight=3, inline_threshold=0)]
+
+    assert asyncio.run(fix_all()) == [FixDirections.fix_cypher_relations_directions(cypher, schema) for cypher in cyphers]
+
+# afix_many should not fix more than max_in_flight queries at the same time, or read queries ahead of them
+def test_AfixMany_ShouldLimitQueriesInFlight(monkeypatch):
+    fixer = Fixer("(Person, WORKS_AT, Organization)")
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    fix_uncached = fixer.fix_uncached
+    def counting_fix_uncached(cypher):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            time.sleep(0.01) # Hold the fix, so the fixes in the executor overlap
+            return fix_uncached(cypher)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    monkeypatch.setattr(fixer, "fix_uncached", counting_fix_uncached)
+    read_cyphers = []
+
+    async def cyphers():
+        for number in range(40):
+            read_cyphers.append(number)
+            yield f"MATCH (o:Organization)-[:WORKS_AT]->(p:Person) RETURN {number}"
+
+    async def fix_all():
+        fixed_cyphers = []
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            async for fixed_cypher in fixer.afix_many(cyphers(), executor, max_in_flight=2, inline_threshold=0):
+                assert len(read_cyphers) <= len(fixed_cyphers) + 3
+                fixed_cyphers.append(fixed_cypher)
+        return fixed_cyphers
+
+    fixed_cyphers = asyncio.run(fix_all())
+
+    assert fixed_cyphers == [f"MATCH (o:Organization)<-[:WORKS_AT]-(p:Person) RETURN {number}" for number in range(40)]
+    assert 1 <= in_flight[1] <= 2
+
+# afix should fix short queries without the executor and long ones in a process pool
+def test_Afix_ShouldInlineShortQueriesAndOffloadLongOnes():
+    schema = "(Person, WORKS_AT, Organization)"
+    cypher = "MATCH (o:Organization)-[:WORKS_AT]->(p:Person) RETURN p"
+
+    class NoExecutor:
+        def submit(self, *args, **kwargs):
+            raise AssertionError("short queries should not be sent to the executor")
+
+    async def fix_both():
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return (await FixDirections.afix(cypher, schema, executor=NoExecutor()),
+                    await FixDirections.afix(cypher, schema, executor=executor, inline_threshold=10))
+
+    assert asyncio.run(fix_both()) == ("MATCH (o:Organization)<-[:WORKS_AT]-(p:Person) RETURN p",) * 2
+
+# afix calls that share a semaphore should not fix more cyphers in the executor at the same time than it allows
+def test_Afix_ShouldShareSemaphoreBetweenCalls(monkeypatch):
+    schema = "(Person, WORKS_AT, Organization)"
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    fix_uncached = Fixer.fix_uncached
+    def counting_fix_uncached(fixer, cypher):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            time.sleep(0.01) # Hold the fix, so the fixes in the executor overlap
+            return fix_uncached(fixer, cypher)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    monkeypatch.setattr(Fixer, "fix_uncached", counting_fix_uncached)
+
+    async def fix_all():
+        semaphore = asyncio.Semaphore(2)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return await asyncio.gather(*[FixDirections.afix(
+                f"MATCH (o:Organization)-[:WORKS_AT]->(p:Person) RETURN {number}", schema,
+                executor=executor, inline_threshold=0, semaphore=semaphore) for number in range(20)])
+
+    assert asyncio.run(fix_all()) == [f"MATCH (o:Organization)<-[:WORKS_AT]-(p:Person) RETURN {number}" for number in range(20)]
+    assert 1 <= in_flight[1] <= 2
+
+
+# Fixing with a result cache should give the same cyphers as without, and only fix each distinct query once
+def test_ResultCache_ShouldGiveSameCyphers():
+    rows = read_test_dataset_rows()
+    result_cache = ResultCache()
+
+    for row in rows * 2:
+        fixed_cypher = FixDirections.fix_cypher_relations_directions(row['statement'], row['schema'], result_cache=result_cache)
+        assert fixed_cypher == FixDirections.fix_cypher_relations_directions(row['statement'], row['schema'])
+
+    assert result_cache.misses == len({(row['statement'], row['schema']) for row in rows})
+    assert result_cache.hits == 2 * len(rows) - result_cache.misses
+
+# The FixDirections functions should take the options only by keyword, the parse options in the order of Fixer
+@pytest.mark.parametrize("function", ["fix_cypher_relations_directions", "fix_cypher_relations_directions_patch", "needs_fix",
+                                      "fix_many", "fix_many_parallel", "afix", "afix_many"])
+def test_FixDirections_ShouldTakeOptionsOnlyByKeyword(function):
+    parameters = list(inspect.signature(getattr(FixDirections, function)).parameters.values())
+    fixer_options = list(inspect.signature(Fixer.__init__).parameters)[2:]
+
+    assert [parameter.kind for parameter in parameters[2:]] == [inspect.Parameter.KEYWORD_ONLY] * (len(parameters) - 2)
+    assert [parameter.name for parameter in parameters if parameter.name in fixer_options] == \
+        [option for option in fixer_options if option in [parameter.name for parameter in parameters]]
+    with pytest.raises(TypeError):
+        getattr(FixDirections, function)("MATCH (d:Person)", "(Person, KNOWS, Person)", CypherTokenizer())
@@ -1,8 +1,18 @@
 """
 All schema rules tests
 """
+import copy
+import random
+import sys
 from core.core_classes import NodeFlag, Node, Relation, Triple, DirectionFlag,Schema,SchemaParser,RelationTypeEnum
+from core.core_classes import SchemaCache, SchemaIndex, ResultCache, schema_cache
 from core.schema_rules import SchemaRules
+from core.persistent_cache import FIXER_PACKAGES, PersistentResultCache, fixer_sources_version, flush_open_caches
+from fixcypher_stream_method.fixdirections_streammethod import Fixer as StreamFixer
+from fixcypher_ast_method.fixdirections_astmethod import Fixer as AstFixer
+from fixcypher_stream_method.cypher_parser_streammethod import CypherParser
+from Tests.dataset import read_test_dataset_rows
+import pytest
 
 def test_extract_schema_should_return_schema_object():
     schema_parser = SchemaParser()
@@ -12,6 +22,258 @@ def test_extract_schema_should_return_schema_object():
     assert schemas[0].relation == 'KNOWS'
     assert schemas[0].destination == 'Person'
 
+def test_schema_cache_should_count_hits_and_misses():
+    cache = SchemaCache()
+    schemas = cache.get_schemas("(Person,KNOWS,Person)")
+
+    assert cache.get_schemas("(Person,KNOWS,Person)") is schemas
+    assert cache.get_schemas("(Person,WORKS_AT,Organization)")[0].relation == 'WORKS_AT'
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+
+def test_schema_cache_should_evict_least_recently_used():
+    cache = SchemaCache(capacity=2)
+    cache.get_schemas("(A,R,B)")
+    cache.get_schemas("(B,R,C)")
+    cache.get_schemas("(A,R,B)")
+    cache.get_schemas("(C,R,D)")
+
+    # (B,R,C) was the least recently used
+    cache.get_schemas("(A,R,B)")
+    cache.get_schemas("(B,R,C)")
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    cache.capacity = 1
+    assert len(cache) == 1
+    with pytest.raises(ValueError):
+        cache.capacity = -1
+
+def test_schema_cache_should_not_cache_invalid_schemas():
+    cache = SchemaCache()
+    with pytest.raises(Exception):
+        cache.get_schemas("(Person,KNOWS)")
+
+    assert len(cache) == 0
+
+def test_schema_cache_should_be_shared_by_both_methods():
+    schema = "(Person,SHARED_CACHE,Movie)"
+    misses = schema_cache.misses
+    hits = schema_cache.hits
+
+    stream_fixer = StreamFixer(schema)
+    ast_fixer = AstFixer(schema)
+
+    assert stream_fixer.schema_list is ast_fixer.schema_list
+    assert (schema_cache.hits - hits, schema_cache.misses - misses) == (1, 1)
+
+def test_result_cache_should_count_hits_misses_and_evictions():
+    cache = ResultCache(capacity=2)
+    cache.put("fixer", "(a)-->(b)", "(a)<--(b)")
+    cache.put("fixer", "(b)-->(c)", "(b)<--(c)")
+
+    assert cache.get("fixer", "(a)-->(b)") == "(a)<--(b)"
+    assert cache.get("other fixer", "(a)-->(b)") is None
+    cache.put("fixer", "(c)-->(d)", "(c)<--(d)")
+
+    # (b)-->(c) was the least recently used
+    assert cache.get("fixer", "(b)-->(c)") is None
+    assert (cache.hits, cache.misses, cache.evictions, len(cache)) == (1, 2, 1, 2)
+
+    cache.clear()
+    assert (cache.hits, cache.misses, cache.evictions, cache.bytes, len(cache)) == (0, 0, 0, 0, 0)
+
+def test_result_cache_should_evict_above_max_bytes():
+    cypher = "MATCH (a)-->(b) RETURN a" * 10
+    size = sys.getsizeof(cypher)
+    cache = ResultCache(max_bytes=3 * size)
+    for number in range(5):
+        numbered_cypher = cypher + str(number)
+        cache.put("fixer", numbered_cypher, numbered_cypher)
+
+    assert len(cache) == 2
+    assert cache.bytes <= 3 * size
+    assert cache.evictions == 3
+
+    # A result larger than max_bytes is not cached
+    cache.put("fixer", cypher * 4, cypher * 4)
+    assert cache.get("fixer", cypher * 4) is None
+    with pytest.raises(ValueError):
+        ResultCache(max_bytes=-1)
+
+def test_result_cache_should_be_keyed_by_fixer_and_compiled_schema():
+    cache = ResultCache()
+    cypher = "MATCH (p:Person)<-[:WORKS_AT]-(o:Organization) RETURN p"
+    stream_fixer = StreamFixer("(Person, WORKS_AT, Organization)", result_cache=cache)
+    ast_fixer = AstFixer("(Person, WORKS_AT, Organization)", result_cache=cache)
+    other_schema_fixer = StreamFixer("(Organization, WORKS_AT, Person)", result_cache=cache)
+
+    fixed_cyphers = [fixer.fix(cypher) for fixer in (stream_fixer, ast_fixer, other_schema_fixer, stream_fixer)]
+
+    assert fixed_cyphers[0] == fixed_cyphers[1] == fixed_cyphers[3] == "MATCH (p:Person)-[:WORKS_AT]->(o:Organization) RETURN p"
+    assert fixed_cyphers[2] is cypher
+    assert (cache.hits, cache.misses, len(cache)) == (1, 3, 3)
+
+    # An equal cypher without changes should be returned as the object of the caller
+    same_cypher = "".join(list(cypher))
+    assert other_schema_fixer.fix(same_cypher) is same_cypher
+
+def test_persistent_result_cache_should_keep_results_between_processes(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    with PersistentResultCache(path) as cache:
+        cache.put("fixer", "(a)-->(b)", "(a)<--(b)")
+        cache.put("fixer", "(a)<--(b)", "(a)<--(b)")
+        cache.put("fixer", "(b)-->(c)", "")
+        assert cache.get("fixer", "(a)-->(b)") == "(a)<--(b)"
+
+    cypher = "".join(["(a)<--", "(b)"])
+    with PersistentResultCache(path) as cache:
+        fixed_cyphers = cache.get_many("fixer", ["(a)-->(b)", cypher, "(b)-->(c)", "(c)-->(d)"])
+        assert fixed_cyphers == {"(a)-->(b)": "(a)<--(b)", cypher: cypher, "(b)-->(c)": ""}
+        # An unchanged cypher is returned as the object of the caller
+        assert fixed_cyphers[cypher] is cypher
+        assert cache.get("other fixer", "(a)-->(b)") is None
+        assert (cache.hits, cache.misses, len(cache)) == (3, 2, 3)
+
+        cache.clear()
+        assert (cache.hits, cache.misses, cache.bytes, len(cache)) == (0, 0, 0, 0)
+
+def test_persistent_result_cache_should_evict_least_recently_used_above_max_bytes(tmp_path):
+    fixed_cypher = "MATCH (a)<--(b) RETURN a" * 10
+    size = len(fixed_cypher) + 16
+    with PersistentResultCache(str(tmp_path / "results.sqlite"), max_bytes=3 * size, batch_size=2) as cache:
+        for number in range(3):
+            cache.put("fixer", str(number), fixed_cypher)
+        cache.get("fixer", "0")
+        cache.put("fixer", "3", fixed_cypher)
+        cache.flush()
+
+        # 1 was the least recently used
+        assert cache.get_many("fixer", ["0", "1", "2", "3"]).keys() == {"0", "2", "3"}
+        assert cache.bytes == 3 * size
+        assert cache.evictions == 1
+
+# Two processes writing to one file should keep the bytes and the least recently used order of both
+def test_persistent_result_cache_should_share_file_between_writers(tmp_path):
+    fixed_cypher = "MATCH (a)<--(b) RETURN a" * 10
+    size = len(fixed_cypher) + 16
+    path = str(tmp_path / "results.sqlite")
+    with PersistentResultCache(path, max_bytes=4 * size, batch_size=1) as first_cache, \
+            PersistentResultCache(path, max_bytes=4 * size, batch_size=1) as second_cache:
+        first_cache.put("fixer", "0", fixed_cypher)
+        second_cache.put("fixer", "1", fixed_cypher)
+        first_cache.put("fixer", "2", fixed_cypher)
+        second_cache.put("fixer", "3", fixed_cypher)
+        first_cache.get("fixer", "0")
+        first_cache.flush()
+        second_cache.put("fixer", "4", fixed_cypher)
+
+        # 1 was the least recently used of both writers
+        assert second_cache.get_many("fixer", ["0", "1", "2", "3", "4"]).keys() == {"0", "2", "3", "4"}
+        assert second_cache.bytes == 4 * size
+        first_cache.put("fixer", "2", fixed_cypher)
+        assert first_cache.bytes == 4 * size
+
+# A cache that is not closed should write its pending puts when the process exits
+def test_persistent_result_cache_should_flush_at_exit(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = PersistentResultCache(path)
+    cache.put("fixer", "(a)-->(b)", "(a)<--(b)")
+
+    flush_open_caches()
+    cache.close()
+
+    assert cache.closed
+    with PersistentResultCache(path) as cache:
+        assert cache.get("fixer", "(a)-->(b)") == "(a)<--(b)"
+
+# A file with results of another version should be emptied when it is opened
+def test_persistent_result_cache_should_drop_results_of_other_version(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.sqlite")
+    with PersistentResultCache(path) as cache:
+        cache.put("fixer", "(a)-->(b)", "(a)<--(b)")
+
+    with PersistentResultCache(path) as cache:
+        assert cache.get("fixer", "(a)-->(b)") == "(a)<--(b)"
+
+    monkeypatch.setattr(PersistentResultCache, "VERSION", "other version")
+    with PersistentResultCache(path) as cache:
+        assert cache.get("fixer", "(a)-->(b)") is None
+        assert (len(cache), cache.bytes) == (0, 0)
+
+# The version of the stored results should change when the code of a fixer changes
+def test_persistent_result_cache_version_should_change_with_fixer_sources(tmp_path):
+    for package in FIXER_PACKAGES:
+        (tmp_path / package).mkdir()
+        (tmp_path / package / "__init__.py").write_text("")
+    (tmp_path / "core" / "schema_rules.py").write_text("RULES = 1\n")
+    version = fixer_sources_version(tmp_path)
+
+    assert fixer_sources_version(tmp_path) == version
+    (tmp_path / "core" / "schema_rules.py").write_text("RULES = 2\n")
+    assert fixer_sources_version(tmp_path) != version
+    assert PersistentResultCache.VERSION.endswith(fixer_sources_version())
+
+def test_persistent_result_cache_should_fix_without_parsing_after_restart(tmp_path, monkeypatch):
+    rows = read_test_dataset_rows()
+    schema = rows[0]['schema']
+    statements = [row['statement'] for row in rows if row['schema'] == schema]
+    path = str(tmp_path / "results.sqlite")
+    with PersistentResultCache(path) as cache:
+        fixed_cyphers = list(StreamFixer(schema, result_cache=cache).fix_many(statements))
+
+    with PersistentResultCache(path) as cache:
+        fixer = StreamFixer(schema, result_cache=cache)
+        monkeypatch.setattr(fixer, "find_triples", None)
+        assert list(fixer.fix_many(statements)) == fixed_cyphers
+        assert [fixer.fix(statement) for statement in statements] == fixed_cyphers
+        assert cache.misses == 0
+
+def test_schema_index_should_return_positions_in_schema_order():
+    schemas = SchemaParser().extract_schemas("(Person,KNOWS,Person),(Person,WORKS_AT,Organization),(Organization,KNOWS,Person)")
+    schema_index = SchemaIndex(schemas)
+
+    assert schema_index.with_relation("KNOWS") == [0, 2]
+    assert schema_index.with_source("Person") == [0, 1]
+    assert schema_index.with_destination("Person") == [0, 2]
+    assert schema_index.with_source_and_destination("Person", "Organization") == [1]
+    assert schema_index.with_relation("MISSING") == []
+    assert [schema.relation for schema in schema_index] == ["KNOWS", "WORKS_AT", "KNOWS"]
+    assert SchemaIndex.of(schema_index) is schema_index
+
+# With several matching schemas the first schema decides the direction
+def test_index_rules_should_use_first_matching_schema():
+    first_node = Node('',["Person"],NodeFlag.NODE_FOUND)
+    second_node = Node('',[], NodeFlag.NODE_FOUND)
+    rel = Relation()
+
+    triple = Triple(first_node,rel,second_node)
+    triple.direction = DirectionFlag.SOURCE_TO_DESTINATION
+
+    schemas = SchemaIndex([Schema("Movie","ACTED_IN","Person"), Schema("Person","WORKS_AT","Organization")])
+    result = SchemaRules.check_schema_when_no_relationship_type_and_at_least_one_label(first_node, second_node, triple, schemas)
+
+    assert result is True
+    assert triple.schema_validated_direction == DirectionFlag.DESTINATION_TO_SOURCE
+
+# Without a match the validated direction is set as if every schema was checked
+def test_index_rules_should_keep_validated_direction_of_last_schema():
+    first_node = Node('',["Person"],NodeFlag.NODE_FOUND)
+    second_node = Node('',[], NodeFlag.NODE_FOUND)
+    rel = Relation()
+    rel.types = ["WORKS_AT"]
+    rel.negative_types = ["WORKS_AT"]
+
+    triple = Triple(first_node,rel,second_node)
+    triple.direction = DirectionFlag.DESTINATION_TO_SOURCE
+
+    schemas = SchemaIndex([Schema("Movie","ACTED_IN","Genre"), Schema("Person","WORKS_AT","Organization")])
+    result = SchemaRules.check_schema_when_one_node_has_missing_labels(first_node, second_node, triple, schemas)
+
+    assert result is False
+    assert triple.schema_validated_direction == DirectionFlag.SOURCE_TO_DESTINATION
+
 #-------------------------------------------------------------------------
 # Schema validation rules
 #-------------------------------------------------------------------------
@@ -384,3 +646,113 @@ def test_valid_negative_type_should_return_false():
     result = rel.schema_validated_relation_type
 
     assert result is RelationTypeEnum.NOT_VALID
+
+
+#-------------------------------------------------------------------------
+# Equivalence harness, the fused evaluator must give the same results as the rules
+#-------------------------------------------------------------------------
+DIRECTIONS = [
+    DirectionFlag.NOT_SET,
+    DirectionFlag.SOURCE_TO_DESTINATION,
+    DirectionFlag.DESTINATION_TO_SOURCE,
+    DirectionFlag.UNDIRECTED,
+    DirectionFlag.HAS_DIRECTION_ERROR,
+    DirectionFlag.SOURCE_TO_DESTINATION | DirectionFlag.DESTINATION_TO_SOURCE | DirectionFlag.DIRECTION_IN_BOTH_ENDS,
+    DirectionFlag.SOURCE_TO_DESTINATION | DirectionFlag.HAS_DIRECTION_ERROR,
+]
+
+def evaluate_both_ways(triple, schemas):
+    """ Returns the results of the rules and of the fused evaluator on copies of the triple"""
+    results = []
+    for evaluate in (SchemaRules.validate_direction_change, SchemaRules.evaluate_direction_change):
+        triple_copy = copy.deepcopy(triple)
+        evaluate(triple_copy, schemas)
+        results.append((triple_copy.has_schema_match, triple_copy.schema_validated_direction, triple_copy.change_direction()))
+    return results
+
+def random_triple(rng, labels, types):
+    """ A triple with random labels, types, negative types and direction"""
+    relation = Relation()
+    relation.types = rng.choices(types, k=rng.choice([0, 0, 1, 2]))
+    relation.negative_types = rng.choices(types, k=rng.choice([0, 0, 0, 1, 2]))
+    relation.variable_length = rng.random() < 0.2
+
+    triple = Triple(Node('a', rng.choices(labels, k=rng.choice([0, 0, 1, 1, 2])), NodeFlag.NODE_FOUND),
+                    relation,
+                    Node('b', rng.choices(labels, k=rng.choice([0, 0, 1, 1, 2])), NodeFlag.NODE_FOUND))
+    triple.direction = rng.choice(DIRECTIONS)
+    triple.schema_validated_direction = rng.choice(DIRECTIONS)
+    return triple
+
+def test_fused_evaluator_should_match_rules_on_dataset():
+    rows = read_test_dataset_rows()
+
+    cypher_parser = CypherParser()
+    for row in rows:
+        schemas = SchemaParser().extract_schemas(row['schema'])
+        cypher_parser.find_and_prepare_all_triples(row['statement'])
+        for triple in cypher_parser.triples_repository.triples:
+            rules_result, fused_result = evaluate_both_ways(triple, schemas)
+            assert rules_result == fused_result, row['statement']
+
+def test_fused_evaluator_should_match_rules_on_random_triples():
+    rng = random.Random(2023)
+    labels = ['Person', 'Organization', 'Movie', 'Genre', '']
+    types = ['KNOWS', 'WORKS_AT', 'ACTED_IN', '']
+
+    for _ in range(5000):
+        schemas = [Schema(rng.choice(labels), rng.choice(types), rng.choice(labels))
+                   for _ in range(rng.choice([0, 1, 2, 3, 5, 8, 20]))]
+        triple = random_triple(rng, labels, types)
+
+        rules_result, fused_result = evaluate_both_ways(triple, SchemaIndex(schemas))
+        assert rules_result == fused_result, (str(triple), [str(schema) for schema in schemas])
+
+#-------------------------------------------------------------------------
+# Fixing arrows with one splice
+#-------------------------------------------------------------------------
+def fix_arrows_one_at_a_time(cypher, triples):
+    """ Fixes the arrows by rebuilding the cypher for every triple"""
+    fixed_cypher = cypher
+    for triple in reversed(triples):
+        fixed_cypher = SchemaRules.fix_arrow_direction_if_needed(triple, fixed_cypher)
+    return fixed_cypher
+
+# Hundreds of flipped arrows should give the same cypher as fixing one at a time
+def test_fix_all_arrow_directions_should_splice_hundreds_of_flips():
+    cypher = "MATCH (p:Person)<-[:WORKS_AT]-(o:Organization)-[:OWNS]->(c:Company), (o)<--(x:Person)\n" * 150
+    schemas = SchemaIndex(SchemaParser().extract_schemas("(Person,WORKS_AT,Organization),(Company,OWNS,Organization)"))
+
+    cypher_parser = CypherParser()
+    cypher_parser.find_and_prepare_all_triples(cypher)
+    triples = cypher_parser.triples_repository.triples
+    for triple in triples:
+        SchemaRules.evaluate_direction_change(triple, schemas)
+
+    fixed_cypher = SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples)
+
+    assert sum(triple.change_direction() for triple in triples) == 300
+    assert fixed_cypher == fix_arrows_one_at_a_time(cypher, triples)
+    assert fixed_cypher == "MATCH (p:Person)-[:WORKS_AT]->(o:Organization)<-[:OWNS]-(c:Company), (o)<--(x:Person)\n" * 150
+
+# Relations that overlap should be fixed one at a time like before
+def test_fix_all_arrow_directions_should_fix_overlapping_relations_one_at_a_time():
+    cypher = "(a)<--(b)"
+    triples = []
+    for left_position in (3, 4):
+        rel = Relation()
+        rel.left_position1 = left_position
+        rel.right_position1 = 5
+        triple = Triple(Node('a',[],NodeFlag.NODE_FOUND), rel, Node('b',[],NodeFlag.NODE_FOUND))
+        triple.direction = DirectionFlag.DESTINATION_TO_SOURCE
+        triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
+        triple.has_schema_match = True
+        triples.append(triple)
+
+    assert SchemaRules.apply_arrow_direction_edits(cypher, [SchemaRules.arrow_direction_edit(triple) for triple in triples]) is None
+    buffer = bytearray(cypher.encode('utf-8'))
+    assert SchemaRules.apply_arrow_direction_edits_in_place(buffer, SchemaRules.arrow_direction_edits(triples), cypher) is False
+    assert buffer == cypher.encode('utf-8')
+    assert SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples) == fix_arrows_one_at_a_time(cypher, triples)
+    patch = SchemaRules.arrow_direction_patch(cypher, triples)
+    assert SchemaRules.apply_arrow_direction_patch(cypher, patch) == fix_arrows_one_at_a_time(cypher, triples)
@@ -1,9 +1,12 @@
 """Contains classes shared among other modules
 """
+from collections import OrderedDict
 from enum import IntFlag, auto,Enum
 from typing import List
 import re
 import json
+import sys
+import threading
 def to_string(data):
     if isinstance(data, list):
         return [str(item) for item in data]
@@ -136,6 +139,61 @@ class Schema:
     def __str__(self):
         return f"(:{self.source})-[:{self.relation}]->(:{self.destination})"
 
+class SchemaIndex:
+    """
+    Schemas compiled to lookups by relation type, source label, destination label
+    and (source label, destination label) pair. The lookups hold the positions of
+    the schemas in increasing order, so rules can visit the schemas in the same
+    order as in the schema string. Iterates, indexes and counts like the schema list
+
+    Args:
+        schemas (List[Schema]): the schemas to index
+    """
+    def __init__(self, schemas: List[Schema]) -> None:
+        self.schemas = list(schemas)
+        self.by_relation = {}
+        self.by_source = {}
+        self.by_destination = {}
+        self.by_source_and_destination = {}
+
+        for position, schema in enumerate(self.schemas):
+            self.by_relation.setdefault(schema.relation, []).append(position)
+            self.by_source.setdefault(schema.source, []).append(position)
+            self.by_destination.setdefault(schema.destination, []).append(position)
+            self.by_source_and_destination.setdefault((schema.source, schema.destination), []).append(position)
+
+    @staticmethod
+    def of(schemas) -> "SchemaIndex":
+        """ Returns schemas if already indexed, else indexes them"""
+        if isinstance(schemas, SchemaIndex):
+            return schemas
+        return SchemaIndex(schemas)
+
+    def __iter__(self):
+        return iter(self.schemas)
+
+    def __len__(self) -> int:
+        return len(self.schemas)
+
+    def __getitem__(self, position):
+        return self.schemas[position]
+
+    def with_relation(self, relation: str) -> List[int]:
+        """ Positions of the schemas with the relation type"""
+        return self.by_relation.get(relation, [])
+
+    def with_source(self, label: str) -> List[int]:
+        """ Positions of the schemas with the source label"""
+        return self.by_source.get(label, [])
+
+    def with_destination(self, label: str) -> List[int]:
+        """ Positions of the schemas with the destination label"""
+        return self.by_destination.get(label, [])
+
+    def with_source_and_destination(self, source: str, destination: str) -> List[int]:
+        """ Positions of the schemas from the source label to the destination label"""
+        return self.by_source_and_destination.get((source, destination), [])
+
 @json_serializable
 class Triple:
     """
@@ -205,6 +263,191 @@ class SchemaParser:
 
         return schemas
 
+class SchemaCache:
+    """
+    Bounded least recently used cache of compiled schemas keyed by the schema string.
+    Most traffic uses a handful of schemas, so they are only extracted and indexed once.
+    The cached schema indexes are shared and must not be changed by the callers
+
+    Args:
+        capacity (int): the most schema strings to keep, 0 disables the cache
+    """
+    def __init__(self, capacity: int = 128) -> None:
+        if capacity < 0:
+            raise ValueError(f"Schema cache capacity can't be negative: {capacity}")
+        self._capacity = capacity
+        self._schemas = OrderedDict()
+        self._lock = threading.Lock()
+        self.schema_parser = SchemaParser()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self) -> int:
+        """ The most schema strings to keep"""
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, capacity: int) -> None:
+        if capacity < 0:
+            raise ValueError(f"Schema cache capacity can't be negative: {capacity}")
+        with self._lock:
+            self._capacity = capacity
+            self._evict()
+
+    def get_schemas(self, schema_string) -> SchemaIndex:
+        """Gets the compiled schemas for the schema string, extracts and indexes them on a miss
+
+        Args:
+            schema_string (string): string in the format "(Source label, Relation type, Destination label)"
+
+        Returns:
+            SchemaIndex: the shared index of the schema objects
+        """
+        with self._lock:
+            schemas = self._schemas.get(schema_string)
+            if schemas is not None:
+                self._schemas.move_to_end(schema_string)
+                self.hits += 1
+                return schemas
+            self.misses += 1
+
+        # Extract outside of the lock, invalid schemas raise and are not cached
+        schemas = SchemaIndex(self.schema_parser.extract_schemas(schema_string))
+
+        with self._lock:
+            self._schemas[schema_string] = schemas
+            self._schemas.move_to_end(schema_string)
+            self._evict()
+        return schemas
+
+    def clear(self) -> None:
+        """ Removes all schemas and resets the counters"""
+        with self._lock:
+            self._schemas.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._schemas)
+
+    def _evict(self) -> None:
+        """ Removes the least recently used schemas above the capacity"""
+        while len(self._schemas) > self._capacity:
+            self._schemas.popitem(last=False)
+
+
+# Schema cache shared by the stream and the AST method
+schema_cache = SchemaCache()
+
+
+class ResultCache:
+    """
+    Bounded least recently used cache of fixed cyphers, keyed by the fixer, the identity of the
+    compiled schema and the cypher. The cypher itself is part of the key, so two cyphers with the
+    same hash never share a result. It is bounded both by the number of cyphers and by the bytes
+    of the cached strings
+
+    Args:
+        capacity (int): the most cyphers to keep, 0 disables the cache
+        max_bytes (int): the most bytes of cyphers and fixed cyphers to keep
+    """
+    def __init__(self, capacity: int = 10_000, max_bytes: int = 64 * 1024 * 1024) -> None:
+        if capacity < 0 or max_bytes < 0:
+            raise ValueError(f"Result cache capacity and max bytes can't be negative: {capacity}, {max_bytes}")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fixer_key(self, fixer):
+        """ The key of the fixer results, the compiled schema object and the options of the fixer"""
+        return (fixer.schema_list,) + fixer.result_options()
+
+    def get(self, fixer_key, cypher: str):
+        """Gets the fixed cypher of an earlier put
+
+        Args:
+            fixer_key: identifies the fixer and the compiled schema that fixed the cypher
+            cypher (str): the cypher that was fixed
+
+        Returns:
+            str: the fixed cypher, None on a miss
+        """
+        key = (fixer_key, cypher)
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result[0]
+
+    def get_many(self, fixer_key, cyphers) -> dict:
+        """Gets the fixed cyphers of earlier puts
+
+        Args:
+            fixer_key: identifies the fixer and the compiled schema that fixed the cyphers
+            cyphers (Iterable[str]): the cyphers that were fixed
+
+        Returns:
+            Dict[str, str]: the fixed cypher of each cypher that was found
+        """
+        fixed_cyphers = {}
+        for cypher in cyphers:
+            fixed_cypher = self.get(fixer_key, cypher)
+            if fixed_cypher is not None:
+                fixed_cyphers[cypher] = fixed_cypher
+        return fixed_cyphers
+
+    def put(self, fixer_key, cypher: str, fixed_cypher: str) -> None:
+        """Caches the fixed cypher and evicts the least recently used cyphers above the bounds.
+        A cypher that alone is larger than max_bytes is not cached
+
+        Args:
+            fixer_key: identifies the fixer and the compiled schema that fixed the cypher
+            cypher (str): the cypher that was fixed
+            fixed_cypher (str): the fixed cypher
+        """
+        size = sys.getsizeof(cypher)
+        if fixed_cypher is not cypher:
+            size += sys.getsizeof(fixed_cypher)
+        if size > self.max_bytes:
+            return
+
+        key = (fixer_key, cypher)
+        with self._lock:
+            previous = self._results.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._results[key] = (fixed_cypher, size)
+            self.bytes += size
+            self._evict()
+
+    def clear(self) -> None:
+        """ Removes all results and resets the counters"""
+        with self._lock:
+            self._results.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _evict(self) -> None:
+        """ Removes the least recently used results above the capacity or the max bytes"""
+        while self._results and (len(self._results) > self.capacity or self.bytes > self.max_bytes):
+            _, (_, size) = self._results.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
 @json_serializable
 class TriplesRepository:
     """ Holds the triples and the rules for preparing them"""
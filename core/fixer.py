@@ -0,0 +1,416 @@
+"""
+The parts of the fixer engines that are the same for the stream and the AST method
+
+"""
+import asyncio
+import itertools
+import mmap
+import os
+import threading
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Iterator, List
+from core.core_classes import Triple, schema_cache
+from core.schema_rules import SchemaRules
+
+
+# The fixer of a worker process, created once by the pool initializer
+worker_fixer = None
+
+# The parser objects of each thread by fixer class and parser options, shared by all fixers with them
+thread_parsers_pool = threading.local()
+
+
+def initialize_worker(fixer_class, schema, fixer_arguments)->None:
+    """ Creates the fixer of a worker process, the schema is compiled once per worker"""
+    global worker_fixer
+    worker_fixer = fixer_class(schema, **fixer_arguments)
+
+
+def fix_chunk(cyphers)->List[str]:
+    """ Fixes a chunk of cyphers with the fixer of the worker process"""
+    return list(worker_fixer.fix_many(cyphers))
+
+
+async def iterate_async(items):
+    """ Iterates over an iterable or an async iterable"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+def pooled_thread_parsers(key, create_thread_parsers):
+    """ The parser objects of the calling thread for the key, create_thread_parsers sets them
+    as attributes of a new namespace the first time the thread asks for the key"""
+    pool = thread_parsers_pool.__dict__
+    parsers = pool.get(key)
+    if parsers is None:
+        parsers = SimpleNamespace()
+        create_thread_parsers(parsers)
+        pool[key] = parsers
+    return parsers
+
+
+class BaseFixer:
+    """
+    Long lived engine that fixes relations directions for one schema.
+    The schema is looked up once in the shared schema cache. The methods
+    implement find_triples with their own parser.
+
+    A fixer can be shared by many threads. The compiled schema is only read,
+    and every thread gets its own parser objects from create_thread_parsers,
+    so no locks are needed. The parser objects of a thread are reused by all fixers
+    with the same class and parser options, so a new fixer for every call doesn't
+    create a new parser
+
+    Args:
+        schema (str): the schema to validate against
+        result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+    """
+
+    # Cyphers shorter than this are fixed on the event loop by afix. They take about as long
+    # to fix as the hop to a thread pool, and block the loop for less than a millisecond
+    INLINE_THRESHOLD = 256
+
+    # Default number of cyphers afix_many has in executors at the same time
+    MAX_IN_FLIGHT = 16
+
+    # Number of cyphers fix_many looks up in the result cache at a time
+    CACHE_BATCH_SIZE = 256
+
+    # Number of the last distinct cyphers fix_many keeps the fixes of, so memory stays
+    # the same for any number of cyphers
+    RECENT_FIXES_SIZE = 4096
+
+    def __init__(self, schema, result_cache=None)->None:
+        self.schema = schema
+        self.schema_list = schema_cache.get_schemas(schema)
+        self.result_cache = result_cache
+        self.result_key = None if result_cache is None else result_cache.fixer_key(self)
+
+    def result_options(self)->tuple:
+        """ The fixer class and the options that can change its fixed cyphers, as keys for result caches"""
+        return (f"{type(self).__module__}.{type(self).__qualname__}",)
+
+    def __reduce__(self):
+        """ Pickles the fixer as its schema, the parsers are created again where it is unpickled.
+        The result cache is not pickled, it belongs to this process"""
+        return type(self), (self.schema,)
+
+    def parser_options(self)->tuple:
+        """ The options that create_thread_parsers uses, fixers with the same class and options share parser objects"""
+        return ()
+
+    def create_thread_parsers(self, parsers)->None:
+        """ Sets the parser objects for one thread as attributes of parsers"""
+        raise NotImplementedError
+
+    def thread_parsers(self):
+        """ The parser objects of the calling thread, they are created the first time the thread asks
+        for the fixer class and parser options, and reused for every query after that"""
+        return pooled_thread_parsers((type(self),) + self.parser_options(), self.create_thread_parsers)
+
+    def find_triples(self, cypher)->List[Triple]:
+        """ Parses the cypher and returns the triples with prepared directions"""
+        raise NotImplementedError
+
+    def release(self)->None:
+        """ Releases the parsed cypher and triples until the next query"""
+
+    def find_validated_triples(self, cypher)->List[Triple]:
+        """ Parses the cypher and validates the triples against the schema"""
+        triples = self.find_triples(cypher)
+        for triple in triples:
+            SchemaRules.evaluate_direction_change(triple, self.schema_list)
+        return triples
+
+    def fix(self, cypher)->str:
+        """Validates the relations directions in the cypher with the schema and outputs a fixed cypher
+
+        Args:
+            cypher (str): the cypher to be fixed
+
+        Returns:
+            str: the cypher with fixed relations directions, the same string object when
+            no arrow is flipped and an empty string when no triple matches the schema
+        """
+        if self.result_cache is None:
+            return self.fix_uncached(cypher)
+
+        query_fixed = self.cached_fix(cypher)
+        if query_fixed is None:
+            query_fixed = self.fix_uncached(cypher)
+            self.result_cache.put(self.result_key, cypher, query_fixed)
+        return query_fixed
+
+    def cached_fix(self, cypher):
+        """ The fixed cypher from the result cache, None on a miss"""
+        query_fixed = self.result_cache.get(self.result_key, cypher)
+        if query_fixed is not None and query_fixed == cypher:
+            # The cached cypher is an equal string, return the one of the caller
+            return cypher
+        return query_fixed
+
+    def fix_uncached(self, cypher)->str:
+        """ Fixes the cypher like fix without the result cache"""
+        triples = self.find_validated_triples(cypher)
+        query_fixed = SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples)
+        self.release()
+        return query_fixed
+
+    def fix_many(self, cyphers)->Iterator[str]:
+        """Fixes many cyphers with this fixer, in the order they are given.
+        A cypher that is one of the last RECENT_FIXES_SIZE distinct cyphers is not parsed again. With a result cache
+        the cyphers are read in batches of CACHE_BATCH_SIZE and looked up together
+
+        Args:
+            cyphers (Iterable[str]): the cyphers to be fixed
+
+        Yields:
+            str: the cyphers with fixed relations directions, as fix returns them
+        """
+        # The fixes of the last distinct cyphers, the least recently used first
+        fixed_cyphers = OrderedDict()
+        cyphers = iter(cyphers)
+        while True:
+            batch = list(itertools.islice(cyphers, self.CACHE_BATCH_SIZE))
+            if not batch:
+                return
+            if self.result_cache is not None:
+                new_cyphers = [cypher for cypher in dict.fromkeys(batch) if cypher not in fixed_cyphers]
+                for cypher, fixed_cypher in self.result_cache.get_many(self.result_key, new_cyphers).items():
+                    self.keep_recent_fix(fixed_cyphers, cypher, cypher if fixed_cypher == cypher else fixed_cypher)
+
+            for cypher in batch:
+                fixed_cypher = fixed_cyphers.get(cypher)
+                if fixed_cypher is None:
+                    fixed_cypher = self.fix_uncached(cypher)
+                    if self.result_cache is not None:
+                        self.result_cache.put(self.result_key, cypher, fixed_cypher)
+                else:
+                    fixed_cyphers.move_to_end(cypher)
+                self.keep_recent_fix(fixed_cyphers, cypher, fixed_cypher)
+                yield fixed_cypher
+
+    def keep_recent_fix(self, fixed_cyphers, cypher, fixed_cypher)->None:
+        """ Keeps the fix as the most recent one, and forgets the least recent above RECENT_FIXES_SIZE"""
+        fixed_cyphers[cypher] = fixed_cypher
+        if len(fixed_cyphers) > self.RECENT_FIXES_SIZE:
+            fixed_cyphers.popitem(last=False)
+
+    @classmethod
+    def fix_many_parallel(cls, cyphers, schema, processes=None, chunk_size=256, **fixer_arguments)->Iterator[str]:
+        """Fixes many cyphers with a pool of processes, in the order they are given.
+        Each worker creates its fixer once in the pool initializer and fixes chunks of
+        chunk_size cyphers with fix_many. At most two chunks per process are sent ahead,
+        so cyphers are read from the iterable as the results are consumed
+
+        Args:
+            cyphers (Iterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            processes (int): the number of worker processes, None for the number of CPUs
+            chunk_size (int): the number of cyphers sent to a worker at a time
+            fixer_arguments: the other arguments of the fixer, they must be picklable
+
+        Yields:
+            str: the cyphers with fixed relations directions, as fix returns them
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        processes = processes or os.cpu_count() or 1
+        max_pending_chunks = 2 * processes
+        cyphers = iter(cyphers)
+        with ProcessPoolExecutor(max_workers=processes, initializer=initialize_worker,
+                                 initargs=(cls, schema, fixer_arguments)) as executor:
+            pending_chunks = deque()
+            while True:
+                while len(pending_chunks) < max_pending_chunks:
+                    chunk = list(itertools.islice(cyphers, chunk_size))
+                    if not chunk:
+                        break
+                    pending_chunks.append(executor.submit(fix_chunk, chunk))
+                if not pending_chunks:
+                    return
+                yield from pending_chunks.popleft().result()
+
+    async def afix(self, cypher, executor=None, inline_threshold=None, semaphore=None)->str:
+        """Fixes the cypher like fix without blocking the event loop.
+        Cyphers shorter than inline_threshold are fixed directly on the event loop,
+        longer cyphers in the executor unless they are in the result cache
+
+        Args:
+            cypher (str): the cypher to be fixed
+            executor (Executor): thread or process pool, None for the default executor of the loop.
+                A process pool gets a pickled fixer that creates its own parser
+            inline_threshold (int): the length from which the cypher is sent to the executor, None for INLINE_THRESHOLD
+            semaphore (asyncio.Semaphore): shared by callers to limit the cyphers in executors at the same time
+
+        Returns:
+            str: the cypher with fixed relations directions
+        """
+        if inline_threshold is None:
+            inline_threshold = self.INLINE_THRESHOLD
+        if len(cypher) < inline_threshold:
+            return self.fix(cypher)
+
+        if self.result_cache is not None:
+            query_fixed = self.cached_fix(cypher)
+            if query_fixed is not None:
+                return query_fixed
+
+        loop = asyncio.get_running_loop()
+        if semaphore is None:
+            query_fixed = await loop.run_in_executor(executor, self.fix_uncached, cypher)
+        else:
+            async with semaphore:
+                query_fixed = await loop.run_in_executor(executor, self.fix_uncached, cypher)
+        if self.result_cache is not None:
+            self.result_cache.put(self.result_key, cypher, query_fixed)
+        return query_fixed
+
+    async def afix_many(self, cyphers, executor=None, max_in_flight=None, inline_threshold=None)->AsyncIterator[str]:
+        """Fixes many cyphers with afix, in the order they are given.
+        At most max_in_flight cyphers are fixed at the same time, and no more cyphers are read
+        until the oldest one is fixed and consumed
+
+        Args:
+            cyphers (Iterable[str] or AsyncIterable[str]): the cyphers to be fixed
+            executor (Executor): thread or process pool, None for the default executor of the loop
+            max_in_flight (int): the number of cyphers fixed at the same time, None for MAX_IN_FLIGHT
+            inline_threshold (int): the length from which a cypher is sent to the executor, None for INLINE_THRESHOLD
+
+        Yields:
+            str: the cyphers with fixed relations directions, as fix returns them
+        """
+        if max_in_flight is None:
+            max_in_flight = self.MAX_IN_FLIGHT
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        pending_fixes = deque()
+        try:
+            async for cypher in iterate_async(cyphers):
+                if len(pending_fixes) >= max_in_flight:
+                    yield await pending_fixes.popleft()
+                pending_fixes.append(asyncio.ensure_future(self.afix(cypher, executor, inline_threshold)))
+            while pending_fixes:
+                yield await pending_fixes.popleft()
+        finally:
+            for pending_fix in pending_fixes:
+                pending_fix.cancel()
+
+    def needs_fix(self, cypher)->bool:
+        """Checks if fix would flip at least one arrow in the cypher.
+        The whole cypher is parsed first, then the triples are validated one at a time and
+        the validation stops at the first triple that is flipped once one triple matches the schema.
+        No fixed cypher is built
+
+        Args:
+            cypher (str): the cypher to check
+
+        Returns:
+            bool: True if fix changes the cypher, False if fix returns it unchanged or empty
+        """
+        try:
+            has_schema_match = False
+            has_arrow_edit = False
+            for triple in self.find_triples(cypher):
+                SchemaRules.evaluate_direction_change(triple, self.schema_list)
+                has_schema_match = has_schema_match or triple.has_schema_match
+                has_arrow_edit = has_arrow_edit or SchemaRules.arrow_direction_edit(triple) is not None
+                if has_schema_match and has_arrow_edit:
+                    return True
+            return False
+        finally:
+            self.release()
+
+    def fix_patch(self, cypher):
+        """Validates the relations directions like fix, but returns only the characters that change.
+        No fixed cypher is built, SchemaRules.apply_arrow_direction_patch builds it from the patch
+
+        Args:
+            cypher (str): the cypher to be fixed
+
+        Returns:
+            Tuple[List[Tuple[int, str, str]], bool]: the patch as sorted (offset, old character, new character),
+            and if the cypher matches the schema. Without a match fix returns an empty string
+        """
+        try:
+            triples = self.find_validated_triples(cypher)
+            if not SchemaRules.has_one_schema_match(triples):
+                return [], False
+            return SchemaRules.arrow_direction_patch(cypher, triples), True
+        finally:
+            self.release()
+
+    def fix_in_place(self, buffer, start=0, end=None, encoding="utf-8")->bool:
+        """Fixes the relations directions of the cypher in buffer[start:end] in place.
+        The buffer can be a bytearray, a writable memoryview or an mmap. Flipping an
+        arrow never changes the length, so the rest of the buffer is not moved
+
+        Args:
+            buffer: the writable buffer with the encoded cypher
+            start (int): the byte position of the cypher in the buffer
+            end (int): the byte position after the cypher, None for the end of the buffer
+            encoding (str): the encoding of the cypher, it must write the arrows as single bytes like utf-8
+
+        Returns:
+            bool: True if the cypher matches the schema, False if it doesn't and the buffer
+            is unchanged, where fix returns an empty string
+        """
+        if end is None:
+            end = len(buffer)
+        cypher = bytes(buffer[start:end]).decode(encoding)
+
+        try:
+            triples = self.find_validated_triples(cypher)
+            has_schema_match = SchemaRules.has_one_schema_match(triples)
+            if has_schema_match:
+                edits = SchemaRules.arrow_direction_edits(triples)
+                if not SchemaRules.apply_arrow_direction_edits_in_place(buffer, edits, cypher, start, encoding):
+
+                    # Relations that overlap are fixed one at a time on a string
+                    fixed_cypher = SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples).encode(encoding)
+                    if len(fixed_cypher) != end - start:
+                        raise ValueError("The fixed cypher doesn't have the same length in bytes")
+                    buffer[start:end] = fixed_cypher
+        finally:
+            self.release()
+
+        return has_schema_match
+
+    def fix_file_in_place(self, path, separator=b"\n", encoding="utf-8")->int:
+        """Fixes the relations directions of all cyphers in a file in place through mmap.
+        Each cypher is decoded into a string to parse it, one at a time, so the whole file is never
+        read into memory, and the fixed arrows are written into the mapped file
+
+        Args:
+            path (str): the file with cyphers
+            separator (bytes): the bytes between the cyphers
+            encoding (str): the encoding of the file, it must write the arrows as single bytes like utf-8
+
+        Returns:
+            int: the number of cyphers that matches the schema
+        """
+        matches = 0
+        with open(path, "r+b") as file:
+            file.seek(0, 2)
+            if file.tell() == 0:
+                return 0
+
+            with mmap.mmap(file.fileno(), 0) as buffer:
+                start = 0
+                while start < len(buffer):
+                    end = buffer.find(separator, start)
+                    if end == -1:
+                        end = len(buffer)
+                    if end > start and self.fix_in_place(buffer, start, end, encoding):
+                        matches += 1
+                    start = end + len(separator)
+                buffer.flush()
+        return matches
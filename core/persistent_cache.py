@@ -0,0 +1,275 @@
+"""
+A result cache of fixed cyphers in an sqlite3 file, so a new process can fix
+the cyphers that earlier processes fixed without parsing them
+
+"""
+import atexit
+import hashlib
+import sqlite3
+import threading
+import weakref
+from pathlib import Path
+
+# The caches that are not closed, they are flushed when the process exits
+open_caches = weakref.WeakSet()
+
+
+@atexit.register
+def flush_open_caches() -> None:
+    """ Writes the pending puts and uses of the caches that were not closed"""
+    for cache in list(open_caches):
+        cache.close()
+
+
+# The packages whose code decides the fixed cyphers, relative to the repository directory
+FIXER_PACKAGES = ("core", "fixcypher_stream_method", "fixcypher_ast_method", "parse_antlr_to_cypher")
+
+
+def fixer_sources_version(directory: Path = Path(__file__).resolve().parent.parent) -> str:
+    """ A hash of the python files of the FIXER_PACKAGES in the directory, it changes with every change of the fixers"""
+    sources_hash = hashlib.blake2b(digest_size=16)
+    for package in FIXER_PACKAGES:
+        for source in sorted((directory / package).rglob("*.py")):
+            sources_hash.update(source.relative_to(directory).as_posix().encode("utf-8") + b"\0")
+            sources_hash.update(source.read_bytes() + b"\0")
+    return sources_hash.hexdigest()
+
+
+class PersistentResultCache:
+    """
+    Result cache of fixed cyphers stored in an sqlite3 database, with the same methods as ResultCache.
+    The rows are keyed by a fingerprint of the fixer options, the schema string and the cypher,
+    so they stay valid between processes. A cypher that the fixer returned unchanged is stored
+    without its text.
+
+    The file stores the VERSION of the results, with a hash of the sources of the fixers. When a file with
+    another version is opened, all its rows are deleted, so fixes from older code are not returned.
+
+    Writes and the use of the rows are kept in memory and written in one transaction every
+    batch_size puts, and by flush and close. A cache that is not closed is closed when the
+    process exits, a with block closes it when it ends. The least recently used rows are deleted when the
+    stored bytes are above max_bytes.
+
+    Several processes can share the file. The stored bytes and the last use are kept in the file
+    and read in the write transaction, so the counts and the least recently used order hold
+    for the writes of all processes
+
+    Args:
+        path (str): the sqlite3 file, ":memory:" for a database that is not saved
+        max_bytes (int): the most bytes of fixed cyphers to keep in the file
+        batch_size (int): the number of puts that are written together
+    """
+
+    # The most keys in one select, below the sqlite3 limit of variables in a statement
+    SELECT_BATCH_SIZE = 500
+
+    # The version of the table, increase it when the table changes. Changes of the fixers
+    # change the hash of their sources
+    FORMAT_VERSION = 1
+    VERSION = f"{FORMAT_VERSION}:{fixer_sources_version()}"
+
+    def __init__(self, path, max_bytes: int = 256 * 1024 * 1024, batch_size: int = 256) -> None:
+        if max_bytes < 0 or batch_size < 1:
+            raise ValueError(f"Max bytes can't be negative and batch size must be at least 1: {max_bytes}, {batch_size}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "fingerprint BLOB PRIMARY KEY, fixed_cypher TEXT, size INTEGER NOT NULL, used INTEGER NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value NOT NULL)")
+            version = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if version is None or version[0] != self.VERSION:
+                # The results were fixed by other code
+                self._connection.execute("DELETE FROM results")
+                self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (self.VERSION,))
+                self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bytes', 0)")
+            self.bytes = self._read_bytes()
+        # The order of the puts and gets since the last flush, they are stored after the uses in the file
+        self._clock = 0
+        self._flushed_clock = 0
+        self._pending_writes = {}
+        self._pending_uses = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = False
+        open_caches.add(self)
+
+    def fixer_key(self, fixer) -> str:
+        """ The key of the fixer results, the schema string and the options of the fixer"""
+        return repr((fixer.schema,) + fixer.result_options())
+
+    @staticmethod
+    def fingerprint(fixer_key: str, cypher: str) -> bytes:
+        """ The 16 byte hash that is stored as the key of the fixed cypher"""
+        text = f"{fixer_key}\0{cypher}".encode("utf-8", "surrogatepass")
+        return hashlib.blake2b(text, digest_size=16).digest()
+
+    def get(self, fixer_key, cypher: str):
+        """Gets the fixed cypher of an earlier put, from this or an earlier process
+
+        Args:
+            fixer_key: the key from fixer_key
+            cypher (str): the cypher that was fixed
+
+        Returns:
+            str: the fixed cypher, None on a miss
+        """
+        return self.get_many(fixer_key, [cypher]).get(cypher)
+
+    def get_many(self, fixer_key, cyphers) -> dict:
+        """Gets the fixed cyphers of earlier puts with one select per SELECT_BATCH_SIZE cyphers
+
+        Args:
+            fixer_key: the key from fixer_key
+            cyphers (Iterable[str]): the cyphers that were fixed
+
+        Returns:
+            Dict[str, str]: the fixed cypher of each cypher that was found
+        """
+        cyphers_by_fingerprint = {self.fingerprint(fixer_key, cypher): cypher for cypher in cyphers}
+        fixed_cyphers = {}
+        with self._lock:
+            fingerprints = []
+            for fingerprint, cypher in cyphers_by_fingerprint.items():
+                pending_write = self._pending_writes.get(fingerprint)
+                if pending_write is None:
+                    fingerprints.append(fingerprint)
+                else:
+                    fixed_cyphers[cypher] = cypher if pending_write[0] is None else pending_write[0]
+
+            for start in range(0, len(fingerprints), self.SELECT_BATCH_SIZE):
+                batch = fingerprints[start:start + self.SELECT_BATCH_SIZE]
+                rows = self._connection.execute(
+                    f"SELECT fingerprint, fixed_cypher FROM results WHERE fingerprint IN ({','.join('?' * len(batch))})",
+                    batch)
+                for fingerprint, fixed_cypher in rows:
+                    cypher = cyphers_by_fingerprint[fingerprint]
+                    fixed_cyphers[cypher] = cypher if fixed_cypher is None else fixed_cypher
+                    self._clock += 1
+                    self._pending_uses[fingerprint] = self._clock
+
+            self.hits += len(fixed_cyphers)
+            self.misses += len(cyphers_by_fingerprint) - len(fixed_cyphers)
+        return fixed_cyphers
+
+    def put(self, fixer_key, cypher: str, fixed_cypher: str) -> None:
+        """Caches the fixed cypher, it is written with the next batch
+
+        Args:
+            fixer_key: the key from fixer_key
+            cypher (str): the cypher that was fixed
+            fixed_cypher (str): the fixed cypher
+        """
+        stored_cypher = None if fixed_cypher == cypher else fixed_cypher
+        size = len(stored_cypher.encode("utf-8", "surrogatepass")) if stored_cypher else 0
+        size += 16
+        if size > self.max_bytes:
+            return
+
+        fingerprint = self.fingerprint(fixer_key, cypher)
+        with self._lock:
+            self._clock += 1
+            self._pending_writes[fingerprint] = (stored_cypher, size, self._clock)
+            if len(self._pending_writes) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """ Writes the pending puts and uses, and evicts above max_bytes"""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """ Flushes and closes the database, closing it again does nothing"""
+        with self._lock:
+            if self.closed:
+                return
+            self._flush()
+            self._connection.close()
+            self.closed = True
+            open_caches.discard(self)
+
+    def clear(self) -> None:
+        """ Removes all results from the database and resets the counters"""
+        with self._lock:
+            self._pending_writes.clear()
+            self._pending_uses.clear()
+            with self._connection:
+                self._connection.execute("DELETE FROM results")
+                self._connection.execute("UPDATE meta SET value = 0 WHERE key = 'bytes'")
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._flush()
+            return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+    def _read_bytes(self) -> int:
+        """ The stored bytes of all processes"""
+        return self._connection.execute("SELECT value FROM meta WHERE key = 'bytes'").fetchone()[0]
+
+    def _flush(self) -> None:
+        """ Writes the pending puts and uses in one transaction"""
+        if not self._pending_writes and not self._pending_uses:
+            return
+        with self._connection:
+            # Lock the file for writing before reading, other processes may have written since the last flush
+            self._connection.execute("BEGIN IMMEDIATE")
+            self.bytes = self._read_bytes()
+            # The uses since the last flush come after the last use stored by any process
+            clock_offset = self._connection.execute(
+                "SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0] - self._flushed_clock
+
+            if self._pending_writes:
+                fingerprints = list(self._pending_writes)
+                for start in range(0, len(fingerprints), self.SELECT_BATCH_SIZE):
+                    batch = fingerprints[start:start + self.SELECT_BATCH_SIZE]
+                    replaced_bytes = self._connection.execute(
+                        f"SELECT COALESCE(SUM(size), 0) FROM results WHERE fingerprint IN ({','.join('?' * len(batch))})",
+                        batch).fetchone()[0]
+                    self.bytes -= replaced_bytes
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO results (fingerprint, fixed_cypher, size, used) VALUES (?, ?, ?, ?)",
+                    [(fingerprint, fixed_cypher, size, used + clock_offset)
+                     for fingerprint, (fixed_cypher, size, used) in self._pending_writes.items()])
+                self.bytes += sum(size for _, size, _ in self._pending_writes.values())
+            if self._pending_uses:
+                self._connection.executemany(
+                    "UPDATE results SET used = ? WHERE fingerprint = ?",
+                    [(used + clock_offset, fingerprint) for fingerprint, used in self._pending_uses.items()])
+            self._pending_writes.clear()
+            self._pending_uses.clear()
+            self._flushed_clock = self._clock
+            self._evict()
+            self._connection.execute("UPDATE meta SET value = ? WHERE key = 'bytes'", (self.bytes,))
+
+    def _evict(self) -> None:
+        """ Deletes the least recently used rows above max_bytes"""
+        if self.bytes <= self.max_bytes:
+            return
+        evicted_fingerprints = []
+        evicted_bytes = 0
+        for fingerprint, size in self._connection.execute("SELECT fingerprint, size FROM results ORDER BY used"):
+            evicted_fingerprints.append((fingerprint,))
+            evicted_bytes += size
+            if self.bytes - evicted_bytes <= self.max_bytes:
+                break
+        self._connection.executemany("DELETE FROM results WHERE fingerprint = ?", evicted_fingerprints)
+        self.bytes -= evicted_bytes
+        self.evictions += len(evicted_fingerprints)
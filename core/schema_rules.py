@@ -2,7 +2,7 @@
 schema rules used to test if triples against schemas
 """
 from typing import List
-from core.core_classes import Node, Relation, Triple, DirectionFlag,Schema,RelationTypeEnum
+from core.core_classes import Node, Relation, Triple, DirectionFlag,Schema,SchemaIndex,RelationTypeEnum
 
 
 class SchemaRules:
@@ -10,16 +10,22 @@ class SchemaRules:
     Rules to check if triples should change direction
 
     """
+    # Arrows that are inserted when a direction is fixed
+    LEFT_ARROW = "<"
+    RIGHT_ARROW = ">"
+
     @staticmethod
     def validate_direction_change(triple:Triple, schemas: List[Schema]):
         """Checks against rules to see that the triple direction is valid
 
         Args:
             triple (Triple): the triple a it was parsed from the cypher (node,relation,node)
-            schemas (List[Schema]): the schemas to use when validating the triple
+            schemas (List[Schema]): the schemas to use when validating the triple,
+                a SchemaIndex is used as is and a list is indexed first
         """
         first_node = triple.first_node
         second_node = triple.second_node
+        schemas = SchemaIndex.of(schemas)
 
         has_match = False
         triple.has_schema_match = True
@@ -47,6 +53,107 @@ class SchemaRules:
 
 
 
+    @staticmethod
+    def evaluate_direction_change(triple:Triple, schemas: List[Schema]):
+        """Checks the same rules as validate_direction_change with the same results, in one evaluation.
+        The relation type of each candidate schema is classified once, then rules 2 to 6
+        are applied in order. The relation is only updated with the schema that matched
+
+        Args:
+            triple (Triple): the triple a it was parsed from the cypher (node,relation,node)
+            schemas (List[Schema]): the schemas to use when validating the triple
+        """
+        schema_index = SchemaIndex.of(schemas)
+        relation = triple.relation
+        direction = triple.direction
+        source_labels = set(triple.first_node.labels)
+        destination_labels = set(triple.second_node.labels)
+        types = set(relation.types)
+        negative_types = set(relation.negative_types)
+
+        # Relation types by schema relation, each is classified once
+        relation_types = {}
+        def relation_type_of(schema):
+            relation_type = relation_types.get(schema.relation)
+            if relation_type is None:
+                relation_type = SchemaRules.classify_relation_type(types, negative_types, schema)
+                relation_types[schema.relation] = relation_type
+            return relation_type
+
+        validated_direction = triple.schema_validated_direction
+        matched_schema = None
+
+        # Rule 2, nodes with the same labels
+        if source_labels & destination_labels:
+            matched_schema = SchemaRules.find_first_schema_with_valid_relation_type(relation, schema_index)
+
+        # Rule 6, schemas between a label of each node
+        if matched_schema is None and source_labels and destination_labels:
+            positions = set()
+            for source_label in source_labels:
+                for destination_label in destination_labels:
+                    positions.update(schema_index.with_source_and_destination(source_label, destination_label))
+                    positions.update(schema_index.with_source_and_destination(destination_label, source_label))
+
+            for position in sorted(positions):
+                schema = schema_index[position]
+                if schema.source in source_labels and schema.destination in destination_labels:
+                    validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
+                else:
+                    validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
+
+                if not direction & (DirectionFlag.SOURCE_TO_DESTINATION |
+                                    DirectionFlag.DESTINATION_TO_SOURCE |
+                                    DirectionFlag.UNDIRECTED):
+                    break
+                if RelationTypeEnum.TYPE_IS_VALID == relation_type_of(schema):
+                    matched_schema = schema
+                    break
+
+        # Rule 4, one node has missing labels
+        if matched_schema is None and len(schema_index) > 0:
+            positions = set()
+            if types and not (source_labels and destination_labels):
+                for label in source_labels or destination_labels:
+                    positions.update(schema_index.with_source(label))
+                    positions.update(schema_index.with_destination(label))
+
+            for position in sorted(positions):
+                schema = schema_index[position]
+                schema_direction, is_match = SchemaRules.missing_labels_direction(
+                    source_labels, destination_labels, types, direction, schema)
+                if is_match and RelationTypeEnum.TYPE_IS_VALID == relation_type_of(schema):
+                    validated_direction = schema_direction
+                    matched_schema = schema
+                    break
+            else:
+                # The validated direction is from the last schema, as if all schemas were checked
+                validated_direction, _ = SchemaRules.missing_labels_direction(
+                    source_labels, destination_labels, types, direction, schema_index[-1])
+
+        # Rule 5, no relation type and at least one label
+        if matched_schema is None and not types and not negative_types:
+            position, schema_direction = SchemaRules.find_first_schema_for_labels(
+                source_labels, destination_labels, schema_index)
+            if position is not None:
+                validated_direction = schema_direction
+                matched_schema = schema_index[position]
+
+        if matched_schema is None:
+            triple.has_schema_match = False
+            triple.schema_validated_direction = validated_direction
+            return
+
+        # Rule 3 and 7, undirected or variable length relations keep the direction
+        triple.has_schema_match = True
+        if (direction & DirectionFlag.UNDIRECTED and RelationTypeEnum.NOT_VALID != relation_type_of(schema_index[0])) or \
+            SchemaRules.relation_has_variable_length(triple):
+            validated_direction = direction
+        triple.schema_validated_direction = validated_direction
+
+        relation.valid_schema = matched_schema
+        relation.schema_validated_relation_type = relation_type_of(matched_schema)
+
     # Rule 2
     @staticmethod
     def has_same_labels(triple:Triple,schemas: List[Schema]):
@@ -60,13 +167,16 @@ class SchemaRules:
         Returns:
             bool: return True if match, else false
         """
-        for schema in schemas:
-            relation_type = SchemaRules.validate_relation_type(triple.relation,schema)
+        if not SchemaRules.has_at_least_one_intersection(triple.first_node.labels, triple.second_node.labels):
+            return False
 
-            if SchemaRules.has_at_least_one_intersection(triple.first_node.labels, triple.second_node.labels):
-                if RelationTypeEnum.NOT_VALID != relation_type:
-                    return True
-        return False
+        # Any schema with a relation type that is not invalid matches
+        schema = SchemaRules.find_first_schema_with_valid_relation_type(triple.relation, SchemaIndex.of(schemas))
+        if schema is None:
+            return False
+
+        SchemaRules.validate_relation_type(triple.relation,schema)
+        return True
 
     # Rule 3
     @staticmethod
@@ -80,15 +190,12 @@ class SchemaRules:
         Returns:
             bool: return True if match, else false
         """
-        for schema in schemas:
-            relation_type = SchemaRules.validate_relation_type(triple.relation,schema)
-            if triple.direction & DirectionFlag.UNDIRECTED:
+        if len(schemas) == 0 or not triple.direction & DirectionFlag.UNDIRECTED:
+            return False
 
-                if RelationTypeEnum.NOT_VALID != relation_type:
-                    return True
-                else:
-                    return False
-        return False
+        # Only the relation type of the first schema is checked
+        relation_type = SchemaRules.validate_relation_type(triple.relation,schemas[0])
+        return RelationTypeEnum.NOT_VALID != relation_type
 
     # Rule 4
     @staticmethod
@@ -111,46 +218,80 @@ class SchemaRules:
         Returns:
             bool: return True if match, else false
         """
+        schema_index = SchemaIndex.of(schemas)
+        if len(schema_index) == 0:
+            return False
+
+        # Only schemas with one of the types and a label of the node with labels can match
+        positions = set()
+        if len(source_node.labels) == 0 or len(destination_node.labels) == 0:
+            for label in source_node.labels or destination_node.labels:
+                positions.update(schema_index.with_source(label))
+                positions.update(schema_index.with_destination(label))
+
+        types = set(triple.relation.types)
+        for position in sorted(positions):
+            schema = schema_index[position]
+            if schema.relation in types and \
+                SchemaRules.one_node_has_missing_labels_match(source_node, destination_node, triple, schema):
+                return True
+
+        # The validated direction is from the last schema, as if all schemas were checked
+        SchemaRules.one_node_has_missing_labels_match(source_node, destination_node, triple, schema_index[-1])
+        return False
+
+    @staticmethod
+    def one_node_has_missing_labels_match(source_node: Node, destination_node: Node, triple:Triple, schema: Schema)->bool:
+        """ Checks rule 4 against one schema and sets the schema validated direction
+
+        Returns:
+            bool: return True if match, else false
+        """
+        relation_type = SchemaRules.validate_relation_type(triple.relation,schema)
 
-        for schema in schemas:
-            relation_type = SchemaRules.validate_relation_type(triple.relation,schema)
+        triple.schema_validated_direction, is_match = SchemaRules.missing_labels_direction(
+            source_node.labels, destination_node.labels, triple.relation.types, triple.direction, schema)
 
-            change_direction = (schema.source!=schema.destination)
-            triple.schema_validated_direction = triple.direction
+        return is_match and RelationTypeEnum.TYPE_IS_VALID == relation_type
 
-            if schema.relation in triple.relation.types:
-                if schema.source in source_node.labels and \
-                    len(destination_node.labels)==0:
+    @staticmethod
+    def missing_labels_direction(source_labels, destination_labels, types, direction: DirectionFlag, schema: Schema):
+        """ The direction of rule 4 for one schema, when one of the nodes has no labels
 
-                    if change_direction:
-                        triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
+        Returns:
+            Tuple[DirectionFlag, bool]: the schema validated direction, and if the schema
+            has one of the types and fits the node with labels
+        """
+        change_direction = (schema.source!=schema.destination)
 
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        return True
-                elif schema.source in destination_node.labels and \
-                    len(source_node.labels)==0:
+        if schema.relation in types:
+            if schema.source in source_labels and \
+                len(destination_labels)==0:
 
-                    if change_direction:
-                        triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        return True
+                if change_direction:
+                    return DirectionFlag.SOURCE_TO_DESTINATION, True
+                return direction, True
+            elif schema.source in destination_labels and \
+                len(source_labels)==0:
 
-                elif schema.destination in source_node.labels and \
-                    len(destination_node.labels)==0:
+                if change_direction:
+                    return DirectionFlag.DESTINATION_TO_SOURCE, True
+                return direction, True
 
-                    if change_direction:
-                        triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        return True
-                elif schema.destination in destination_node.labels and \
-                    len(source_node.labels)==0:
+            elif schema.destination in source_labels and \
+                len(destination_labels)==0:
 
-                    if change_direction:
-                        triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        return True
+                if change_direction:
+                    return DirectionFlag.DESTINATION_TO_SOURCE, True
+                return direction, True
+            elif schema.destination in destination_labels and \
+                len(source_labels)==0:
 
-        return False
+                if change_direction:
+                    return DirectionFlag.SOURCE_TO_DESTINATION, True
+                return direction, True
+
+        return direction, False
 
     # Rule 5
     @staticmethod
@@ -165,27 +306,52 @@ class SchemaRules:
         Returns:
             bool: return True if match, else false
         """
+        schema_index = SchemaIndex.of(schemas)
+        relation = triple.relation
+        if len(schema_index) == 0 or len(relation.types) > 0 or len(relation.negative_types) > 0:
+            return False
 
-        for schema in schemas:
-            relation_type = SchemaRules.validate_relation_type(triple.relation,schema)
-            if  RelationTypeEnum.TYPE_IS_EMPTY == relation_type:
-                if schema.source in source_node.labels and schema.destination in destination_node.labels:
-                    triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    return True
-                elif (schema.source in source_node.labels and len(destination_node.labels)==0) or\
-                     (len(source_node.labels)==0 and schema.destination in destination_node.labels):
-                    triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    return True
+        position, schema_direction = SchemaRules.find_first_schema_for_labels(
+            source_node.labels, destination_node.labels, schema_index)
+        if position is None:
+            return False
 
-                if schema.source in destination_node.labels and schema.destination in source_node.labels:
-                    triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
-                    return True
-                elif (schema.source in destination_node.labels and len(source_node.labels)==0) or\
-                     (len(destination_node.labels)==0 and schema.destination in source_node.labels):
-                    triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
-                    return True
+        triple.schema_validated_direction = schema_direction
+        SchemaRules.validate_relation_type(relation,schema_index[position])
+        return True
 
-        return False
+    @staticmethod
+    def find_first_schema_for_labels(source_labels, destination_labels, schema_index: SchemaIndex):
+        """ Finds the first schema for rule 5, from a source label to a destination label,
+            or from or to the only node with labels
+
+        Returns:
+            Tuple[int, DirectionFlag]: the position of the schema and the direction,
+            the position is None when no schema fits
+        """
+        source_to_destination = []
+        destination_to_source = []
+        for source_label in source_labels:
+            for destination_label in destination_labels:
+                source_to_destination += schema_index.with_source_and_destination(source_label, destination_label)[:1]
+                destination_to_source += schema_index.with_source_and_destination(destination_label, source_label)[:1]
+        if len(destination_labels) == 0:
+            for label in source_labels:
+                source_to_destination += schema_index.with_source(label)[:1]
+                destination_to_source += schema_index.with_destination(label)[:1]
+        if len(source_labels) == 0:
+            for label in destination_labels:
+                source_to_destination += schema_index.with_destination(label)[:1]
+                destination_to_source += schema_index.with_source(label)[:1]
+
+        if not source_to_destination and not destination_to_source:
+            return None, None
+
+        # The first schema wins, source to destination is checked first on the same schema
+        first_position = min(source_to_destination + destination_to_source)
+        if first_position in source_to_destination:
+            return first_position, DirectionFlag.SOURCE_TO_DESTINATION
+        return first_position, DirectionFlag.DESTINATION_TO_SOURCE
 
     # Rule 6
     @staticmethod
@@ -199,80 +365,37 @@ class SchemaRules:
         Returns:
             bool: return True if match, else false
         """
+        schema_index = SchemaIndex.of(schemas)
 
+        # Only schemas between a label of each node can match
+        positions = set()
+        for source_label in source_node.labels:
+            for destination_label in destination_node.labels:
+                positions.update(schema_index.with_source_and_destination(source_label, destination_label))
+                positions.update(schema_index.with_source_and_destination(destination_label, source_label))
 
-        for schema in schemas:
+        for position in sorted(positions):
+            schema = schema_index[position]
             relation_type = SchemaRules.validate_relation_type(triple.relation,schema)
+
             # Cypher: (:Person) [X] (:Organization), Schema: (:Person)-[:WORKS_AT]->(:Organization)
             if  schema.source in source_node.labels and \
                 schema.destination in destination_node.labels:
                 triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
 
-                # (:Person)-[X]->(:Organization)
-                if triple.direction & DirectionFlag.SOURCE_TO_DESTINATION:
-
-                    # triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    if  RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        triple.has_schema_match = True
-                        return True
-                    else:
-                        continue
-
-                # (:Person)<-[X]-(:Organization)
-                elif triple.direction & DirectionFlag.DESTINATION_TO_SOURCE:
-
-                    # triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
-                    # triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        triple.has_schema_match = True
-                        return True
-                    else:
-                        continue
-                elif triple.direction & DirectionFlag.UNDIRECTED:
-
-                    # triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        triple.has_schema_match = True
-                        return True
-                    else:
-                        continue
-                else:
-                    return False
-
             # Cypher: (:Organization) [X] (:Person), Schema: (:Person)-[:WORKS_AT]->(:Organization)
-            elif   schema.source in destination_node.labels and\
-                   schema.destination in source_node.labels:
+            else:
                 triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
 
-                # (:Organization)-[X]->(:Person)
-                if triple.direction & DirectionFlag.SOURCE_TO_DESTINATION:
-
-                    # triple.schema_validated_direction = DirectionFlag.DESTINATION_TO_SOURCE
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        triple.has_schema_match = True
-                        return True
-                    else:
-                        continue
-
-                # (:Organization)<-[X]-(:Person)
-                elif triple.direction & DirectionFlag.DESTINATION_TO_SOURCE:
-
-                    # triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        triple.has_schema_match = True
-                        return True
-                    else:
-                        continue
-                elif triple.direction & DirectionFlag.UNDIRECTED:
-
-                    # triple.schema_validated_direction = DirectionFlag.SOURCE_TO_DESTINATION
-                    if RelationTypeEnum.TYPE_IS_VALID == relation_type:
-                        triple.has_schema_match = True
-                        return True
-                    else:
-                        continue
-                else:
-                    return False
+            # (:Person)-[X]->(:Organization), (:Person)<-[X]-(:Organization) or (:Person)-[X]-(:Organization)
+            if not triple.direction & (DirectionFlag.SOURCE_TO_DESTINATION |
+                                       DirectionFlag.DESTINATION_TO_SOURCE |
+                                       DirectionFlag.UNDIRECTED):
+                return False
+
+            if RelationTypeEnum.TYPE_IS_VALID == relation_type:
+                triple.has_schema_match = True
+                return True
         return False
 
     # Rule 7
@@ -305,30 +428,74 @@ class SchemaRules:
         Returns:
             bool: if relation is valid according to schemas
         """
-        types_count = len(relation.types)
-        negative_types_count = len(relation.negative_types)
-        relation.schema_validated_relation_type = RelationTypeEnum.NOT_VALID
+        relation_type = SchemaRules.classify_relation_type(relation.types, relation.negative_types, schema)
 
-        # If both is empty then it is a valid relation pattern
-        if types_count==0 and negative_types_count==0:
+        # Keeps the last schema that the relation type is valid for
+        relation.schema_validated_relation_type = relation_type
+        if RelationTypeEnum.NOT_VALID != relation_type:
             relation.valid_schema = schema
-            relation.schema_validated_relation_type = RelationTypeEnum.TYPE_IS_EMPTY
+
+        return relation.schema_validated_relation_type
+
+    @staticmethod
+    def classify_relation_type(types, negative_types, schema: Schema)->RelationTypeEnum:
+        """Classifies the relation types against the relation type of a schema, without changing the relation
+
+        Args:
+            types: the types of the relation
+            negative_types: the negative types of the relation
+            schema (Schema): the schema with the relation type
+
+        Returns:
+            RelationTypeEnum: empty when the relation has no types, not valid if the schema relation
+            is a negative type or not one of the types, else valid
+        """
+        # If both is empty then it is a valid relation pattern
+        if len(types)==0 and len(negative_types)==0:
+            return RelationTypeEnum.TYPE_IS_EMPTY
 
         # If any type in negative types, then it is not valid, else valid
-        elif negative_types_count>0:
-            if schema.relation in relation.negative_types:
-                relation.schema_validated_relation_type =  RelationTypeEnum.NOT_VALID
-            else:
-                relation.valid_schema = schema
-                relation.schema_validated_relation_type =  RelationTypeEnum.TYPE_IS_VALID
+        if len(negative_types)>0:
+            if schema.relation in negative_types:
+                return RelationTypeEnum.NOT_VALID
+            return RelationTypeEnum.TYPE_IS_VALID
 
         # If any type in types, then it is valid
-        elif types_count>0:
-            if schema.relation in relation.types:
-                relation.valid_schema = schema
-                relation.schema_validated_relation_type =  RelationTypeEnum.TYPE_IS_VALID
+        if schema.relation in types:
+            return RelationTypeEnum.TYPE_IS_VALID
+        return RelationTypeEnum.NOT_VALID
 
-        return relation.schema_validated_relation_type
+    @staticmethod
+    def find_first_schema_with_valid_relation_type(relation: Relation, schema_index: SchemaIndex)->Schema:
+        """Finds the first schema the relation type is not invalid for, see validate_relation_type
+
+        Returns:
+            Schema: the first schema, None if the relation type is invalid for all schemas
+        """
+        if len(schema_index) == 0:
+            return None
+
+        # Valid for all schemas
+        if len(relation.types)==0 and len(relation.negative_types)==0:
+            return schema_index[0]
+
+        # Valid for the first schema without a negative type
+        if len(relation.negative_types)>0:
+            invalid_positions = set()
+            for negative_type in set(relation.negative_types):
+                invalid_positions.update(schema_index.with_relation(negative_type))
+            for position in range(len(schema_index)):
+                if position not in invalid_positions:
+                    return schema_index[position]
+            return None
+
+        # Valid for the first schema with one of the types
+        positions = [schema_index.with_relation(relation_type)[0]
+                     for relation_type in set(relation.types)
+                     if schema_index.with_relation(relation_type)]
+        if not positions:
+            return None
+        return schema_index[min(positions)]
 
     @staticmethod
     def has_at_least_one_intersection(list1: List[str], list2: List[str])->bool:
@@ -350,24 +517,213 @@ class SchemaRules:
 
     @staticmethod
     def fix_all_arrow_directions_from_triples( cypher,triples: List[Triple]) -> str:
-        """Fixes all triples arrow directions that needs to be changed
+        """Fixes all triples arrow directions that needs to be changed.
+        The fixes are collected as edits and the fixed cypher is built in one pass
 
         Returns:
-            str: returns the fixed cypher
+            str: returns the fixed cypher, the cypher itself when no arrow is flipped
         """
-        fixed_cypher = cypher
-        one_triple_has_schema_match = False
+        if not SchemaRules.has_one_schema_match(triples):
+            return ""
+
+        edits = SchemaRules.arrow_direction_edits(triples)
+        if not edits:
+            # Nothing to flip, the same string object is returned without a copy
+            return cypher
 
-        # The direction is not important, but for future changes it is more lasting
+        fixed_cypher = SchemaRules.apply_arrow_direction_edits(cypher, edits)
+        if fixed_cypher is not None:
+            return fixed_cypher
+
+        # Relations that overlap or are outside of the cypher are fixed one at a time
+        fixed_cypher = cypher
         for triple in reversed(triples):
             fixed_cypher = SchemaRules.fix_arrow_direction_if_needed(triple, fixed_cypher)
+        return fixed_cypher
+
+    @staticmethod
+    def has_one_schema_match(triples: List[Triple]) -> bool:
+        """ True if at least one of the triples matches the schema, else the cypher is not fixed"""
+        for triple in triples:
             if triple.has_schema_match:
-                one_triple_has_schema_match = True
+                return True
+        return False
 
-        if one_triple_has_schema_match is False:
-            return ""
+    @staticmethod
+    def arrow_direction_edits(triples: List[Triple]) -> list:
+        """ The edits of all triples that change direction, see arrow_direction_edit"""
+        edits = []
+        for triple in triples:
+            edit = SchemaRules.arrow_direction_edit(triple)
+            if edit is not None:
+                edits.append(edit)
+        return edits
 
-        return fixed_cypher
+    @staticmethod
+    def arrow_direction_edit(triple: Triple):
+        """The edit that fix_arrow_direction_if_needed would do on the triple
+
+        Args:
+            triple (Triple): triple of node, relation, node to fix direction on
+
+        Returns:
+            Tuple[int, int, str]: the position of the first and the last character of the
+            relation to rewrite, and the new arrow "<" or ">". None when nothing changes
+        """
+        if triple.change_direction():
+            if triple.direction & DirectionFlag.SOURCE_TO_DESTINATION:
+                if triple.relation.left_position2 > 0:
+                    return triple.relation.left_position2, triple.relation.right_position2, SchemaRules.LEFT_ARROW
+            elif triple.direction & DirectionFlag.DESTINATION_TO_SOURCE:
+                if triple.relation.left_position1 > 0:
+                    return triple.relation.left_position1, triple.relation.right_position1, SchemaRules.RIGHT_ARROW
+        return None
+
+    @staticmethod
+    def apply_arrow_direction_edits(cypher, edits) -> str:
+        """Builds the fixed cypher from the edits in one pass with str.join.
+
+        A new left arrow is inserted at the first position and the character at the last
+        position is removed, a new right arrow removes the first character and is inserted
+        after the last. The characters between move one step, so the length stays the same
+
+        Args:
+            cypher: The original string.
+            edits: the edits from arrow_direction_edit
+
+        Return:
+            The fixed string, None if the edits overlap or are outside of the cypher
+        """
+        parts = []
+        previous_end = 0
+        for start, end, arrow in sorted(edits):
+            if start < previous_end or end < start or end >= len(cypher):
+                return None
+
+            parts.append(cypher[previous_end:start])
+            if arrow == SchemaRules.LEFT_ARROW:
+                parts.append(arrow)
+                parts.append(cypher[start:end])
+            else:
+                parts.append(cypher[start + 1:end + 1])
+                parts.append(arrow)
+            previous_end = end + 1
+
+        parts.append(cypher[previous_end:])
+        return "".join(parts)
+
+    @staticmethod
+    def arrow_direction_patch(cypher, triples: List[Triple]) -> list:
+        """The characters that fix_all_arrow_directions_from_triples changes, without building the fixed cypher.
+        A flip moves the characters between the removed and the inserted arrow one step,
+        so every moved character that differs from the one before it is in the patch,
+        e.g. (a)<--(b) gives [(3, "<", "-"), (5, "-", ">")]
+
+        Args:
+            cypher: The original string.
+            triples: the validated triples of the cypher
+
+        Returns:
+            List[Tuple[int, str, str]]: sorted (offset, old character, new character),
+            apply it with apply_arrow_direction_patch
+        """
+        edits = sorted(SchemaRules.arrow_direction_edits(triples))
+        patch = []
+        previous_end = 0
+        for start, end, arrow in edits:
+            if start < previous_end or end < start or end >= len(cypher):
+                # Relations that overlap are fixed one at a time, then compared
+                fixed_cypher = SchemaRules.fix_all_arrow_directions_from_triples(cypher, triples)
+                return [(offset, old_character, new_character)
+                        for offset, (old_character, new_character) in enumerate(zip(cypher, fixed_cypher))
+                        if old_character != new_character]
+            previous_end = end + 1
+
+            old_characters = cypher[start:end + 1]
+            if arrow == SchemaRules.LEFT_ARROW:
+                new_characters = arrow + cypher[start:end]
+            else:
+                new_characters = cypher[start + 1:end + 1] + arrow
+            patch.extend(change for change in zip(range(start, end + 1), old_characters, new_characters)
+                         if change[1] != change[2])
+        return patch
+
+    @staticmethod
+    def apply_arrow_direction_patch(cypher, patch) -> str:
+        """Applies a patch from arrow_direction_patch to the cypher it was made for
+
+        Args:
+            cypher: The original string.
+            patch: sorted (offset, old character, new character)
+
+        Raises:
+            ValueError: if a character at an offset is not the old character of the patch
+
+        Return:
+            The fixed string.
+        """
+        parts = []
+        previous_offset = 0
+        for offset, old_character, new_character in patch:
+            if cypher[offset:offset + 1] != old_character:
+                raise ValueError(f"The patch expects {old_character!r} at {offset} but it is {cypher[offset:offset + 1]!r}")
+            parts.append(cypher[previous_offset:offset])
+            parts.append(new_character)
+            previous_offset = offset + 1
+        parts.append(cypher[previous_offset:])
+        return "".join(parts)
+
+    @staticmethod
+    def apply_arrow_direction_edits_in_place(buffer, edits, cypher, offset=0, encoding="utf-8") -> bool:
+        """Writes the edits directly into a writable buffer that holds the encoded cypher,
+        like a bytearray, a memoryview or an mmap. The length never changes, so nothing
+        after the cypher moves
+
+        Args:
+            buffer: the writable buffer
+            edits: the edits from arrow_direction_edit, with character positions in the cypher
+            cypher (str): the decoded cypher, to convert character positions to byte positions
+            offset (int): the byte position of the cypher in the buffer
+            encoding (str): the encoding of the cypher, it must write the arrows as single bytes like utf-8
+
+        Returns:
+            bool: True if written, False if nothing was written because the edits overlap,
+            are outside of the cypher or the removed arrow is not a single byte
+        """
+        edits = sorted(edits)
+        previous_end = 0
+        for start, end, arrow in edits:
+            if start < previous_end or end < start or end >= len(cypher):
+                return False
+            removed_character = cypher[end] if arrow == SchemaRules.LEFT_ARROW else cypher[start]
+            if len(removed_character.encode(encoding)) != 1:
+                return False
+            previous_end = end + 1
+
+        # Character positions to byte positions, in one pass over the sorted positions
+        byte_positions = {}
+        is_ascii = cypher.isascii()
+        character_position = 0
+        byte_position = offset
+        for position in sorted({position for start, end, _ in edits for position in (start, end)}):
+            if is_ascii:
+                byte_position += position - character_position
+            else:
+                byte_position += len(cypher[character_position:position].encode(encoding))
+            character_position = position
+            byte_positions[position] = byte_position
+
+        arrow_bytes = {arrow: arrow.encode(encoding) for arrow in (SchemaRules.LEFT_ARROW, SchemaRules.RIGHT_ARROW)}
+        for start, end, arrow in edits:
+            byte_start = byte_positions[start]
+            byte_end = byte_positions[end]
+            if arrow == SchemaRules.LEFT_ARROW:
+                buffer[byte_start + 1:byte_end + 1] = bytes(buffer[byte_start:byte_end])
+                buffer[byte_start:byte_start + 1] = arrow_bytes[arrow]
+            else:
+                buffer[byte_start:byte_end] = bytes(buffer[byte_start + 1:byte_end + 1])
+                buffer[byte_end:byte_end + 1] = arrow_bytes[arrow]
+        return True
 
     @staticmethod
     def fix_arrow_direction_if_needed( triple: Triple, fixed_cypher: str) -> str:
@@ -417,7 +773,7 @@ class SchemaRules:
                 cypher,
                 existing_right_arrow_position,
             )
-            cypher = SchemaRules.insert_char(cypher, new_left_arrow_position, "<")
+            cypher = SchemaRules.insert_char(cypher, new_left_arrow_position, SchemaRules.LEFT_ARROW)
 
         return cypher
 
@@ -442,7 +798,7 @@ class SchemaRules:
                 cypher,
                 existing_left_arrow_position,
             )
-            cypher = SchemaRules.insert_char(cypher, new_right_arrow_position, ">")
+            cypher = SchemaRules.insert_char(cypher, new_right_arrow_position, SchemaRules.RIGHT_ARROW)
 
         return cypher
 
@@ -1,27 +1,34 @@
-from antlr4 import InputStream,CommonTokenStream,ParseTreeWalker
-from antlr4.error.ErrorListener import ConsoleErrorListener,ErrorListener
-
 from fixcypher_ast_method.fixdirections_astmethod import (
-    FixRelationsDirectionsLexer,
-    FixRelationsDirectionsParser,
-    CypherParserListener
+    CypherParserListener,
+    CypherParseListener,
+    parse_triples,
+    pooled_parsers
 )
-from core.core_classes import (Node,Relation,Triple,NodeFlag,TriplesRepository)
+from fixcypher_ast_method.regex_lexer import RegexLexer
 
 
 class CypherParser:
     """
-    A class for parsing Cypher queries
+    A class for parsing Cypher queries. The lexer, parser and walker are the ones of the calling thread
+    that Fixer uses with the same token options, only the listeners and the triples belong to this parser
 
     Args:
-        cypher (str): The Cypher query to parse
-        schema (str): The database schema to use for parsing
+        two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+        filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+        build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+        regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
     """
 
-    def __init__(self):
+    def __init__(self, two_stage=False, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
         self.cypher = None
+        self.two_stage = two_stage
+        self.filter_tokens = filter_tokens
+        self.build_parse_trees = build_parse_trees
+        # The generated lexer is used when it has other rules than RegexLexer was written for
+        self.regex_lexer = regex_lexer and RegexLexer.MATCHES_GENERATED_LEXER
         self.antlr_listener = CypherParserListener()
         self.triples_repository = self.antlr_listener.triples_repository
+        self.parse_listener = CypherParseListener(self.triples_repository)
 
     def reset(self):
         """ Reset repository """
@@ -39,27 +46,9 @@ class CypherParser:
 
     def find_triples(self):
         """ Find all triples in the cypher"""
-
-
-        inputStream = InputStream(self.cypher)
-
-        lexer = FixRelationsDirectionsLexer(inputStream)
-        lexer.removeErrorListener(ConsoleErrorListener.INSTANCE)
-        #lexer.addErrorListener(my_parser_error_listener)
-        tokens = CommonTokenStream(lexer)
-
-        parser = FixRelationsDirectionsParser(tokens)
-
-        parser.removeErrorListeners() # Removes the default error listener
-        #parser.addErrorListener(my_parser_error_listener) # Adds our custom error listener
-
-        tree = parser.start()
-
-        walker = ParseTreeWalker()
-        walker.walk(self.antlr_listener, tree)
+        parsers = pooled_parsers(self.filter_tokens, self.regex_lexer)
+        parse_triples(parsers, self.cypher, self.antlr_listener, self.parse_listener, self.two_stage,
+                      self.build_parse_trees, report_errors=False)
 
         # Validates all triples
         self.antlr_listener.triples_repository.validate_all_triples()
-
-
-
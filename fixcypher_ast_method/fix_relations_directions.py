@@ -201,6 +201,105 @@ class CypherParserListener(FixRelationsDirectionsListener):
             text = text[:-1]
         return text
 
+class CypherParseListener(CypherParserListener):
+    """ Parse listener that finds the triples while the parser parses, so no parse tree has to be built and walked.
+    The parser gives the rule contexts their tokens but not their sub rules, so the
+    nodes, labels, types and relations are kept when their rules are exited and put
+    together into triples when the triple is exited
+
+    Args:
+        triples_repository (TriplesRepository): the repository to save the triples in, None for a new repository
+    """
+
+    def __init__(self, triples_repository=None)->None:
+        super().__init__()
+        if triples_repository is not None:
+            self.triples_repository = triples_repository
+        self.reset()
+
+    def reset(self)->None:
+        """ Forgets the parts of an unfinished triple"""
+        self.nodes = []
+        self.relations = []
+        self.labels = []
+        self.types = []
+        self.negative_types = []
+        self.variable_length = False
+
+    def enterTriple(self, ctx: FixRelationsDirectionsParser.TripleContext):
+        """ The triples are found when they are exited"""
+
+    def exitLabel_expression(self, ctx: FixRelationsDirectionsParser.Label_expressionContext):
+        """ Keeps the labels for the node"""
+        self.labels = [self.replace_first_and_last_backtick(name.getText()) for name in ctx.NAME()]
+
+    def exitNodeWithVariableAndLabel(self, ctx: FixRelationsDirectionsParser.NodeWithVariableAndLabelContext):
+        """ Creates the node with the labels of the label expression"""
+        self.exit_node(ctx)
+
+    def exitNodeWithVariable(self, ctx: FixRelationsDirectionsParser.NodeWithVariableContext):
+        """ Creates the node without labels"""
+        self.exit_node(ctx)
+
+    def exit_node(self, ctx)->None:
+        """ Creates the node and saves its variable and labels"""
+        node_flag = NodeFlag.NONE
+        variable = None
+        labels = self.labels
+        self.labels = []
+        if labels:
+            node_flag = node_flag|NodeFlag.HAS_LABELS
+        if ctx.NAME() is not None:
+            variable = self.replace_first_and_last_backtick(ctx.NAME().getText())
+            node_flag = node_flag|NodeFlag.HAS_VARIABLE
+
+        node = Node(variable,labels,node_flag)
+        node.position = ctx.LPAREN().symbol.start
+        self.nodes.append(node)
+        self.triples_repository.save_node_variable_and_label(node)
+
+    def exitType_name(self, ctx: FixRelationsDirectionsParser.Type_nameContext):
+        """ Keeps the type for the relation"""
+        type_name = self.replace_first_and_last_backtick(ctx.NAME().getText())
+        if ctx.NEGATION() is not None:
+            self.negative_types.append(type_name)
+        else:
+            self.types.append(type_name)
+
+    def exitVariable_length(self, ctx: FixRelationsDirectionsParser.Variable_lengthContext):
+        """ Keeps that the relation has variable length"""
+        self.variable_length = True
+
+    def exitRelation(self, ctx: FixRelationsDirectionsParser.RelationContext):
+        """ Creates the relation with the kept types"""
+        relation = Relation()
+        relation.types = self.types
+        relation.negative_types = self.negative_types
+        relation.left = ""
+        relation.left_position1 = -1
+        relation.left_position2 = -1
+        relation.right = ""
+        relation.right_position1 = -1
+        relation.right_position2 = -1
+        relation.variable_length = self.variable_length
+        relation.status = RelationFlag.NONE
+        relation.variable = ''
+        self.set_arrow_positions(ctx,relation)
+        self.relations.append(relation)
+
+        self.types = []
+        self.negative_types = []
+        self.variable_length = False
+
+    def exitTriple(self, ctx: FixRelationsDirectionsParser.TripleContext):
+        """ Adds the triples of the nodes and relations between them"""
+        for node_index in range(1,len(self.nodes)):
+            triple = Triple(self.nodes[node_index - 1],self.relations[node_index - 1],self.nodes[node_index])
+            self.triples_repository.triples.append(triple)
+        self.nodes = []
+        self.relations = []
+
+
 class MyErrorListener(ErrorListener):
     """ Custom error listener"""
 
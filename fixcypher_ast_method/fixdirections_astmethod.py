@@ -3,57 +3,397 @@ This module contains a function to fix directions of the arrows
 in cyphers e.g. (:Person)-[]->(:Car) could be changed to (:Person)<-[]-(:Car)
 
 """
+import sys
+import warnings
 from antlr4 import InputStream,CommonTokenStream,ParseTreeWalker
-from fixcypher_ast_method.fix_relations_directions  import MyErrorListener,CypherParserListener
-from core.core_classes import SchemaParser
-from core.schema_rules import SchemaRules
+from antlr4.PredictionContext import PredictionContextCache
+from antlr4.atn.LexerATNSimulator import LexerATNSimulator
+from antlr4.atn.ParserATNSimulator import ParserATNSimulator
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.dfa.DFA import DFA
+from antlr4.error.ErrorStrategy import BailErrorStrategy,DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+from fixcypher_ast_method.fix_relations_directions  import MyErrorListener,CypherParserListener,CypherParseListener
+from fixcypher_ast_method.pattern_token_source import PatternTokenSource
+from fixcypher_ast_method.regex_lexer import RegexLexer
+from core.fixer import BaseFixer,pooled_thread_parsers
 from parse_antlr_to_cypher.FixRelationsDirectionsParser import FixRelationsDirectionsParser
 from parse_antlr_to_cypher.FixRelationsDirectionsLexer import FixRelationsDirectionsLexer
 
 
+def parse_two_stage(parser, tokens):
+    """Parses the tokens with the fast SLL prediction first and bails out at the first syntax error.
+    Only when SLL fails the tokens are parsed again with full LL prediction and the default error
+    strategy, which gives the same tree as always parsing with LL. The error listeners are only
+    told about errors of the LL parse
+
+    Args:
+        parser (FixRelationsDirectionsParser): the parser with the token stream set
+        tokens (CommonTokenStream): the token stream of the parser
+
+    Returns:
+        StartContext: the parse tree
+    """
+    error_listeners = parser._listeners
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    parser.removeErrorListeners()
+    try:
+        return parser.start()
+    except ParseCancellationException:
+        pass
+    finally:
+        parser._interp.predictionMode = PredictionMode.LL
+        parser._errHandler = DefaultErrorStrategy()
+        parser._listeners = error_listeners
+
+    tokens.seek(0)
+    parser.reset()
+    return parser.start()
+
+
+def parse_without_tree(parser, tokens, parse_listener, two_stage=False):
+    """Parses the tokens without building a parse tree, the parse listener finds the triples while parsing.
+    The error listeners are detached, and when the parse has a syntax error, or SLL fails with two_stage,
+    the listener is reset and the tokens are parsed again with a parse tree, which gives the same
+    tree and error messages as always building it
+
+    Args:
+        parser (FixRelationsDirectionsParser): the parser with the token stream set
+        tokens (CommonTokenStream): the token stream of the parser
+        parse_listener (CypherParseListener): the listener that finds the triples during the parse
+        two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+
+    Returns:
+        StartContext: the parse tree to walk, None when the parse listener found the triples
+    """
+    error_listeners = parser._listeners
+    parser.removeErrorListeners()
+    parser.buildParseTrees = False
+    parser.addParseListener(parse_listener)
+    if two_stage:
+        parser._interp.predictionMode = PredictionMode.SLL
+        parser._errHandler = BailErrorStrategy()
+    try:
+        parser.start()
+        if parser.getNumberOfSyntaxErrors() == 0:
+            return None
+    except ParseCancellationException:
+        pass
+    finally:
+        parser.removeParseListener(parse_listener)
+        parser.buildParseTrees = True
+        parser._interp.predictionMode = PredictionMode.LL
+        parser._errHandler = DefaultErrorStrategy()
+        parser._listeners = error_listeners
+
+    parse_listener.reset()
+    parse_listener.triples_repository.reset()
+    tokens.seek(0)
+    parser.reset()
+    return parser.start()
+
+
+def shares_dfa_between_threads()->bool:
+    """The generated lexer and parser keep their DFA cache in class attributes, so the parsers of all threads
+    share it. The runtime adds states and edges to it without locks, which is safe while the GIL makes each
+    dict and list update atomic: a thread that loses a race adds an equal state again or computes the edge again.
+    Without the GIL, on free-threaded builds, each thread gets its own DFA cache
+
+    Returns:
+        bool: True if the parsers of all threads can share the DFA cache
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+
+def create_parsers(parsers, filter_tokens=False, regex_lexer=False)->None:
+    """Creates the lexer, parser, walker and listeners for one thread as attributes of parsers
+
+    Args:
+        parsers (SimpleNamespace): the parser objects of the thread
+        filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+        regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
+    """
+    if regex_lexer:
+        parsers.lexer = RegexLexer()
+    else:
+        parsers.lexer = FixRelationsDirectionsLexer(InputStream(""))
+        parsers.lexer.removeErrorListeners()
+    parsers.filter_tokens = filter_tokens
+    parsers.token_source = PatternTokenSource(parsers.lexer) if filter_tokens else parsers.lexer
+    parsers.tokens = CommonTokenStream(parsers.token_source)
+
+    parsers.parser = FixRelationsDirectionsParser(parsers.tokens)
+    parsers.parser.removeErrorListeners() # Removes the default error listener
+    parsers.parser.addErrorListener(MyErrorListener()) # Adds our custom error listener
+
+    if not shares_dfa_between_threads():
+        parser = parsers.parser
+        parser._interp = ParserATNSimulator(parser, parser.atn, create_decisions_dfa(parser.atn), PredictionContextCache())
+        if not regex_lexer:
+            lexer = parsers.lexer
+            lexer._interp = LexerATNSimulator(lexer, lexer.atn, create_decisions_dfa(lexer.atn), PredictionContextCache())
+
+    parsers.walker = ParseTreeWalker()
+    parsers.listener = CypherParserListener()
+    parsers.parse_listener = CypherParseListener(parsers.listener.triples_repository)
+
+
+def create_decisions_dfa(atn):
+    """ An empty DFA cache for the decisions of the ATN"""
+    return [DFA(decision_state, i) for i, decision_state in enumerate(atn.decisionToState)]
+
+
+def pooled_parsers(filter_tokens=False, regex_lexer=False):
+    """The parser objects of the calling thread for the token options, the same ones Fixer uses
+
+    Args:
+        filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+        regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
+
+    Returns:
+        SimpleNamespace: the lexer, token source, tokens, parser, walker and listeners of the thread
+    """
+    return pooled_thread_parsers((Fixer, filter_tokens, regex_lexer),
+                                 lambda parsers: create_parsers(parsers, filter_tokens, regex_lexer))
+
+
+def parse_triples(parsers, cypher, listener, parse_listener, two_stage=False, build_parse_trees=True,
+                  report_errors=True)->None:
+    """Parses the cypher with the parser objects of a thread and finds its triples with the listeners.
+    The lexer and token stream are pointed at the cypher, and the triples are added to the
+    triples repository of the listeners
+
+    Args:
+        parsers (SimpleNamespace): the parser objects of the thread
+        cypher (str): the cypher to parse
+        listener (CypherParserListener): the listener that finds the triples in the parse tree
+        parse_listener (CypherParseListener): the listener that finds the triples during the parse
+        two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+        build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+        report_errors (bool): tell the error listeners of the parser about syntax errors
+    """
+    # Point the lexer at the cypher, setting the input stream resets the lexer
+    parsers.lexer.inputStream = InputStream(cypher)
+    if parsers.filter_tokens:
+        parsers.token_source.reset()
+    parsers.tokens.setTokenSource(parsers.token_source)
+    parser = parsers.parser
+    parser.setTokenStream(parsers.tokens)
+
+    error_listeners = parser._listeners
+    if not report_errors:
+        parser.removeErrorListeners()
+    try:
+        if not build_parse_trees:
+            parse_listener.reset()
+            tree = parse_without_tree(parser, parsers.tokens, parse_listener, two_stage)
+        elif two_stage:
+            tree = parse_two_stage(parser, parsers.tokens)
+        else:
+            tree = parser.start()
+    finally:
+        parser._listeners = error_listeners
+
+    # Walk the cypher and find triples, unless they were found while parsing
+    if tree is not None:
+        parsers.walker.walk(listener, tree)
+
+
+class Fixer(BaseFixer):
+    """
+    Long lived engine that fixes relations directions for one schema.
+    The schema is looked up once in the shared schema cache, and each thread reuses its own lexer, parser,
+    walker and listeners for every query, also between fixers with the same token options and CypherParser.
+    The lexer and token stream are pointed at each new cypher, and the parsers of all threads share the DFA cache
+    of the generated parser while the GIL is enabled, see shares_dfa_between_threads
+
+    Args:
+        schema (str): the schema to validate against
+        two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+        result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+        filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+        build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+        regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer. The generated lexer
+            is also used when it has other lexer rules than RegexLexer was written for
+    """
+
+    def __init__(self, schema, two_stage=False, result_cache=None, filter_tokens=False, build_parse_trees=True,
+                 regex_lexer=False)->None:
+        self.two_stage = two_stage
+        self.filter_tokens = filter_tokens
+        self.build_parse_trees = build_parse_trees
+        if regex_lexer and not RegexLexer.MATCHES_GENERATED_LEXER:
+            warnings.warn("The generated lexer has other rules than RegexLexer, the generated lexer is used")
+            regex_lexer = False
+        self.regex_lexer = regex_lexer
+        super().__init__(schema, result_cache)
+
+    def __reduce__(self):
+        """ Pickles the fixer as its arguments, the parsers are created again where it is unpickled.
+        The result cache is not pickled, it belongs to this process"""
+        return type(self), (self.schema, self.two_stage, None, self.filter_tokens, self.build_parse_trees,
+                            self.regex_lexer)
+
+    def parser_options(self)->tuple:
+        """ The token options, the lexer and token source of the parser depend on them"""
+        return (self.filter_tokens, self.regex_lexer)
+
+    def create_thread_parsers(self, parsers)->None:
+        """ Creates the lexer, parser, walker and listeners for one thread"""
+        create_parsers(parsers, self.filter_tokens, self.regex_lexer)
+
+    def find_triples(self, cypher):
+        """ Parses the cypher and returns the triples with prepared directions"""
+        parsers = self.thread_parsers()
+        triples_repository = parsers.listener.triples_repository
+        triples_repository.reset()
+        parse_triples(parsers, cypher, parsers.listener, parsers.parse_listener, self.two_stage, self.build_parse_trees)
+
+        # Prepare all triples and directions
+        triples_repository.validate_all_triples()
+        return triples_repository.triples
+
+    def release(self)->None:
+        """ Releases the parsed cypher and triples until the next query"""
+        self.thread_parsers().listener.triples_repository.reset()
+
+
 class FixDirections():
 
     @staticmethod
-    def fix_cypher_relations_directions(cypher, schema)->str:
+    def fix_cypher_relations_directions(cypher, schema, *, two_stage=False, result_cache=None, filter_tokens=False, build_parse_trees=True, regex_lexer=False)->str:
         """Validates the relations directions in the cypher with the schema and outputs a fixed cypher
         Args:
             cypher (str): the cypher to be fixed
             schema (str): the schema to validate against
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
 
         Returns:
             str: the cypher with fixed relations directions
         """
+        return Fixer(schema, two_stage=two_stage, result_cache=result_cache, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer).fix(cypher)
 
-        cypher_text_stream = InputStream(cypher)
-        lexer = FixRelationsDirectionsLexer(cypher_text_stream)
-        lexer.removeErrorListeners()
-        tokens = CommonTokenStream(lexer)
+    @staticmethod
+    def fix_cypher_relations_directions_patch(cypher, schema, *, two_stage=False, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
+        """Validates the relations directions in the cypher with the schema and outputs the characters to change,
+        apply them with SchemaRules.apply_arrow_direction_patch
 
-        parser = FixRelationsDirectionsParser(tokens)
-        parser.removeErrorListeners() # Removes the default error listener
-        parser.addErrorListener(MyErrorListener()) # Adds our custom error listener
-        tree = parser.start()
+        Args:
+            cypher (str): the cypher to be fixed
+            schema (str): the schema to validate against
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
 
-        walker = ParseTreeWalker()
+        Returns:
+            Tuple[List[Tuple[int, str, str]], bool]: the patch as sorted (offset, old character, new character),
+            and if the cypher matches the schema
+        """
+        return Fixer(schema, two_stage=two_stage, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer).fix_patch(cypher)
 
-        # Walk the cypher and find triples
-        listener = CypherParserListener()
+    @staticmethod
+    def needs_fix(cypher, schema, *, two_stage=False, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
+        """Checks if fixing the cypher with the schema would flip at least one arrow
 
-        walker.walk(listener, tree)
+        Args:
+            cypher (str): the cypher to check
+            schema (str): the schema to validate against
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
 
-        # Prepare all triples and directions
-        listener.triples_repository.validate_all_triples()
+        Returns:
+            bool: True if the cypher needs a fix
+        """
+        return Fixer(schema, two_stage=two_stage, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer).needs_fix(cypher)
+
+    @staticmethod
+    def fix_many(cyphers, schema, *, two_stage=False, result_cache=None, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
+        """Fixes the relations directions of many cyphers with one schema.
+        The schema and the parser are set up once, and identical cyphers are only fixed once
+
+        Args:
+            cyphers (Iterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
+
+        Returns:
+            Iterator[str]: generator of the fixed cyphers in the order of cyphers
+        """
+        return Fixer(schema, two_stage=two_stage, result_cache=result_cache, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer).fix_many(cyphers)
 
-        # Extract schema and variables
-        schema_parser = SchemaParser()
-        schema_list =  schema_parser.extract_schemas(schema)
+    @staticmethod
+    def fix_many_parallel(cyphers, schema, *, processes=None, chunk_size=256, two_stage=False, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
+        """Fixes the relations directions of many cyphers with one schema in a pool of processes.
+        Each process sets up the schema and the parser once and fixes chunks of cyphers
+
+        Args:
+            cyphers (Iterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            processes (int): the number of worker processes, None for the number of CPUs
+            chunk_size (int): the number of cyphers sent to a worker at a time
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
+
+        Returns:
+            Iterator[str]: generator of the fixed cyphers in the order of cyphers
+        """
+        return Fixer.fix_many_parallel(cyphers, schema, processes=processes, chunk_size=chunk_size, two_stage=two_stage, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer)
 
+    @staticmethod
+    async def afix(cypher, schema, *, executor=None, inline_threshold=None, semaphore=None, two_stage=False, result_cache=None, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
+        """Validates the relations directions in the cypher with the schema without blocking the event loop.
+        Short cyphers are fixed on the event loop, longer cyphers in the executor
+
+        Args:
+            cypher (str): the cypher to be fixed
+            schema (str): the schema to validate against
+            executor (Executor): thread or process pool, None for the default executor of the loop
+            inline_threshold (int): the length from which the cypher is sent to the executor, None for the default
+            semaphore (asyncio.Semaphore): shared by callers to limit the cyphers in executors at the same time, None for no limit
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
 
-        # Iterate all triples and validate direction changes
-        for triple in listener.triples_repository.triples:
-            SchemaRules.validate_direction_change(triple, schema_list)
+        Returns:
+            str: the cypher with fixed relations directions
+        """
+        return await Fixer(schema, two_stage=two_stage, result_cache=result_cache, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer).afix(cypher, executor, inline_threshold, semaphore)
 
-        query_fixed = SchemaRules.fix_all_arrow_directions_from_triples(cypher, listener.triples_repository.triples)
+    @staticmethod
+    def afix_many(cyphers, schema, *, executor=None, max_in_flight=None, inline_threshold=None, two_stage=False, result_cache=None, filter_tokens=False, build_parse_trees=True, regex_lexer=False):
+        """Fixes the relations directions of many cyphers with one schema without blocking the event loop.
+        At most max_in_flight cyphers are fixed at the same time
 
-        return query_fixed
+        Args:
+            cyphers (Iterable[str] or AsyncIterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            executor (Executor): thread or process pool, None for the default executor of the loop
+            max_in_flight (int): the number of cyphers fixed at the same time, None for the default
+            inline_threshold (int): the length from which a cypher is sent to the executor, None for the default
+            two_stage (bool): parse with SLL prediction first and with full LL only when SLL fails
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+            filter_tokens (bool): only give the parser the first token of each run of tokens outside of patterns
+            build_parse_trees (bool): build a parse tree and walk it, False to find the triples while parsing
+            regex_lexer (bool): find the tokens with RegexLexer, False for the generated lexer
 
+        Returns:
+            AsyncIterator[str]: async generator of the fixed cyphers in the order of cyphers
+        """
+        return Fixer(schema, two_stage=two_stage, result_cache=result_cache, filter_tokens=filter_tokens, build_parse_trees=build_parse_trees, regex_lexer=regex_lexer).afix_many(cyphers, executor, max_in_flight, inline_threshold)
@@ -0,0 +1,106 @@
+"""
+This module contains a token source that filters the lexer tokens before the parser.
+The start rule (cypher_body | .)*? EOF lets the parser predict a cypher_body at every
+token, so text between the patterns, like WHERE and RETURN clauses, costs as much
+to parse as the patterns
+
+"""
+from antlr4 import Token
+from antlr4.Lexer import TokenSource
+from parse_antlr_to_cypher.FixRelationsDirectionsLexer import FixRelationsDirectionsLexer
+
+
+class PatternTokenSource(TokenSource):
+    """
+    Token source that gives the parser the tokens of the lexer, but only the first token of
+    each run of tokens that can't be part of a pattern.
+
+    A token is outside of every pattern when it is not inside parentheses, brackets or braces,
+    and is not one of them or an arrow character after the end of a node or a part of a relation,
+    e.g. WHERE p.age > 18 is one run. The first token of the run is kept, so
+    the patterns before and after the run are not joined, and the parser finds the same
+    patterns at the same positions as with all tokens
+
+    Args:
+        lexer (FixRelationsDirectionsLexer): the lexer to read the tokens from
+    """
+
+    # Tokens that open and close the parts of a pattern
+    OPENING_TOKENS = {
+        FixRelationsDirectionsLexer.LPAREN: 0,
+        FixRelationsDirectionsLexer.LBRACK: 1,
+        FixRelationsDirectionsLexer.LBRACE: 2,
+    }
+    CLOSING_TOKENS = {
+        FixRelationsDirectionsLexer.RPAREN: 0,
+        FixRelationsDirectionsLexer.RBRACK: 1,
+        FixRelationsDirectionsLexer.RBRACE: 2,
+    }
+
+    # Tokens of relations between nodes
+    ARROW_TOKENS = {
+        FixRelationsDirectionsLexer.LT,
+        FixRelationsDirectionsLexer.SUB,
+        FixRelationsDirectionsLexer.GT,
+    }
+
+    # The tokens that can come before an arrow token of a relation, the end of a node or another part of the relation
+    BEFORE_ARROW_TOKENS = {
+        FixRelationsDirectionsLexer.RPAREN,
+        FixRelationsDirectionsLexer.LT,
+        FixRelationsDirectionsLexer.SUB,
+        FixRelationsDirectionsLexer.RBRACK,
+    }
+
+    def __init__(self, lexer) -> None:
+        self.lexer = lexer
+        self.reset()
+
+    def reset(self) -> None:
+        """ Starts over for a new cypher in the lexer"""
+        # Open parentheses, brackets and braces, a closing token without an opening one is ignored
+        self.depths = [0, 0, 0]
+        self.in_filtered_run = False
+        self.previous_type = Token.INVALID_TYPE
+
+    def nextToken(self) -> Token:
+        """ The next token for the parser, tokens after the first of a run outside of patterns are skipped"""
+        while True:
+            token = self.lexer.nextToken()
+            token_type = token.type
+            previous_type = self.previous_type
+            self.previous_type = token_type
+
+            depth = self.OPENING_TOKENS.get(token_type)
+            if depth is not None:
+                self.depths[depth] += 1
+                self.in_filtered_run = False
+                return token
+
+            depth = self.CLOSING_TOKENS.get(token_type)
+            if depth is not None:
+                if self.depths[depth] > 0:
+                    self.depths[depth] -= 1
+                self.in_filtered_run = False
+                return token
+
+            if token_type == Token.EOF or any(self.depths) or \
+                    (token_type in self.ARROW_TOKENS and previous_type in self.BEFORE_ARROW_TOKENS):
+                self.in_filtered_run = False
+                return token
+
+            if not self.in_filtered_run:
+                self.in_filtered_run = True
+                return token
+
+    def getSourceName(self) -> str:
+        return self.lexer.inputStream.name
+
+    @property
+    def inputStream(self):
+        return self.lexer.inputStream
+
+    @property
+    def _factory(self):
+        """ The token factory of the lexer, the parser creates missing tokens with it"""
+        return self.lexer._factory
@@ -0,0 +1,150 @@
+"""
+This module contains a lexer for the AST method that scans the cypher with one compiled
+regular expression. It gives the parser the same tokens as the generated
+FixRelationsDirectionsLexer, which runs the lexer ATN for every character
+
+"""
+import hashlib
+import re
+from antlr4 import InputStream, Token
+from antlr4.CommonTokenFactory import CommonTokenFactory
+from antlr4.Lexer import TokenSource
+from parse_antlr_to_cypher.FixRelationsDirectionsLexer import FixRelationsDirectionsLexer, serializedATN
+
+# Letters are a-z and _ in any case, and all characters above 0x7F except
+# high surrogates, which are only letters as the first half of a surrogate pair
+LETTER_REGEX = r"[a-zA-Z_\x80-\ud7ff\udc00-\U0010ffff]|[\ud800-\udbff][\udc00-\udfff]"
+
+# The rules of the generated lexer that the regular expression is written for, and the hash of its ATN,
+# which changes with any change of the lexer rules in FixRelationsDirections.g4
+GENERATED_LEXER_RULE_NAMES = (
+    "WS", "COMMENT", "LINE_COMMENT", "LPAREN", "RPAREN", "LBRACK", "RBRACK", "LBRACE", "RBRACE", "GT", "LT",
+    "COLON", "SUB", "DOT", "COMMA", "PLUS", "DIV", "MULT", "NEGATION", "STICK", "NAME", "STRING",
+    "BACKTICK_STRING", "VARIABLE_LENGTH_DIGITS", "LetterOrDigit", "Digits", "Letter",
+)
+GENERATED_LEXER_ATN_SHA256 = "2657122c624d0cc78a98dab22bd004fbc5c50a6afe3d010058d1a94522f37fa0"
+
+
+def generated_lexer_atn_sha256() -> str:
+    """ The hash of the ATN of the generated lexer"""
+    return hashlib.sha256(",".join(map(str, serializedATN())).encode()).hexdigest()
+
+
+def matches_generated_lexer() -> bool:
+    """ Checks that the generated lexer has the rules the regular expression is written for"""
+    return tuple(FixRelationsDirectionsLexer.ruleNames) == GENERATED_LEXER_RULE_NAMES and \
+        generated_lexer_atn_sha256() == GENERATED_LEXER_ATN_SHA256
+
+
+class RegexLexer(TokenSource):
+    """
+    Lexer that finds the tokens of FixRelationsDirections.g4 with a compiled regular expression.
+    The tokens have the same types, offsets, lines and columns as the tokens of FixRelationsDirectionsLexer.
+
+    The characters that the generated lexer can't match are skipped the same way: one character,
+    two for a high surrogate without its low surrogate, and the rest of the cypher after a
+    quote or backtick without its closing one.
+
+    When the generated lexer is regenerated from other lexer rules, MATCHES_GENERATED_LEXER is False
+    and the fixers use the generated lexer until the regular expression is changed to match it
+
+    Args:
+        input_stream (InputStream): the cypher to find the tokens in
+    """
+
+    SCANNER = re.compile(
+        r"(?P<SKIP>[ \t\r\n]+|/\*.*?\*/|//[^\r\n]*)"
+        r"|(?P<NAME>`(?:``|[^`])*`|(?:" + LETTER_REGEX + r")(?:" + LETTER_REGEX + r"|[0-9])*)"
+        r"|(?P<STRING>'[^']*'|\"[^\"]*\")"
+        r"|(?P<VARIABLE_LENGTH_DIGITS>[1-9](?:[0-9_]*[0-9])?)"
+        r"|(?P<SYMBOL>[()\[\]{}><:\-.,+/*!|])"
+        r"|(?P<UNCLOSED>['\"`].*)"
+        r"|(?P<SURROGATE>[\ud800-\udbff].?)"
+        r"|(?P<ERROR>.)",
+        re.DOTALL,
+    )
+
+    # Token types of the groups that are tokens
+    GROUP_TYPES = {
+        "NAME": FixRelationsDirectionsLexer.NAME,
+        "STRING": FixRelationsDirectionsLexer.STRING,
+        "VARIABLE_LENGTH_DIGITS": FixRelationsDirectionsLexer.VARIABLE_LENGTH_DIGITS,
+    }
+
+    # Token types of the one character tokens
+    SYMBOL_TYPES = {
+        "(": FixRelationsDirectionsLexer.LPAREN,
+        ")": FixRelationsDirectionsLexer.RPAREN,
+        "[": FixRelationsDirectionsLexer.LBRACK,
+        "]": FixRelationsDirectionsLexer.RBRACK,
+        "{": FixRelationsDirectionsLexer.LBRACE,
+        "}": FixRelationsDirectionsLexer.RBRACE,
+        ">": FixRelationsDirectionsLexer.GT,
+        "<": FixRelationsDirectionsLexer.LT,
+        ":": FixRelationsDirectionsLexer.COLON,
+        "-": FixRelationsDirectionsLexer.SUB,
+        ".": FixRelationsDirectionsLexer.DOT,
+        ",": FixRelationsDirectionsLexer.COMMA,
+        "+": FixRelationsDirectionsLexer.PLUS,
+        "/": FixRelationsDirectionsLexer.DIV,
+        "*": FixRelationsDirectionsLexer.MULT,
+        "!": FixRelationsDirectionsLexer.NEGATION,
+        "|": FixRelationsDirectionsLexer.STICK,
+    }
+
+    MATCHES_GENERATED_LEXER = matches_generated_lexer()
+
+    def __init__(self, input_stream=None) -> None:
+        self._factory = CommonTokenFactory.DEFAULT
+        self.inputStream = InputStream("") if input_stream is None else input_stream
+
+    @property
+    def inputStream(self):
+        return self._input
+
+    @inputStream.setter
+    def inputStream(self, input_stream) -> None:
+        """ Sets the cypher to find the tokens in and starts from the beginning"""
+        self._input = input_stream
+        self._token_factory_source_pair = (self, input_stream)
+        self.text = input_stream.strdata
+        self.position = 0
+        self.line = 1
+        self.line_start = 0
+        self.column = 0
+        self.counted_position = 0
+
+    def nextToken(self) -> Token:
+        """ The next token, the EOF token at the end of the cypher"""
+        text = self.text
+        while self.position < len(text):
+            match = RegexLexer.SCANNER.match(text, self.position)
+            group = match.lastgroup
+            start = self.position
+            self.position = match.end()
+
+            if group == "SYMBOL":
+                token_type = RegexLexer.SYMBOL_TYPES[match.group(group)]
+            else:
+                token_type = RegexLexer.GROUP_TYPES.get(group)
+                if token_type is None:
+                    continue
+            return self.create_token(token_type, start, self.position - 1)
+
+        return self.create_token(Token.EOF, len(text), len(text) - 1)
+
+    def create_token(self, token_type: int, start: int, stop: int) -> Token:
+        """ Creates the token with the line and column of the start"""
+        # Count the new lines since the last token
+        new_lines = self.text.count("\n", self.counted_position, start)
+        if new_lines:
+            self.line += new_lines
+            self.line_start = self.text.rindex("\n", self.counted_position, start) + 1
+        self.counted_position = start
+        self.column = start - self.line_start
+
+        return self._factory.create(self._token_factory_source_pair, token_type, None, Token.DEFAULT_CHANNEL,
+                                    start, stop, self.line, self.column)
+
+    def getSourceName(self) -> str:
+        return self._input.name
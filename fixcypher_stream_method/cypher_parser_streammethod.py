@@ -3,7 +3,7 @@ This module contains a function to fix directions of the arrows
 in cyphers e.g. (:Person)-[]->(:Car) could be changed to (:Person)<-[]-(:Car)
 
 """
-import io
+import re
 from core.core_classes import (
     NodeFlag,
     Node,
@@ -20,25 +20,29 @@ class CypherParser:
 
     Args:
         cypher (str): The Cypher query to parse
-        schema (str): The database schema to use for parsing
+        tokenizer (CypherTokenizer): scans words, labels, types, numbers and whitespaces
+            with regular expressions. None scans them one character at a time
+        arrow_anchored (bool): only parse the parts of the cypher around relation arrows
+            and nodes with labels, instead of every node in the cypher
     """
 
-    def __init__(self,cypher=None):
+    def __init__(self,cypher=None,tokenizer=None,arrow_anchored=False):
+        self.tokenizer = tokenizer
+        self.arrow_anchored = arrow_anchored
         self.triples_repository = TriplesRepository()
-        self.current_triple = None
+        self.reset()
         if cypher is not None:
-            self.reset()
             self.set_cypher(cypher)
 
 
     def reset(self):
         """ Reset to init"""
-        self.input_stream = None
         self.cypher = None
-        self.word = ""
+        self.cypher_length = 0
         self.current_character = None
         self.position = None
         self.current_triple: Triple = None
+        self.nodes_ending_triples = []
         self.triples_repository.reset()
 
 
@@ -64,11 +68,41 @@ class CypherParser:
     # Status messages
     STATUS_NO_COMPLETE_NODE_FOUND = "No complete node found"
 
+    # Where a triple can start, a node directly followed by an arrow ")-" ")<",
+    # or a node that can have both variable and labels "(p:" whose labels are looked up
+    ARROW_ANCHORS = re.compile(r"\)(?=[-<])|\((?=\s*(?:`|[^\W\d_]\w*\s*:))")
+
+    # Ends of a property value without quotes
+    NON_QUOTE_VALUE_END = re.compile(r"['\",}]")
+
+    # Content and closing quote of strings and backtick names with backslash escapes
+    ESCAPED_QUOTED_CONTENT = {
+        quote: re.compile(rf"[^{quote}\\]*(?:\\.[^{quote}\\]*)*{quote}", re.DOTALL)
+        for quote in ("'", '"', "`")
+    }
+
+    # Characters that can make the node parser continue past a parenthesis
+    HIDES_PARENTHESES = re.compile(r"[{`\\]")
+
+    # Lookup tables for ASCII characters of names, characters above ASCII
+    # fall back to str.isalpha and str.isdigit
+    LAST_ASCII_CHARACTER = "\x7f"
+    ASCII_VARIABLE_START_CHARACTERS = frozenset(
+        char for char in map(chr, range(128)) if char.isalpha()
+    )
+    ASCII_VARIABLE_CHARACTERS = frozenset(
+        char for char in map(chr, range(128)) if char.isalpha() or char.isdigit() or char == "_"
+    )
+
+    # Runs of variable characters, the same as the table for ASCII characters
+    WORD_CHARACTERS = re.compile(r"\w*")
+
     def set_cypher(self,cypher):
-        """ Sets cypher and set input stream"""
+        """ Sets cypher and moves the cursor to the start of it"""
 
-        self.input_stream = io.StringIO(cypher)
         self.cypher = cypher
+        self.cypher_length = len(cypher)
+        self.position = 0
 
     def find_and_prepare_all_triples(self, cypher):
         """Finds all triples in the actual Cypher"""
@@ -83,59 +117,116 @@ class CypherParser:
         """The starting point to find the triples in the cypher, first step one character in
         the stream the start finding the first node e.g. (p:Person)
 
+        The cypher is parsed in a loop that switches between looking for a node and looking for
+        a relation, so the stack does not grow with the length of the cypher
         """
         self.next_character()
         self.skip_whitespaces()
 
-        self.validate_if_next_is_a_node()
+        if self.arrow_anchored:
+            self.find_triples_around_arrows()
+        else:
+            self.parse_patterns()
+
+        # Nodes that ends a triple are saved last and in reverse order, the same order
+        # as when the parser was recursive and saved them while returning
+        for node in reversed(self.nodes_ending_triples):
+            self.triples_repository.save_node_variable_and_label(node)
+
+    def parse_patterns(self, stop_after=None):
+        """Parses nodes and relations from the current character
+
+        Args:
+            stop_after (int): stop when no triple is in progress after this offset,
+                None parses to the end of the cypher
+        """
+        look_for_node = True
+        while self.current_character != "":
+            if look_for_node:
+                if stop_after is not None and self.current_triple is None and\
+                    self.current_offset() > stop_after:
+                    return
+
+                # A relation is only looked for directly after a found node
+                look_for_node = not self.validate_if_next_is_a_node()
+            else:
+                self.validate_if_next_is_a_relation()
+                look_for_node = True
+
+    def find_triples_around_arrows(self):
+        """Parses only around the anchors where a triple can start, see ARROW_ANCHORS,
+        and jumps over the rest of the cypher.
 
-    def validate_if_next_is_a_node(self):
-        """ Find and validate found node. Then add any relation. Otherwise starts over and tries to find the next node
+        A jump is only made when the skipped part can not hide a parenthesis from the
+        node parser, otherwise the skipped part is parsed. That gives the same triples
+        and saved labels as parsing the whole cypher
+        """
+        cypher = self.cypher
+        for anchor in CypherParser.ARROW_ANCHORS.finditer(cypher):
+            offset = self.current_offset()
+            anchor_offset = anchor.start()
+            if anchor_offset < offset:
+                continue
+
+            # The node before an arrow starts at the closest left parenthesis
+            if cypher[anchor_offset] == CypherParser.RPARENTHESIS:
+                start = cypher.rfind(CypherParser.LPARENTHESIS, offset, anchor_offset)
+            else:
+                start = anchor_offset
+
+            if start > offset and CypherParser.HIDES_PARENTHESES.search(cypher, offset, start) is None:
+                self.seek(start)
+
+            self.parse_patterns(anchor_offset)
+
+        # Nothing after the last anchor can be a triple or have labels to save
+        self.seek(self.cypher_length)
+
+    def validate_if_next_is_a_node(self)->bool:
+        """ Find and validate found node. Then add it to the current triple
+
+        Returns:
+            bool: True if a node is found, False if not
         """
         if self.current_character == "":
-            return
+            return False
         # Look for node
         found_node = self.parse_if_node()
 
-        # if first_node is None and tmp_node.status & NodeFlag.NODE_NOT_FOUND:
-        if found_node.status & NodeFlag.NODE_NOT_FOUND:
-            self.validate_if_next_is_a_node()
+        if not found_node.status & NodeFlag.NODE_FOUND:
+            return False
 
         # If node is found set node
-        if found_node.status & NodeFlag.NODE_FOUND:
-            if self.current_triple is None:
-                self.current_triple = Triple(None, None, None)
-
-            if self.current_triple.first_node is None:
-                self.current_triple.first_node = found_node
-
-            elif self.current_triple.second_node is None:
-                self.current_triple.second_node = found_node
-
-            # Check if valid triple
-            if (
-                (self.current_triple.first_node is not None)
-                and (self.current_triple.relation is not None)
-                and (self.current_triple.second_node is not None)
-            ):
-                second_node = self.current_triple.second_node
-                tmp_triple = self.current_triple
-                self.triples_repository.triples.append(tmp_triple)
-                self.current_triple = Triple(None, None, None)
-                self.current_triple.first_node = second_node
-
-                # Try to find relation
-                self.validate_if_next_is_a_relation()
-
+        if self.current_triple is None:
+            self.current_triple = Triple(None, None, None)
+
+        if self.current_triple.first_node is None:
+            self.current_triple.first_node = found_node
+
+        elif self.current_triple.second_node is None:
+            self.current_triple.second_node = found_node
+
+        # Check if valid triple
+        if (
+            (self.current_triple.first_node is not None)
+            and (self.current_triple.relation is not None)
+            and (self.current_triple.second_node is not None)
+        ):
+            second_node = self.current_triple.second_node
+            tmp_triple = self.current_triple
+            self.triples_repository.triples.append(tmp_triple)
+            self.current_triple = Triple(None, None, None)
+            self.current_triple.first_node = second_node
+
+            self.nodes_ending_triples.append(found_node)
+        else:
             # Save node value and labels in dictionary if criteria is met
             self.triples_repository.save_node_variable_and_label(found_node)
 
-            self.validate_if_next_is_a_relation()
-
-            self.validate_if_next_is_a_node()
+        return True
 
     def validate_if_next_is_a_relation(self):
-        """Find and validate any relationship, otherwise continue to find the next node.
+        """Find and validate any relationship directly after a node
         """
         if self.current_character == "":
             return
@@ -152,7 +243,6 @@ class CypherParser:
             self.current_triple = None
 
         self.skip_whitespaces()
-        self.validate_if_next_is_a_node()
 
 
     def parse_if_node(self):
@@ -181,7 +271,7 @@ class CypherParser:
                 return node
 
         elif self.current_character != CypherParser.LPARENTHESIS:
-            self.next_character()
+            self.skip_to(CypherParser.LPARENTHESIS)
             return Node("", [], NodeFlag.NODE_NOT_FOUND)
 
         # Find variable of node the p in (p:Person)
@@ -392,15 +482,10 @@ class CypherParser:
         Returns:
             string: variable string
         """
-        variable = self.current_character
-        while True:
-            self.next_character()
-
-            if self.is_valid_variable_character(self.current_character):
-                variable += self.current_character
-            else:
-                break
-        return variable
+        start = self.current_offset()
+        end = self.find_end_of_variable(start + 1)
+        self.seek(end)
+        return self.cypher[start:end]
 
     def find_labels(self):
         """Get labels if there is any
@@ -413,6 +498,12 @@ class CypherParser:
 
         if self.current_character != CypherParser.COLON:
             return [], []
+
+        if self.tokenizer is not None:
+            labels, offset = self.tokenizer.match_labels(self.cypher, self.current_offset())
+            self.seek(offset)
+            return labels
+
         self.next_character()
         self.skip_whitespaces()
         while True:
@@ -440,6 +531,12 @@ class CypherParser:
         # Find labels
         if self.current_character != CypherParser.COLON:
             return [], []
+
+        if self.tokenizer is not None:
+            types, negative_types, offset = self.tokenizer.match_types(self.cypher, self.current_offset())
+            self.seek(offset)
+            return types, negative_types
+
         self.next_character()
         self.skip_whitespaces()
 
@@ -492,6 +589,10 @@ class CypherParser:
 
     def skip_number(self):
         """ Skips numbers [0-9]* til no more number"""
+        if self.tokenizer is not None:
+            self.seek(self.tokenizer.skip_number(self.cypher, self.current_offset()))
+            return
+
         while True:
             if self.current_character.isdigit():
                 self.next_character()
@@ -509,6 +610,12 @@ class CypherParser:
 
     def skip_whitespaces(self):
         """ Skip the next whitespaces"""
+        if self.tokenizer is not None:
+            # Most of the time there is no whitespace to skip
+            if self.current_character.isspace():
+                self.seek(self.tokenizer.skip_whitespaces(self.cypher, self.current_offset()))
+            return
+
         while True:
             if self.current_character.isspace():
                 self.next_character()
@@ -532,25 +639,25 @@ class CypherParser:
                 return False
 
     def skip_property(self):
-        """ Skips the properties in the { Name: 'Value'}"""
-        self.skip_escape_signs()
-        self.skip_whitespaces()
-        self.skip_property_name()
-        self.skip_whitespaces()
-        if self.current_character == CypherParser.COLON:
+        """ Skips the properties in the { Name: 'Value', Name2: 'Value2'}"""
+        while True:
+            self.skip_escape_signs()
+            self.skip_whitespaces()
+            self.skip_property_name()
+            self.skip_whitespaces()
+            if self.current_character != CypherParser.COLON:
+                return False
+
             self.next_character()
             self.skip_whitespaces()
             if self.skip_property_value() is False:
                 return False
             self.skip_whitespaces()
-            if self.current_character == CypherParser.COMMA:
-                self.next_character()
-                if self.skip_property() is False:
-                    return False
-            return True
-        else:
-            return False
-        return True
+
+            # Continue with the next property after comma
+            if self.current_character != CypherParser.COMMA:
+                return True
+            self.next_character()
 
     def skip_property_name(self):
         """ Skips property name"""
@@ -558,33 +665,43 @@ class CypherParser:
 
     def get_cypher_word(self):
         """ Gets valid cypher word, either variable, property, type or label"""
+        if self.tokenizer is not None:
+            word, offset = self.tokenizer.match_word(self.cypher, self.current_offset())
+            self.seek(offset)
+            return word
+
 
-        word = ""
         if self.current_character == CypherParser.BACKTICK:
+            start = self.current_offset() + 1
+            closing = self.find_closing_quote(CypherParser.BACKTICK, start)
 
-            self.next_character()
-            self.word = self.current_character
-            while True:
-                self.skip_escape_signs()
-                if self.current_character != CypherParser.BACKTICK:
-                    word = self.word
-                else:
-                    self.next_character()
-                    self.reset_word()
-                    return word
+            # Unterminated backtick, the word is the rest of the cypher
+            if closing == -1:
+                self.seek(self.cypher_length)
+                return self.cypher[start:]
 
-                self.next_character()
+            self.seek(closing + 1)
+            return self.cypher[start:closing]
         if self.is_valid_start_variable_character(self.current_character):
-            self.word = self.current_character
-            word = self.word
-            self.next_character()
-            while True:
-                if self.is_valid_variable_character(self.current_character) is False:
-                    return word
-                word = self.word
-                self.next_character()
+            start = self.current_offset()
+            end = self.find_end_of_variable(start + 1)
+            self.seek(end)
+            return self.cypher[start:end]
         return ""
 
+    def find_end_of_variable(self, offset):
+        """ Returns the offset after the variable characters from offset"""
+        end = CypherParser.WORD_CHARACTERS.match(self.cypher, offset).end()
+        if self.cypher[offset:end].isascii():
+            return end
+
+        # Word characters above ASCII include numeric characters like ½ that are not digits
+        ascii_variable_characters = CypherParser.ASCII_VARIABLE_CHARACTERS
+        for index, char in enumerate(self.cypher[offset:end], offset):
+            if char not in ascii_variable_characters and not (char.isalpha() or char.isdigit()):
+                return index
+        return end
+
     def skip_property_value(self):
         """ Skips property value, eight single or double quotation"""
         if self.skip_quotation() is False:
@@ -598,82 +715,106 @@ class CypherParser:
         if self.current_character not in [',','}']:
             self.skip_whitespaces()
             self.next_character()
-            while True:
-                if self.current_character in ["'",'"']:
-                    return False
 
-                if self.current_character in [',','}']:
-                    return True
-
-                elif self.current_character == '':
-                    return False
-                self.next_character()
+            # Jump to the first quote, comma or end of block
+            end = CypherParser.NON_QUOTE_VALUE_END.search(self.cypher, self.current_offset())
+            if end is None:
+                self.seek(self.cypher_length)
+                return False
 
+            self.seek(end.start())
+            return self.current_character in [',','}']
 
     def skip_quotation(self):
         """ Skips quotation with content"""
-        if self.current_character == "'":
-            self.next_character()
-            while True:
-                self.skip_escape_signs()
-                if self.current_character == "'":
-                    self.next_character()
-                    return True
-                self.next_character()
-                if self.current_character == '':
-                    return False
-        return False
+        return self.skip_quoted(CypherParser.SINGLE_QUOTATION)
 
     def skip_double_quotation(self):
         """ Skips double quotation"""
-        if self.current_character == '"':
-            self.next_character()
-            while True:
-                self.skip_escape_signs()
-                if self.current_character == '"':
-                    self.next_character()
-                    return True
-                self.next_character()
-                if self.current_character == '':
-                    return False
-        return False
+        return self.skip_quoted(CypherParser.DOUBLE_QOUTATION)
 
-    def is_valid_start_variable_character(self, char):
-        """ Checks if the character is a start of a valid variable"""
-        if not char:
+    def skip_quoted(self, quote):
+        """Skips a string in quotes with content, jumps to the closing quote
+
+        Returns:
+            bool: True if skipped, False if not a quote or the quote is not closed
+        """
+        if self.current_character != quote:
             return False
 
-        if not char.isalpha():
+        closing = self.find_closing_quote(quote, self.current_offset() + 1)
+        if closing == -1:
+            self.seek(self.cypher_length)
             return False
+
+        self.seek(closing + 1)
         return True
 
+    def find_closing_quote(self, quote, offset):
+        """Finds the closing quote from offset, a backslash escapes the character after it
+
+        Returns:
+            int: the offset of the closing quote, -1 if there is none
+        """
+        closing = self.cypher.find(quote, offset)
+        if closing == -1:
+            return -1
+
+        # Without backslashes the first quote is the closing quote
+        if self.cypher.find("\\", offset, closing) == -1:
+            return closing
+
+        match = CypherParser.ESCAPED_QUOTED_CONTENT[quote].match(self.cypher, offset)
+        if match is None:
+            return -1
+        return match.end() - 1
+
+    def is_valid_start_variable_character(self, char):
+        """ Checks if the character is a start of a valid variable"""
+        if char in CypherParser.ASCII_VARIABLE_START_CHARACTERS:
+            return True
+        return char > CypherParser.LAST_ASCII_CHARACTER and char.isalpha()
+
     def is_valid_variable_character(self, char):
         """ Check if the character is a valid variable character"""
-        if not (char.isalpha() or char.isdigit() or char == "_"):
-            return False
-        return True
+        if char in CypherParser.ASCII_VARIABLE_CHARACTERS:
+            return True
+        return char > CypherParser.LAST_ASCII_CHARACTER and (char.isalpha() or char.isdigit())
 
     def is_valid_cypher_label_character(self, char):
         """ Checks if it is a valid cypher label character"""
-        if char.isalpha() or char.isdigit() or char == "_":
-            return True
-        return False
+        return self.is_valid_variable_character(char)
 
     def next_character(self):
-        """ reads the next character in the stream"""
-        c = self.input_stream.read(1)
-
-        # Adds character to word
-        self.word += c
+        """ Moves the cursor to the next character in the cypher"""
+        position = self.position
 
-        # Sets current character
-        self.current_character = c
+        if position < self.cypher_length:
+            # Sets current character and the position after it
+            self.current_character = self.cypher[position]
+            self.position = position + 1
+        else:
+            self.current_character = ""
 
-        # Sets the position of the character
-        self.position = self.input_stream.tell()
+    def seek(self, offset):
+        """ Moves the cursor so the current character is the one at offset"""
+        if 0 <= offset < self.cypher_length:
+            self.current_character = self.cypher[offset]
+            self.position = offset + 1
+        else:
+            self.current_character = ""
+            self.position = self.cypher_length
+
+    def skip_to(self, character):
+        """ Moves the cursor to the next occurrence of character after the current one"""
+        offset = self.cypher.find(character, self.position)
+        if offset == -1:
+            offset = self.cypher_length
+        self.seek(offset)
+
+    def current_offset(self):
+        """ The offset of the current character, the length of the cypher at the end"""
+        if self.current_character == "":
+            return self.position
+        return self.position - 1
 
-    def reset_word(self):
-        """ Resets the global word"""
-        word = self.word
-        self.word = ""
-        return word
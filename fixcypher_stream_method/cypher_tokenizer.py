@@ -0,0 +1,127 @@
+"""
+This module contains a compiled regular expression tokenizer for the stream method.
+It doesn't produce a token stream: the parser still walks the cypher and calls the
+matchers where a name, labels, types, a number or whitespaces start, and they match
+them with re instead of stepping one character at a time
+
+"""
+import re
+from typing import List, Tuple
+
+# Names are either escaped with backticks or start with a letter.
+# Backslash escapes the next character inside backticks, a name without
+# closing backtick ends at the end of the cypher
+BACKTICK_NAME_REGEX = r"`(?P<{group}>(?:[^`\\]|\\.)*\\?)`?"
+NAME_REGEX = r"[^\W\d_]\w*"
+
+
+class CypherTokenizer:
+    """
+    Tokenizer that matches names, labels and types in cypher with compiled regular expressions.
+
+    Names have the characters the parser checks with str.isalpha and str.isdigit. re also counts
+    numeric characters like ½ as word characters and doesn't count digits like ² as \\d, so names
+    and numbers with characters above ASCII are checked with the same str methods
+    """
+
+    WHITESPACES = re.compile(r"\s*")
+    NUMBER_PATTERN = re.compile(r"\d*")
+    WORD = re.compile(BACKTICK_NAME_REGEX.format(group="backtick_name") + r"|(?P<name>" + NAME_REGEX + r")", re.DOTALL)
+    LABEL_PATTERN = re.compile(r":\s*(?:" + BACKTICK_NAME_REGEX.format(group="backtick_name") +
+                               r"|(?P<name>" + NAME_REGEX + r"))?\s*", re.DOTALL)
+    TYPE_PATTERN = re.compile(r"(?P<negation>!\s*)?(?:" + BACKTICK_NAME_REGEX.format(group="backtick_name") +
+                              r"|(?P<name>" + NAME_REGEX + r"))?\s*", re.DOTALL)
+    TYPE_OR_PATTERN = re.compile(r"\|\s*")
+
+    def skip_whitespaces(self, cypher: str, offset: int) -> int:
+        """ Returns the offset after the whitespaces at offset"""
+        return CypherTokenizer.WHITESPACES.match(cypher, offset).end()
+
+    def skip_number(self, cypher: str, offset: int) -> int:
+        """ Returns the offset after the digits at offset"""
+        while True:
+            offset = CypherTokenizer.NUMBER_PATTERN.match(cypher, offset).end()
+            if offset == len(cypher) or not cypher[offset].isdigit():
+                return offset
+            offset += 1
+
+    def match_word(self, cypher: str, offset: int) -> Tuple[str, int]:
+        """Matches a variable, property, type or label name at offset
+
+        Returns:
+            Tuple[str, int]: the name without backticks, and the offset after it.
+            The name is empty and the offset unchanged when there is no name
+        """
+        match = CypherTokenizer.WORD.match(cypher, offset)
+        if match is None:
+            return "", offset
+        return CypherTokenizer.matched_name(cypher, match)
+
+    def match_labels(self, cypher: str, offset: int) -> Tuple[List[str], int]:
+        """Matches labels :Label1:Label2 at offset, which must be a colon
+
+        Returns:
+            Tuple[List[str], int]: the labels and the offset after them
+        """
+        labels = []
+        while True:
+            match = CypherTokenizer.LABEL_PATTERN.match(cypher, offset)
+            if match is None:
+                return labels, offset
+            label, offset = CypherTokenizer.matched_name(cypher, match)
+            labels.append(label)
+
+    def match_types(self, cypher: str, offset: int) -> Tuple[List[str], List[str], int]:
+        """Matches types :TYPE1|!TYPE2 at offset, which must be a colon
+
+        Returns:
+            Tuple[List[str], List[str], int]: the types, the negative types and the offset after them
+        """
+        types = []
+        negative_types = []
+        offset = self.skip_whitespaces(cypher, offset + 1)
+        while True:
+            match = CypherTokenizer.TYPE_PATTERN.match(cypher, offset)
+            name, offset = CypherTokenizer.matched_name(cypher, match)
+            if match.group("negation") is None:
+                types.append(name)
+            else:
+                negative_types.append(name)
+
+            match = CypherTokenizer.TYPE_OR_PATTERN.match(cypher, offset)
+            if match is None:
+                return types, negative_types, offset
+            offset = match.end()
+
+    @staticmethod
+    def matched_name(cypher: str, match: re.Match) -> Tuple[str, int]:
+        """The name from a match of a backtick name or a name, empty if none, and the offset after the match.
+        A name ends before the first character that is not a letter, digit or _ for the parser,
+        the offset is then the end of the name
+
+        Returns:
+            Tuple[str, int]: the name without backticks, and the offset after it
+        """
+        name = match.group("backtick_name")
+        if name is not None:
+            return name, match.end()
+        start, end = match.span("name")
+        if start == -1:
+            return "", match.end()
+        name_end = CypherTokenizer.find_end_of_name(cypher, start, end)
+        if name_end < end:
+            return cypher[start:name_end], name_end
+        return cypher[start:end], match.end()
+
+    @staticmethod
+    def find_end_of_name(cypher: str, start: int, end: int) -> int:
+        """ Returns the offset where the name from start to end ends for the parser, which starts names
+        with a letter and continues them with letters, digits and _"""
+        if cypher[start:end].isascii():
+            return end
+        for index in range(start, end):
+            char = cypher[index]
+            if char.isalpha() or (index > start and (char.isdigit() or char == "_")):
+                continue
+            return index
+        return end
@@ -1,33 +1,181 @@
-
-from core.core_classes import SchemaParser
+from core.fixer import BaseFixer
 from fixcypher_stream_method.cypher_parser_streammethod import CypherParser
-from core.schema_rules import SchemaRules
+
+
+class Fixer(BaseFixer):
+    """
+    Long lived engine that fixes relations directions for one schema.
+    The schema is looked up once in the shared schema cache and each thread reuses its own cypher parser for every query
+
+    Args:
+        schema (str): the schema to validate against
+        tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+        arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+        result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+    """
+
+    def __init__(self, schema, tokenizer=None, arrow_anchored=False, result_cache=None)->None:
+        self.tokenizer = tokenizer
+        self.arrow_anchored = arrow_anchored
+        super().__init__(schema, result_cache)
+
+    def result_options(self)->tuple:
+        """ The fixer class, the tokenizer class and arrow_anchored, as keys for result caches"""
+        tokenizer_class = type(self.tokenizer)
+        return super().result_options() + (f"{tokenizer_class.__module__}.{tokenizer_class.__qualname__}", self.arrow_anchored)
+
+    def __reduce__(self):
+        """ Pickles the fixer as its arguments, the parser is created again where it is unpickled.
+        The result cache is not pickled, it belongs to this process"""
+        return type(self), (self.schema, self.tokenizer, self.arrow_anchored)
+
+    def parser_options(self)->tuple:
+        """ The tokenizer class and arrow_anchored, the tokenizers don't keep state between cyphers"""
+        return (type(self.tokenizer), self.arrow_anchored)
+
+    def create_thread_parsers(self, parsers)->None:
+        """ Creates the cypher parser for one thread"""
+        parsers.cypher_parser = CypherParser(tokenizer=self.tokenizer, arrow_anchored=self.arrow_anchored)
+
+    @property
+    def cypher_parser(self)->CypherParser:
+        """ The cypher parser of the calling thread"""
+        return self.thread_parsers().cypher_parser
+
+    def find_triples(self, cypher):
+        """ Parses the cypher and returns the triples with prepared directions"""
+        cypher_parser = self.cypher_parser
+        cypher_parser.find_and_prepare_all_triples(cypher)
+        return cypher_parser.triples_repository.triples
+
+    def release(self)->None:
+        """ Releases the parsed cypher and triples until the next query"""
+        self.cypher_parser.reset()
+
 
 class FixDirections():
 
     @staticmethod
-    def fix_cypher_relations_directions(cypher, schema)->str:
+    def fix_cypher_relations_directions(cypher, schema, *, tokenizer=None, arrow_anchored=False, result_cache=None)->str:
         """Validates the relations directions in the cypher with the schema and outputs a fixed cypher
 
 
         Args:
             cypher (str): the cypher to be fixed
             schema (str): the schema to validate against
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
 
         Returns:
             str: the cypher with fixed relations directions
         """
+        return Fixer(schema, tokenizer=tokenizer, arrow_anchored=arrow_anchored, result_cache=result_cache).fix(cypher)
 
-        # Extract schema and variables
-        schema_parser = SchemaParser()
-        schema_list =  schema_parser.extract_schemas(schema)
-        cypher_parser = CypherParser()
-        cypher_parser.find_and_prepare_all_triples(cypher)
+    @staticmethod
+    def fix_cypher_relations_directions_patch(cypher, schema, *, tokenizer=None, arrow_anchored=False):
+        """Validates the relations directions in the cypher with the schema and outputs the characters to change,
+        apply them with SchemaRules.apply_arrow_direction_patch
 
-        for triple in cypher_parser.triples_repository.triples:
-            SchemaRules.validate_direction_change(triple, schema_list)
+        Args:
+            cypher (str): the cypher to be fixed
+            schema (str): the schema to validate against
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
 
-        query_fixed = SchemaRules.fix_all_arrow_directions_from_triples(cypher, cypher_parser.triples_repository.triples)
+        Returns:
+            Tuple[List[Tuple[int, str, str]], bool]: the patch as sorted (offset, old character, new character),
+            and if the cypher matches the schema
+        """
+        return Fixer(schema, tokenizer=tokenizer, arrow_anchored=arrow_anchored).fix_patch(cypher)
 
-        return query_fixed
+    @staticmethod
+    def needs_fix(cypher, schema, *, tokenizer=None, arrow_anchored=False):
+        """Checks if fixing the cypher with the schema would flip at least one arrow
 
+        Args:
+            cypher (str): the cypher to check
+            schema (str): the schema to validate against
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+
+        Returns:
+            bool: True if the cypher needs a fix
+        """
+        return Fixer(schema, tokenizer=tokenizer, arrow_anchored=arrow_anchored).needs_fix(cypher)
+
+    @staticmethod
+    def fix_many(cyphers, schema, *, tokenizer=None, arrow_anchored=False, result_cache=None):
+        """Fixes the relations directions of many cyphers with one schema.
+        The schema and the parser are set up once, and identical cyphers are only fixed once
+
+        Args:
+            cyphers (Iterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+
+        Returns:
+            Iterator[str]: generator of the fixed cyphers in the order of cyphers
+        """
+        return Fixer(schema, tokenizer=tokenizer, arrow_anchored=arrow_anchored, result_cache=result_cache).fix_many(cyphers)
+
+    @staticmethod
+    def fix_many_parallel(cyphers, schema, *, processes=None, chunk_size=256, tokenizer=None, arrow_anchored=False):
+        """Fixes the relations directions of many cyphers with one schema in a pool of processes.
+        Each process sets up the schema and the parser once and fixes chunks of cyphers
+
+        Args:
+            cyphers (Iterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            processes (int): the number of worker processes, None for the number of CPUs
+            chunk_size (int): the number of cyphers sent to a worker at a time
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+
+        Returns:
+            Iterator[str]: generator of the fixed cyphers in the order of cyphers
+        """
+        return Fixer.fix_many_parallel(cyphers, schema, processes=processes, chunk_size=chunk_size,
+                                      tokenizer=tokenizer, arrow_anchored=arrow_anchored)
+
+    @staticmethod
+    async def afix(cypher, schema, *, executor=None, inline_threshold=None, semaphore=None, tokenizer=None, arrow_anchored=False, result_cache=None):
+        """Validates the relations directions in the cypher with the schema without blocking the event loop.
+        Short cyphers are fixed on the event loop, longer cyphers in the executor
+
+        Args:
+            cypher (str): the cypher to be fixed
+            schema (str): the schema to validate against
+            executor (Executor): thread or process pool, None for the default executor of the loop
+            inline_threshold (int): the length from which the cypher is sent to the executor, None for the default
+            semaphore (asyncio.Semaphore): shared by callers to limit the cyphers in executors at the same time, None for no limit
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+
+        Returns:
+            str: the cypher with fixed relations directions
+        """
+        return await Fixer(schema, tokenizer=tokenizer, arrow_anchored=arrow_anchored, result_cache=result_cache).afix(cypher, executor, inline_threshold, semaphore)
+
+    @staticmethod
+    def afix_many(cyphers, schema, *, executor=None, max_in_flight=None, inline_threshold=None, tokenizer=None, arrow_anchored=False, result_cache=None):
+        """Fixes the relations directions of many cyphers with one schema without blocking the event loop.
+        At most max_in_flight cyphers are fixed at the same time
+
+        Args:
+            cyphers (Iterable[str] or AsyncIterable[str]): the cyphers to be fixed
+            schema (str): the schema to validate against
+            executor (Executor): thread or process pool, None for the default executor of the loop
+            max_in_flight (int): the number of cyphers fixed at the same time, None for the default
+            inline_threshold (int): the length from which a cypher is sent to the executor, None for the default
+            tokenizer (CypherTokenizer): regex tokenizer for the parser, None to scan one character at a time
+            arrow_anchored (bool): only parse around relation arrows instead of the whole cypher
+            result_cache (ResultCache): cache of fixed cyphers to look up before fixing, None to always fix
+
+        Returns:
+            AsyncIterator[str]: async generator of the fixed cyphers in the order of cyphers
+        """
+        return Fixer(schema, tokenizer=tokenizer, arrow_anchored=arrow_anchored, result_cache=result_cache).afix_many(cyphers, executor, max_in_flight, inline_threshold)